@@ -0,0 +1,289 @@
+# Analítica de tiempos de cocina y de servicio con NumPy: percentiles, histogramas y ventanas móviles
+# de los tiempos de preparación (por producto, categoría y hora del día) y de los tiempos de pedido a
+# entrega, a finalización y a factura. Uso: python analitica.py [días]   (por defecto 7)
+#
+# Las marcas de tiempo se leen en bloque con consultas de solo columnas (tablas de trabajo y archivadas)
+# y se resumen por día en histogramas de intervalos fijos de ANCHO_INTERVALO minutos, que se pueden
+# sumar entre días. Los días cerrados quedan en caché: un tablero repetido solo lee los días abiertos.
+# Los percentiles son el límite superior del intervalo que los contiene, como en instrumentacion.py.
+#
+# No se registra qué cocinero prepara cada línea, así que no hay desglose por cocinero.
+
+from datetime import date, datetime, time, timedelta
+import sys
+import numpy as np
+from sqlalchemy import func, select
+from models import DetalleFactura, Factura, Producto
+from repository import Repository, detalles_con_historico, pedidos_con_historico
+
+ANCHO_INTERVALO = 0.5
+MAX_MINUTOS = 240.0
+# Límites superiores de los intervalos del histograma; el último intervalo es "más de MAX_MINUTOS"
+LIMITES = np.arange(ANCHO_INTERVALO, MAX_MINUTOS + ANCHO_INTERVALO / 2, ANCHO_INTERVALO)
+INTERVALOS = len(LIMITES) + 1
+
+# Métricas y sus desgloses; "total" agrupa todas las filas
+DIMENSIONES = {
+    "preparacion": ("total", "producto", "categoria", "hora"),
+    "entrega": ("total", "hora"),
+    "finalizacion": ("total", "hora"),
+    "facturacion": ("total", "hora"),
+}
+PERCENTILES = (50, 90, 99)
+# Días recientes que no se guardan en caché: todavía pueden llegar entregas y facturas de sus pedidos
+DIAS_ABIERTOS = 1
+
+
+def _inicio(dia):
+    return datetime.combine(dia, time.min)
+
+
+def consulta_preparacion(desde, hasta):
+    # Líneas con duración registrada cuya preparación empezó en [desde, hasta)
+    detalles = detalles_con_historico()
+    return (select(detalles.c._inicio_preparacion, detalles.c._duracion_preparacion,
+                   Producto._nombre, Producto._categoria)
+            .join(Producto, detalles.c._producto_id == Producto.id)
+            .where(detalles.c._duracion_preparacion.is_not(None),
+                   detalles.c._inicio_preparacion >= desde, detalles.c._inicio_preparacion < hasta))
+
+
+def consulta_pedidos(desde, hasta):
+    # Por pedido iniciado en [desde, hasta): inicio, última línea entregada, finalización y primera factura
+    pedidos, detalles = pedidos_con_historico(), detalles_con_historico()
+    entregas = (select(detalles.c._pedido_id.label("pedido_id"),
+                       func.max(detalles.c._fin_preparacion).label("entrega"))
+                .group_by(detalles.c._pedido_id)
+                .subquery())
+    facturas = (select(DetalleFactura._pedido_id.label("pedido_id"), func.min(Factura._fecha_hora).label("factura"))
+                .join(Factura, DetalleFactura._factura_id == Factura.id)
+                .group_by(DetalleFactura._pedido_id)
+                .subquery())
+    return (select(pedidos.c._fecha_inicio, entregas.c.entrega, pedidos.c._fecha_fin, facturas.c.factura)
+            .outerjoin(entregas, entregas.c.pedido_id == pedidos.c.id)
+            .outerjoin(facturas, facturas.c.pedido_id == pedidos.c.id)
+            .where(pedidos.c._fecha_inicio >= desde, pedidos.c._fecha_inicio < hasta))
+
+
+def _fechas(valores):
+    # Lista de datetime (o None) a datetime64 en segundos; None pasa a NaT
+    return np.array(valores, dtype="datetime64[s]")
+
+
+def _minutos(desde, hasta):
+    return (hasta - desde) / np.timedelta64(60, "s")
+
+
+def _horas(fechas):
+    return ((fechas - fechas.astype("datetime64[D]")) // np.timedelta64(1, "h")).astype(np.int64)
+
+
+def resumir(dias, valores, claves):
+    # Histogramas por (día, clave) en una pasada vectorizada.
+    # Devuelve {día: (claves, conteos[clave, intervalo], sumas[clave], máximos[clave])}
+    if len(valores) == 0:
+        return {}
+    dias_unicos, indice_dia = np.unique(dias, return_inverse=True)
+    claves_unicas, indice_clave = np.unique(claves, return_inverse=True)
+    grupos = indice_dia * len(claves_unicas) + indice_clave
+    total_grupos = len(dias_unicos) * len(claves_unicas)
+    intervalos = np.searchsorted(LIMITES, valores, side="left")
+    conteos = np.bincount(grupos * INTERVALOS + intervalos, minlength=total_grupos * INTERVALOS)
+    conteos = conteos.reshape(len(dias_unicos), len(claves_unicas), INTERVALOS)
+    sumas = np.bincount(grupos, weights=valores, minlength=total_grupos).reshape(len(dias_unicos), -1)
+    maximos = np.full(total_grupos, -np.inf)
+    np.maximum.at(maximos, grupos, valores)
+    maximos = maximos.reshape(len(dias_unicos), -1)
+    resumen = {}
+    for i, dia in enumerate(dias_unicos.astype("datetime64[D]").tolist()):
+        presentes = conteos[i].sum(axis=1) > 0
+        resumen[dia] = (claves_unicas[presentes], conteos[i][presentes], sumas[i][presentes], maximos[i][presentes])
+    return resumen
+
+
+def percentiles_histograma(conteos, percentiles=PERCENTILES, maximos=None):
+    # conteos[..., intervalo] -> valores[..., percentil]; el intervalo abierto devuelve el máximo
+    acumulados = np.cumsum(conteos, axis=-1)
+    totales = acumulados[..., -1:]
+    resultado = []
+    for p in percentiles:
+        indices = np.argmax(acumulados >= np.maximum(totales * p / 100.0, 1), axis=-1)
+        valores = np.append(LIMITES, MAX_MINUTOS)[indices]
+        if maximos is not None:
+            valores = np.where(indices == len(LIMITES), maximos, valores)
+        resultado.append(np.where(totales[..., 0] > 0, valores, np.nan))
+    return np.stack(resultado, axis=-1)
+
+
+class AnaliticaTiempos:
+    def __init__(self, repo: Repository):
+        self.repo = repo
+        # {(métrica, dimensión): {día: resumen de resumir()}} de los días cerrados
+        self._cache = {(metrica, dimension): {} for metrica, dimensiones in DIMENSIONES.items()
+                       for dimension in dimensiones}
+        # {métrica: días cerrados ya leídos}, con o sin filas
+        self._dias_leidos = {metrica: set() for metrica in DIMENSIONES}
+        self.filas_leidas = 0
+
+    def invalidar(self):
+        for dias in (*self._cache.values(), *self._dias_leidos.values()):
+            dias.clear()
+
+    # --- Carga por bloques ---
+
+    def _leer(self, consulta):
+        filas = self.repo.session_lectura.execute(consulta).all()
+        self.filas_leidas += len(filas)
+        return list(zip(*filas)) if filas else None
+
+    def _resumenes_preparacion(self, desde, hasta):
+        columnas = self._leer(consulta_preparacion(_inicio(desde), _inicio(hasta)))
+        if columnas is None:
+            return {dimension: {} for dimension in DIMENSIONES["preparacion"]}
+        inicios = _fechas(columnas[0])
+        valores = np.array(columnas[1], dtype=float)
+        dias = inicios.astype("datetime64[D]")
+        claves = {"total": np.zeros(len(valores), dtype=np.int64), "producto": np.array(columnas[2], dtype=str),
+                  "categoria": np.array(columnas[3], dtype=str), "hora": _horas(inicios)}
+        return {dimension: resumir(dias, valores, claves[dimension]) for dimension in DIMENSIONES["preparacion"]}
+
+    def _resumenes_pedidos(self, desde, hasta):
+        metricas = ("entrega", "finalizacion", "facturacion")
+        columnas = self._leer(consulta_pedidos(_inicio(desde), _inicio(hasta)))
+        if columnas is None:
+            return {metrica: {dimension: {} for dimension in DIMENSIONES[metrica]} for metrica in metricas}
+        inicios = _fechas(columnas[0])
+        resumenes = {}
+        for metrica, fin in zip(metricas, columnas[1:]):
+            minutos = _minutos(inicios, _fechas(fin))
+            validos = ~np.isnan(minutos)
+            claves = {"total": np.zeros(validos.sum(), dtype=np.int64), "hora": _horas(inicios[validos])}
+            dias = inicios[validos].astype("datetime64[D]")
+            resumenes[metrica] = {dimension: resumir(dias, minutos[validos], claves[dimension])
+                                  for dimension in DIMENSIONES[metrica]}
+        return resumenes
+
+    def _cargar(self, metrica, desde, hasta, hoy):
+        # Resúmenes diarios de [desde, hasta]: de la caché los días cerrados y de la base el resto, con
+        # una consulta por rango de días faltantes. La consulta de pedidos llena las tres métricas de pedido.
+        cerrado = hoy - timedelta(days=DIAS_ABIERTOS)
+        dias = [desde + timedelta(days=n) for n in range((hasta - desde).days + 1)]
+        faltantes = [dia for dia in dias if dia not in self._dias_leidos[metrica]]
+        leidos = {}
+        if faltantes:
+            inicio, fin = min(faltantes), max(faltantes) + timedelta(days=1)
+            if metrica == "preparacion":
+                leidos = {"preparacion": self._resumenes_preparacion(inicio, fin)}
+            else:
+                leidos = self._resumenes_pedidos(inicio, fin)
+            for metrica_leida, dimensiones in leidos.items():
+                for dimension, resumen in dimensiones.items():
+                    for dia, valores in resumen.items():
+                        if dia < cerrado:
+                            self._cache[(metrica_leida, dimension)][dia] = valores
+                self._dias_leidos[metrica_leida].update(dia for dia in faltantes if dia < cerrado)
+        resultado = {}
+        for dimension in DIMENSIONES[metrica]:
+            cache = self._cache[(metrica, dimension)]
+            por_dia = {dia: cache[dia] for dia in dias if dia in cache}
+            por_dia.update({dia: valores for dia, valores in leidos.get(metrica, {}).get(dimension, {}).items()
+                            if desde <= dia <= hasta})
+            resultado[dimension] = por_dia
+        return resultado
+
+    def _acumulado(self, por_dia):
+        # Suma de los resúmenes diarios por clave: (claves, conteos, sumas, máximos)
+        conteos, sumas, maximos = {}, {}, {}
+        for claves, c, s, m in por_dia.values():
+            for i, clave in enumerate(claves.tolist()):
+                if clave in conteos:
+                    conteos[clave] = conteos[clave] + c[i]
+                    sumas[clave] += s[i]
+                    maximos[clave] = max(maximos[clave], m[i])
+                else:
+                    conteos[clave], sumas[clave], maximos[clave] = c[i].copy(), s[i], m[i]
+        claves = sorted(conteos)
+        if not claves:
+            return [], np.zeros((0, INTERVALOS), dtype=np.int64), np.zeros(0), np.zeros(0)
+        return (claves, np.array([conteos[c] for c in claves]), np.array([sumas[c] for c in claves]),
+                np.array([maximos[c] for c in claves]))
+
+    # --- Consultas ---
+
+    def percentiles(self, metrica, dimension="total", desde=None, hasta=None, percentiles=PERCENTILES, hoy=None):
+        # {clave: {"lineas" o "pedidos": n, "medio": minutos, "p50": ..., "max": ...}}; por defecto los últimos 7 días
+        hoy = hoy or date.today()
+        hasta = hasta or hoy
+        desde = desde or hasta - timedelta(days=6)
+        claves, conteos, sumas, maximos = self._acumulado(self._cargar(metrica, desde, hasta, hoy)[dimension])
+        totales = conteos.sum(axis=1)
+        valores = percentiles_histograma(conteos, percentiles, maximos)
+        return {("total" if dimension == "total" else clave): {
+                    "n": int(totales[i]), "medio": float(sumas[i] / totales[i]),
+                    **{f"p{p}": float(valores[i, j]) for j, p in enumerate(percentiles)},
+                    "max": float(maximos[i])}
+                for i, clave in enumerate(claves)}
+
+    def histograma(self, metrica, dimension="total", clave=None, desde=None, hasta=None, hoy=None):
+        # (límites superiores, conteos) del rango; el último conteo es el de más de MAX_MINUTOS
+        hoy = hoy or date.today()
+        hasta = hasta or hoy
+        desde = desde or hasta - timedelta(days=6)
+        claves, conteos, _, _ = self._acumulado(self._cargar(metrica, desde, hasta, hoy)[dimension])
+        if dimension == "total" or clave is None:
+            return LIMITES, conteos.sum(axis=0) if len(claves) else np.zeros(INTERVALOS, dtype=np.int64)
+        return LIMITES, conteos[claves.index(clave)] if clave in claves else np.zeros(INTERVALOS, dtype=np.int64)
+
+    def ventana_movil(self, metrica, dias=7, desde=None, hasta=None, percentil=90, dimension="total", clave=0,
+                      hoy=None):
+        # [(día, n, medio, percentil)] de cada día del rango sobre los "dias" días que terminan en él
+        hoy = hoy or date.today()
+        hasta = hasta or hoy
+        desde = desde or hasta - timedelta(days=29)
+        primero = desde - timedelta(days=dias - 1)
+        por_dia = self._cargar(metrica, primero, hasta, hoy)[dimension]
+        fechas = [primero + timedelta(days=n) for n in range((hasta - primero).days + 1)]
+        conteos = np.zeros((len(fechas), INTERVALOS), dtype=np.int64)
+        sumas = np.zeros(len(fechas))
+        for i, dia in enumerate(fechas):
+            if dia in por_dia:
+                claves, c, s, _ = por_dia[dia]
+                posicion = np.flatnonzero(claves == clave)
+                if len(posicion):
+                    conteos[i], sumas[i] = c[posicion[0]], s[posicion[0]]
+        acumulados = np.cumsum(np.vstack([np.zeros((1, INTERVALOS), dtype=np.int64), conteos]), axis=0)
+        ventanas = acumulados[dias:] - acumulados[:-dias]
+        sumas_acumuladas = np.concatenate([[0.0], np.cumsum(sumas)])
+        sumas_ventana = sumas_acumuladas[dias:] - sumas_acumuladas[:-dias]
+        totales = ventanas.sum(axis=1)
+        valores = percentiles_histograma(ventanas, (percentil,))[:, 0]
+        return [(fechas[dias - 1 + i], int(totales[i]),
+                 float(sumas_ventana[i] / totales[i]) if totales[i] else float("nan"), float(valores[i]))
+                for i in range(len(ventanas))]
+
+    def tablero(self, desde=None, hasta=None, hoy=None):
+        # Todas las métricas y desgloses del rango
+        return {metrica: {dimension: self.percentiles(metrica, dimension, desde, hasta, hoy=hoy)
+                          for dimension in dimensiones}
+                for metrica, dimensiones in DIMENSIONES.items()}
+
+
+def imprimir_tablero(tablero):
+    nombres = {"preparacion": "Preparación por línea", "entrega": "Pedido a entrega",
+               "finalizacion": "Pedido a finalización", "facturacion": "Pedido a factura"}
+    for metrica, dimensiones in tablero.items():
+        print(f"\n=== {nombres[metrica]} (minutos) ===")
+        print("{:<12s} {:<32s} {:>7s} {:>7s} {:>7s} {:>7s} {:>7s} {:>7s}".format(
+            "Desglose", "Clave", "N", "Medio", "p50", "p90", "p99", "Máx"))
+        for dimension, filas in dimensiones.items():
+            for clave, fila in filas.items():
+                print("{:<12s} {:<32s} {:>7d} {:>7.1f} {:>7.1f} {:>7.1f} {:>7.1f} {:>7.1f}".format(
+                    dimension, str(clave)[:32], fila["n"], fila["medio"], fila["p50"], fila["p90"], fila["p99"],
+                    fila["max"]))
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    dias = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    with SessionLocal() as session:
+        imprimir_tablero(AnaliticaTiempos(Repository(session)).tablero(date.today() - timedelta(days=dias - 1)))
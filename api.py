@@ -0,0 +1,314 @@
+# API HTTP/JSON sobre los servicios del restaurante para varias terminales a la vez.
+# Uso: python api.py [puerto]
+#
+# Cada petición abre su propia sesión del pool compartido del engine y la cierra al terminar.
+# Con RESTAURANTE_DB_URL_LECTURA definida, /mesas y /cola se leen de esa réplica.
+# Los empleados se identifican con un token (cabecera "Authorization: Bearer <token>")
+# obtenido en POST /login, en lugar del singleton SesionUsuario del menú de consola.
+#
+#   POST /login                      {"codigo": "M001", "clave": "1234"}
+#   POST /logout
+#   GET  /mesas
+#   GET  /cola?mesa=&categoria=&despues_de=&limite=
+#   POST /pedidos                    {"mesa": 3, "productos": [[1, 2], [5, 1]]}
+#   POST /pedidos/<id>/estado        {"estado": "En preparación"}
+#   POST /detalles/<id>/estado       {"estado": "Entregado", "unidades": 2}   (unidades opcional)
+#   POST /detalles/estado            {"estado": "En preparación", "mesa": 3, "producto": 5, "categoria": "Pizzas"}
+#                                    (cambio masivo; "pedido", "mesa", "producto" y "categoria" se combinan)
+#   POST /mesas/<numero>/factura
+#   GET  /eventos                    flujo text/event-stream con los cambios de pedidos y mesas
+#   GET  /metricas                   tiempos, sentencias SQL y operaciones lentas por ruta y servicio
+#                                    (con RESTAURANTE_UMBRAL_LENTO_MS definida; ver instrumentacion.py)
+
+import json
+import re
+import secrets
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from models import Empleado, Mesa
+from repository import Repository
+from services import PedidoService, FacturaService
+from catalogo import ProductCatalog
+from database import SessionLectura, SessionLocal, crear_esquema, obtener_engine
+from estados import EstadoPedido
+from eventos import BusEventos, bus_eventos, evento_a_dict
+from instrumentacion import activar_desde_entorno, instrumentacion
+
+
+class ErrorAPI(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+class SesionesEmpleado:
+    # Tokens de sesión en memoria; cada terminal o cliente tiene el suyo
+    def __init__(self, duracion=8 * 3600):
+        self.duracion = duracion
+        self._bloqueo = threading.Lock()
+        self._tokens = {}
+
+    def iniciar(self, empleado):
+        token = secrets.token_urlsafe(24)
+        with self._bloqueo:
+            self._tokens[token] = (empleado.id, time.monotonic() + self.duracion)
+        return token
+
+    def empleado_id(self, token):
+        with self._bloqueo:
+            sesion = self._tokens.get(token)
+            if sesion is None:
+                return None
+            empleado_id, expira = sesion
+            if time.monotonic() > expira:
+                del self._tokens[token]
+                return None
+            return empleado_id
+
+    def cerrar(self, token):
+        with self._bloqueo:
+            self._tokens.pop(token, None)
+
+
+def _pedido_json(pedido):
+    # pedido: PedidoCola (lecturas.py)
+    return {
+        "id": pedido.id,
+        "mesa": pedido.mesa,
+        "estado": pedido.estado.etiqueta,
+        "mesero": pedido.mesero,
+        "detalles": [{"id": d.id, "producto": d.producto, "cantidad": d.cantidad, "estado": d.estado.etiqueta,
+                      "unidades": d.unidades_por_estado()}
+                     for d in pedido.detalles],
+    }
+
+
+def _entero(valor, nombre):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ErrorAPI(400, f"'{nombre}' debe ser un número entero.")
+
+
+def _estado(valor):
+    # Etiqueta de estado del cuerpo JSON ("En preparación", "Entregado", ...)
+    estado = EstadoPedido.desde(valor) if isinstance(valor, str) else None
+    if estado is None:
+        raise ErrorAPI(400, f"Estado desconocido: {valor!r}.")
+    return estado
+
+
+class RestauranteAPI:
+    def __init__(self, sesiones=SessionLocal, catalogo: ProductCatalog = None, bus: BusEventos = None,
+                 sesiones_lectura=None):
+        # sesiones_lectura: fábrica de sesiones de la réplica (puede devolver None si no hay réplica)
+        self.sesiones = sesiones
+        self.sesiones_lectura = sesiones_lectura
+        self.catalogo = catalogo or ProductCatalog(sesiones=sesiones)
+        self.bus = bus or bus_eventos
+        self.empleados = SesionesEmpleado()
+        self._rutas = [
+            ("POST", re.compile(r"/login"), self.login, False),
+            ("POST", re.compile(r"/logout"), self.logout, True),
+            ("GET", re.compile(r"/mesas"), self.ver_mesas, True),
+            ("GET", re.compile(r"/cola"), self.ver_cola, True),
+            ("POST", re.compile(r"/pedidos"), self.tomar_pedido, True),
+            ("POST", re.compile(r"/pedidos/(\d+)/estado"), self.cambiar_estado_pedido, True),
+            ("POST", re.compile(r"/detalles/(\d+)/estado"), self.cambiar_estado_detalle, True),
+            ("POST", re.compile(r"/detalles/estado"), self.avanzar_detalles, True),
+            ("POST", re.compile(r"/mesas/(\d+)/factura"), self.facturar_mesa, True),
+            ("GET", re.compile(r"/metricas"), self.ver_metricas, True),
+        ]
+
+    def despachar(self, metodo, url, token=None, cuerpo=None):
+        # Devuelve (código HTTP, respuesta JSON); cada petición usa su propia sesión
+        ruta = urlparse(url)
+        for metodo_ruta, patron, manejador, requiere_login in self._rutas:
+            coincidencia = patron.fullmatch(ruta.path)
+            if metodo_ruta != metodo or not coincidencia:
+                continue
+            session = self.sesiones()
+            session_lectura = self.sesiones_lectura() if self.sesiones_lectura else None
+            try:
+                peticion = {
+                    "repo": Repository(session, session_lectura),
+                    "token": token,
+                    "cuerpo": cuerpo or {},
+                    "consulta": {k: v[-1] for k, v in parse_qs(ruta.query).items()},
+                }
+                if requiere_login:
+                    peticion["empleado_id"] = self.empleados.empleado_id(token)
+                    if peticion["empleado_id"] is None:
+                        raise ErrorAPI(401, "Sesión no iniciada o expirada.")
+                with instrumentacion.medir(f"api.{manejador.__name__}"):
+                    return 200, manejador(peticion, *coincidencia.groups())
+            except ErrorAPI as e:
+                return e.estado, {"error": str(e)}
+            except ValueError as e:
+                return 400, {"error": str(e)}
+            except Exception:
+                # Un fallo inesperado (p. ej. de la base) no debe cortar la conexión sin respuesta
+                traceback.print_exc()
+                return 500, {"error": "Error interno del servidor."}
+            finally:
+                session.close()
+                if session_lectura is not None:
+                    session_lectura.close()
+        return 404, {"error": f"Ruta no encontrada: {metodo} {ruta.path}"}
+
+    def login(self, peticion):
+        cuerpo = peticion["cuerpo"]
+        empleado = peticion["repo"].get_by_codigo(Empleado, cuerpo.get("codigo"))
+        if not empleado or not empleado._verificar_clave(cuerpo.get("clave")):
+            raise ErrorAPI(401, "Credenciales incorrectas.")
+        return {"token": self.empleados.iniciar(empleado), "nombre": empleado.nombre, "rol": empleado.rol}
+
+    def logout(self, peticion):
+        self.empleados.cerrar(peticion["token"])
+        return {"ok": True}
+
+    def ver_mesas(self, peticion):
+        return [{"numero": numero, "estado": estado} for numero, estado in
+                peticion["repo"].iter_all(Mesa, columnas=(Mesa._numero, Mesa._estado), orden=Mesa._numero)]
+
+    def ver_cola(self, peticion):
+        consulta = peticion["consulta"]
+        pedidos = peticion["repo"].get_cola_lectura(
+            mesa_numero=_entero(consulta["mesa"], "mesa") if "mesa" in consulta else None,
+            categoria=consulta.get("categoria"),
+            despues_de_id=_entero(consulta["despues_de"], "despues_de") if "despues_de" in consulta else None,
+            limite=_entero(consulta.get("limite", 50), "limite"))
+        return [_pedido_json(pedido) for pedido in pedidos]
+
+    def tomar_pedido(self, peticion):
+        cuerpo = peticion["cuerpo"]
+        lineas = cuerpo.get("productos", [])
+        if not isinstance(lineas, list) or not all(isinstance(l, list) and len(l) == 2 for l in lineas):
+            raise ErrorAPI(400, "'productos' debe ser una lista de pares [producto, cantidad].")
+        productos = [(_entero(prod_id, "producto"), _entero(cantidad, "cantidad")) for prod_id, cantidad in lineas]
+        if not productos:
+            raise ErrorAPI(400, "No se seleccionaron productos.")
+        service = PedidoService(peticion["repo"], self.catalogo, self.bus)
+        pedido = service.crear_pedido(_entero(cuerpo.get("mesa"), "mesa"), peticion["empleado_id"], productos)
+        return {"pedido_id": pedido.id}
+
+    def cambiar_estado_pedido(self, peticion, pedido_id):
+        service = PedidoService(peticion["repo"], self.catalogo, self.bus)
+        service.cambiar_estado(int(pedido_id), _estado(peticion["cuerpo"].get("estado")))
+        return {"ok": True}
+
+    def cambiar_estado_detalle(self, peticion, detalle_id):
+        service = PedidoService(peticion["repo"], self.catalogo, self.bus)
+        unidades = peticion["cuerpo"].get("unidades")
+        service.cambiar_estado_detalle(int(detalle_id), _estado(peticion["cuerpo"].get("estado")),
+                                       _entero(unidades, "unidades") if unidades is not None else None)
+        return {"ok": True}
+
+    def avanzar_detalles(self, peticion):
+        cuerpo = peticion["cuerpo"]
+        filtros = {clave: _entero(cuerpo[campo], campo) if campo in cuerpo else None
+                   for clave, campo in (("pedido_id", "pedido"), ("mesa_numero", "mesa"), ("producto_id", "producto"))}
+        service = PedidoService(peticion["repo"], self.catalogo, self.bus)
+        detalles = service.avanzar_detalles(_estado(cuerpo.get("estado")), categoria=cuerpo.get("categoria"), **filtros)
+        return {"detalles": detalles}
+
+    def facturar_mesa(self, peticion, mesa_numero):
+        factura = FacturaService(peticion["repo"], self.bus).facturar_mesa(int(mesa_numero))
+        return {"factura_id": factura.id, "total": factura._total}
+
+    def ver_metricas(self, peticion):
+        return instrumentacion.snapshot()
+
+
+class _ManejadorHTTP(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Conexiones persistentes entre peticiones del mismo cliente
+    disable_nagle_algorithm = True  # Cabeceras y cuerpo salen en escrituras separadas
+
+    def _atender(self, metodo):
+        token = None
+        autorizacion = self.headers.get("Authorization", "")
+        if autorizacion.startswith("Bearer "):
+            token = autorizacion[len("Bearer "):]
+        ruta = urlparse(self.path)
+        if metodo == "GET" and ruta.path == "/eventos":
+            # EventSource del navegador no envía cabeceras: se acepta también ?token=
+            self._transmitir_eventos(token or parse_qs(ruta.query).get("token", [None])[-1])
+            return
+        cuerpo = None
+        longitud = int(self.headers.get("Content-Length") or 0)
+        if longitud:
+            try:
+                cuerpo = json.loads(self.rfile.read(longitud))
+            except ValueError:
+                self._responder(400, {"error": "Cuerpo JSON inválido."})
+                return
+            if not isinstance(cuerpo, dict):
+                self._responder(400, {"error": "El cuerpo debe ser un objeto JSON."})
+                return
+        self._responder(*self.server.api.despachar(metodo, self.path, token, cuerpo))
+
+    def _responder(self, estado, datos):
+        contenido = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(contenido)))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    def _transmitir_eventos(self, token, latido=15.0):
+        # Server-Sent Events: las pantallas reciben cada cambio confirmado en lugar de releer las tablas
+        api = self.server.api
+        if api.empleados.empleado_id(token) is None:
+            self._responder(401, {"error": "Sesión no iniciada o expirada."})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        with api.bus.suscribir() as suscripcion:
+            try:
+                while True:
+                    evento = suscripcion.obtener(timeout=latido)
+                    if evento is None:
+                        self.wfile.write(b": latido\n\n")
+                    else:
+                        datos = json.dumps(evento_a_dict(evento), ensure_ascii=False)
+                        self.wfile.write(f"event: {type(evento).__name__}\ndata: {datos}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        self.close_connection = True
+
+    def do_GET(self):
+        self._atender("GET")
+
+    def do_POST(self):
+        self._atender("POST")
+
+    def log_message(self, formato, *args):
+        pass
+
+
+def crear_servidor(api: RestauranteAPI, host="127.0.0.1", puerto=8000):
+    # Un hilo por conexión; las conexiones a la base las limita el pool del engine
+    servidor = ThreadingHTTPServer((host, puerto), _ManejadorHTTP)
+    servidor.daemon_threads = True
+    servidor.api = api
+    return servidor
+
+
+if __name__ == "__main__":
+    from menu import cargar_datos_iniciales
+    crear_esquema(obtener_engine())
+    activar_desde_entorno(obtener_engine())
+    session = SessionLocal()
+    cargar_datos_iniciales(Repository(session))
+    session.close()
+    puerto = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    servidor = crear_servidor(RestauranteAPI(sesiones_lectura=SessionLectura), puerto=puerto)
+    print(f"API del restaurante escuchando en http://127.0.0.1:{puerto}")
+    servidor.serve_forever()
@@ -0,0 +1,64 @@
+# Archivo de pedidos facturados: los pedidos "Facturado" más antiguos que una antigüedad dada pasan,
+# con sus detalles, a pedidos_historico y detalles_pedido_historico, para que las tablas de trabajo
+# solo tengan el turno en curso. Uso: python archivo.py [horas]   (por defecto 12)
+#
+# Se mueve por lotes, cada uno en su propia transacción (INSERT ... SELECT y DELETE), así un archivo
+# grande no bloquea las tablas de trabajo mucho tiempo. Los ids se conservan; los reportes leen ambas
+# tablas con pedidos_con_historico() y detalles_con_historico() de repository.py.
+
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, select
+from database import crear_engine, crear_esquema
+from estados import EstadoPedido
+from models import DetallePedido, Pedido, detalles_pedido_historico, pedidos_historico
+
+ANTIGUEDAD_POR_DEFECTO = timedelta(hours=12)
+
+
+def consulta_pedidos_por_archivar(limite_fecha, tamano_lote):
+    # El pedido más nuevo y el dueño del detalle más nuevo nunca se archivan: SQLite asigna
+    # max(id) + 1 a las filas nuevas y volvería a usar ids ya archivados
+    pedidos, detalles = Pedido.__table__, DetallePedido.__table__
+    ultimo_pedido = select(func.max(pedidos.c.id)).scalar_subquery()
+    dueno_ultimo_detalle = (select(detalles.c._pedido_id)
+                            .where(detalles.c.id == select(func.max(detalles.c.id)).scalar_subquery())
+                            .scalar_subquery())
+    return (select(pedidos.c.id)
+            .where(pedidos.c._estado == EstadoPedido.FACTURADO,
+                   func.coalesce(pedidos.c._fecha_fin, pedidos.c._fecha_inicio) < limite_fecha,
+                   pedidos.c.id < ultimo_pedido,
+                   pedidos.c.id != func.coalesce(dueno_ultimo_detalle, 0))
+            .order_by(pedidos.c.id)
+            .limit(tamano_lote))
+
+
+def _mover(conexion, origen, destino, condicion):
+    conexion.execute(insert(destino).from_select(
+        [c.name for c in origen.columns], select(*origen.columns).where(condicion)))
+    return conexion.execute(delete(origen).where(condicion)).rowcount
+
+
+def archivar_pedidos(engine, antiguedad=ANTIGUEDAD_POR_DEFECTO, tamano_lote=500, ahora=None):
+    # Devuelve (pedidos, detalles) archivados
+    limite_fecha = (ahora or datetime.now()) - antiguedad
+    pedidos, detalles = Pedido.__table__, DetallePedido.__table__
+    total_pedidos = total_detalles = 0
+    while True:
+        with engine.begin() as conexion:
+            ids = conexion.execute(consulta_pedidos_por_archivar(limite_fecha, tamano_lote)).scalars().all()
+            if not ids:
+                break
+            total_detalles += _mover(conexion, detalles, detalles_pedido_historico, detalles.c._pedido_id.in_(ids))
+            total_pedidos += _mover(conexion, pedidos, pedidos_historico, pedidos.c.id.in_(ids))
+        if len(ids) < tamano_lote:
+            break
+    return total_pedidos, total_detalles
+
+
+if __name__ == "__main__":
+    engine = crear_engine()
+    crear_esquema(engine)
+    horas = float(sys.argv[1]) if len(sys.argv) > 1 else ANTIGUEDAD_POR_DEFECTO.total_seconds() / 3600
+    archivados, detalles_archivados = archivar_pedidos(engine, timedelta(hours=horas))
+    print(f"{archivados} pedido(s) y {detalles_archivados} detalle(s) archivados.")
@@ -0,0 +1,364 @@
+# Benchmarks de la capa de servicios sobre una base SQLite en memoria.
+# Uso: python benchmarks.py   (termina con código 1 si alguna operación excede su presupuesto de sentencias)
+
+from contextlib import redirect_stdout
+import http.client
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event, update
+from sqlalchemy.orm import sessionmaker
+from catalogo import ProductCatalog
+from cocina import comparar_politicas
+from estados import EstadoPedido
+from eventos import BusEventos
+from models import Empleado, Pedido, DetallePedido
+from reportes import ReporteFacturacion
+from repository import Repository
+from services import PedidoService, FacturaService
+from datos_prueba import crear_base_benchmark, crear_base_historial
+
+
+# Cuenta las sentencias SQL (idas y vueltas a la base) y los commits de un engine
+class ContadorSQL:
+    def __init__(self, engine):
+        self.engine = engine
+        self.sentencias = 0
+        self.commits = 0
+
+    def _al_ejecutar(self, conn, cursor, statement, parameters, context, executemany):
+        self.sentencias += 1
+
+    def _al_confirmar(self, conn):
+        self.commits += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._al_ejecutar)
+        event.listen(self.engine, "commit", self._al_confirmar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._al_ejecutar)
+        event.remove(self.engine, "commit", self._al_confirmar)
+        return False
+
+
+class PlanesSQL:
+    # Registra las consultas ejecutadas dentro del bloque para revisar después su plan con EXPLAIN
+    def __init__(self, engine):
+        self.engine = engine
+        self.sentencias = []
+
+    def _al_ejecutar(self, conn, cursor, statement, parameters, context, executemany):
+        verbo = statement.lstrip().split(None, 1)[0].upper()
+        if not executemany and verbo in ("SELECT", "UPDATE", "DELETE"):
+            self.sentencias.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._al_ejecutar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._al_ejecutar)
+        return False
+
+    def escaneos_completos(self):
+        # [(tabla, sentencia)] de cada tabla que algún plan recorre entera:
+        # "SCAN tabla" en SQLite (con o sin índice de cobertura) y type=ALL en MySQL
+        escaneos = []
+        with self.engine.connect() as conexion:
+            for sentencia, parametros in self.sentencias:
+                if self.engine.dialect.name == "sqlite":
+                    for fila in conexion.exec_driver_sql("EXPLAIN QUERY PLAN " + sentencia, parametros):
+                        partes = fila[-1].split()
+                        if partes[0] == "SCAN" and partes[1] != "CONSTANT":
+                            escaneos.append((partes[1], sentencia))
+                else:
+                    for fila in conexion.exec_driver_sql("EXPLAIN " + sentencia, parametros).mappings():
+                        if fila["type"] == "ALL":
+                            escaneos.append((fila["table"], sentencia))
+        return escaneos
+
+
+# Máximo de sentencias SQL por operación, sin importar el historial ni el tamaño del pedido.
+# Si una operación pasa su presupuesto, lo más probable es una consulta por fila (N+1).
+PRESUPUESTOS_SQL = {
+    "crear_pedido": 4,
+    "cambiar_estado_detalle": 5,
+    "cambiar_estado": 6,  # Al finalizar, el SELECT ... FOR UPDATE y el UPDATE del resumen de la mesa
+    "avanzar_detalles": 4,
+    "cola_pedidos": 2,
+    "facturar_mesa": 7,
+    "reporte_facturacion": 4,
+}
+
+
+def _medir(engine, sesiones, operacion):
+    # Ejecuta operacion(repo) en una sesión propia, como una petición; devuelve su resultado y medidas
+    with sesiones() as session, ContadorSQL(engine) as contador, redirect_stdout(io.StringIO()):
+        inicio = time.perf_counter()
+        resultado = operacion(Repository(session))
+        duracion = time.perf_counter() - inicio
+    return resultado, {"sentencias": contador.sentencias, "commits": contador.commits, "ms": duracion * 1000}
+
+
+def _cola_como_api(repo):
+    # Lo que devuelve GET /cola: pedidos y detalles en dos consultas, sin importar el tamaño de la página
+    from api import _pedido_json
+    return [_pedido_json(pedido) for pedido in repo.get_cola_lectura()]
+
+
+def benchmark_servicios(volumenes=((7, 20, 2), (30, 100, 8)), repeticiones=5, num_mesas=20):
+    # volumenes: (días de historial, pedidos por día, ítems por pedido). Cada operación se repite
+    # sobre mesas distintas y se informa el máximo de sentencias y el tiempo medio.
+    resultados = []
+    for dias, pedidos_por_dia, items in volumenes:
+        engine = crear_base_historial(num_mesas=max(num_mesas, repeticiones), dias=dias,
+                                      pedidos_por_dia=pedidos_por_dia, items_por_pedido=items,
+                                      num_productos=max(items, 20))
+        sesiones = sessionmaker(bind=engine)
+        catalogo = ProductCatalog(sesiones=sesiones)
+        catalogo.productos()  # El catálogo se carga una vez, fuera de la medición
+        bus = BusEventos()
+        productos = [(prod_id, 2) for prod_id in range(1, items + 1)]
+        mediciones = {operacion: [] for operacion in PRESUPUESTOS_SQL}
+
+        def medir(nombre, operacion):
+            resultado, medida = _medir(engine, sesiones, operacion)
+            mediciones[nombre].append(medida)
+            return resultado
+
+        for mesa in range(1, repeticiones + 1):
+            medir("crear_pedido", lambda repo: PedidoService(repo, catalogo, bus).crear_pedido(mesa, 1, productos))
+        with sesiones() as session:
+            primeros = {p.id: p.detalles[0].id for p in Repository(session).get_cola_pedidos(limite=None)}
+        for _ in range(repeticiones):
+            medir("cola_pedidos", _cola_como_api)
+        for mesa, pedido_id in enumerate(primeros, start=1):
+            medir("cambiar_estado_detalle", lambda repo: PedidoService(repo, catalogo, bus).cambiar_estado_detalle(
+                primeros[pedido_id], EstadoPedido.EN_PREPARACION))
+            medir("avanzar_detalles", lambda repo: PedidoService(repo, catalogo, bus).avanzar_detalles(
+                EstadoPedido.EN_PREPARACION, mesa_numero=mesa))
+            medir("cambiar_estado", lambda repo: PedidoService(repo, catalogo, bus).cambiar_estado(
+                pedido_id, EstadoPedido.FINALIZADO))
+            medir("facturar_mesa", lambda repo: FacturaService(repo, bus).facturar_mesa(mesa))
+        for _ in range(repeticiones):
+            medir("reporte_facturacion", lambda repo: _reporte_completo(ReporteFacturacion(repo)))
+        engine.dispose()
+
+        for operacion, medidas in mediciones.items():
+            resultados.append({
+                "operacion": operacion,
+                "dias": dias,
+                "pedidos_por_dia": pedidos_por_dia,
+                "items": items,
+                "sentencias": max(m["sentencias"] for m in medidas),
+                "commits": max(m["commits"] for m in medidas),
+                "ms": sum(m["ms"] for m in medidas) / len(medidas),
+                "presupuesto": PRESUPUESTOS_SQL[operacion],
+            })
+    return resultados
+
+
+def _reporte_completo(reporte):
+    # Resúmenes y recorrido completo de cabeceras y detalles de todo el historial
+    filas = len(reporte.resumen_diario()) + len(reporte.resumen_por_mesero())
+    filas += sum(1 for _ in reporte.iterar_facturas()) + sum(1 for _ in reporte.iterar_detalles())
+    return filas
+
+
+def excesos_de_presupuesto(resultados):
+    # Mensajes de las operaciones que superan su presupuesto de sentencias
+    return [f"{r['operacion']} ({r['dias']} días, {r['pedidos_por_dia']} pedidos/día, {r['items']} ítems): "
+            f"{r['sentencias']} sentencias, presupuesto {r['presupuesto']}"
+            for r in resultados if r["sentencias"] > r["presupuesto"]]
+
+
+def benchmark_crear_pedido(lineas=(1, 4, 16), unidades=3):
+    engine = crear_base_benchmark(num_mesas=len(lineas), num_productos=max(lineas))
+    session = sessionmaker(bind=engine)()
+    repo = Repository(session)
+    service = PedidoService(repo)
+    mesero_id = repo.get_by_codigo(Empleado, "B001").id
+    service.catalogo.productos()  # El catálogo se carga una vez, fuera de la medición
+    resultados = []
+    for mesa_numero, num_lineas in enumerate(lineas, start=1):
+        productos = [(prod_id, unidades) for prod_id in range(1, num_lineas + 1)]
+        with ContadorSQL(engine) as contador:
+            inicio = time.perf_counter()
+            service.crear_pedido(mesa_numero, mesero_id, productos)
+            duracion = time.perf_counter() - inicio
+        resultados.append({
+            "lineas": num_lineas,
+            "unidades": num_lineas * unidades,
+            "sentencias": contador.sentencias,
+            "commits": contador.commits,
+            "ms": duracion * 1000,
+        })
+    session.close()
+    return resultados
+
+
+def _recorrer_cola(pedidos):
+    # Lo que lee la pantalla de la cola de cada pedido y detalle; con entidades, mesa, mesero y
+    # producto son relaciones ya cargadas
+    for pedido in pedidos:
+        pedido.mesa, pedido.mesero, pedido.estado
+        for detalle in pedido.detalles:
+            detalle.producto, detalle.unidades_por_estado()
+    return pedidos
+
+
+# (nombre, carga con entidades ORM, carga con modelos de lectura o columnas)
+_LECTURAS = (
+    ("cola_pedidos", lambda repo: _recorrer_cola(repo.get_cola_pedidos(limite=None)),
+     lambda repo: _recorrer_cola(repo.get_cola_lectura(limite=None))),
+    ("detalles", lambda repo: repo.get_all(DetallePedido),
+     lambda repo: list(repo.iter_all(DetallePedido, columnas=(DetallePedido.id, DetallePedido._producto_id,
+                                                              DetallePedido._cantidad, DetallePedido._estado)))),
+)
+
+
+def _medir_lectura(sesiones, carga, memoria):
+    # Tiempo (ms) o pico de memoria (bytes) de una carga en una sesión nueva; el resultado se
+    # conserva hasta el final de la medición, como en una pantalla que lo recorre
+    with sesiones() as session:
+        repo = Repository(session)
+        if memoria:
+            tracemalloc.start()
+            resultado = carga(repo)
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return pico
+        inicio = time.perf_counter()
+        resultado = carga(repo)
+        return (time.perf_counter() - inicio) * 1000
+
+
+def benchmark_lecturas(filas=10000, items_por_pedido=4, repeticiones=3):
+    # Memoria y tiempo por cada 10 000 filas de detalle: entidades ORM contra modelos de lectura
+    # (lecturas.py) y proyecciones de columnas. Los pedidos del historial se pasan a "Finalizado"
+    # para que todos entren en la cola.
+    pedidos = max(filas // items_por_pedido, 1)
+    engine = crear_base_historial(num_mesas=20, dias=1, pedidos_por_dia=pedidos, items_por_pedido=items_por_pedido)
+    with engine.begin() as conexion:
+        conexion.execute(update(Pedido).values(_estado=EstadoPedido.FINALIZADO))
+    sesiones = sessionmaker(bind=engine)
+    escala = 10000 / (pedidos * items_por_pedido)
+    resultados = []
+    for nombre, carga_orm, carga_lectura in _LECTURAS:
+        medidas = {}
+        for modelo, carga in (("orm", carga_orm), ("lectura", carga_lectura)):
+            ms = min(_medir_lectura(sesiones, carga, False) for _ in range(repeticiones))
+            memoria = _medir_lectura(sesiones, carga, True)
+            medidas[modelo] = (ms * escala, memoria * escala / 1024)
+        resultados.append({
+            "consulta": nombre,
+            "ms_orm": medidas["orm"][0],
+            "ms_lectura": medidas["lectura"][0],
+            "kb_orm": medidas["orm"][1],
+            "kb_lectura": medidas["lectura"][1],
+        })
+    engine.dispose()
+    return resultados
+
+
+def _cliente_api(puerto, mesa_numero, peticiones):
+    # Un cliente HTTP con conexión persistente: inicia sesión, toma un pedido y consulta cola y mesas
+    conexion = http.client.HTTPConnection("127.0.0.1", puerto)
+    cabeceras = {"Content-Type": "application/json"}
+
+    def pedir(metodo, ruta, cuerpo=None):
+        conexion.request(metodo, ruta, body=json.dumps(cuerpo) if cuerpo is not None else None,
+                         headers=cabeceras)
+        respuesta = conexion.getresponse()
+        datos = json.loads(respuesta.read())
+        return respuesta.status, datos
+
+    errores = 0
+    estado, datos = pedir("POST", "/login", {"codigo": "B001", "clave": "1234"})
+    cabeceras["Authorization"] = f"Bearer {datos['token']}"
+    estado, _ = pedir("POST", "/pedidos", {"mesa": mesa_numero, "productos": [[1, 2], [2, 1]]})
+    errores += estado != 200
+    for i in range(peticiones - 2):
+        estado, _ = pedir("GET", "/cola?limite=20" if i % 2 else "/mesas")
+        errores += estado != 200
+    conexion.close()
+    return errores
+
+
+def benchmark_api(clientes=(1, 8, 32), peticiones_por_cliente=50):
+    from api import RestauranteAPI, crear_servidor
+    resultados = []
+    for num_clientes in clientes:
+        # Base en archivo: cada hilo del servidor toma su propia conexión del pool
+        descriptor, ruta = tempfile.mkstemp(suffix=".db")
+        os.close(descriptor)
+        engine = crear_base_benchmark(num_mesas=num_clientes, num_productos=5, url=f"sqlite:///{ruta}")
+        servidor = crear_servidor(RestauranteAPI(sesiones=sessionmaker(bind=engine)), puerto=0)
+        hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+        hilo.start()
+        puerto = servidor.server_address[1]
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_clientes) as ejecutor:
+            errores = sum(ejecutor.map(lambda mesa: _cliente_api(puerto, mesa, peticiones_por_cliente),
+                                       range(1, num_clientes + 1)))
+        duracion = time.perf_counter() - inicio
+        servidor.shutdown()
+        servidor.server_close()
+        engine.dispose()
+        os.remove(ruta)
+        total = num_clientes * peticiones_por_cliente
+        resultados.append({
+            "clientes": num_clientes,
+            "peticiones": total,
+            "errores": errores,
+            "rps": total / duracion,
+        })
+    return resultados
+
+
+if __name__ == "__main__":
+    print("\n=== Servicios: sentencias y tiempo medio por volumen de historial ===")
+    print("{:<24s} {:>5s} {:>11s} {:>6s} {:>11s} {:>12s} {:>9s}".format(
+        "Operación", "Días", "Pedidos/día", "Ítems", "Sentencias", "Presupuesto", "ms"))
+    resultados_servicios = benchmark_servicios()
+    for r in resultados_servicios:
+        print("{:<24s} {:>5d} {:>11d} {:>6d} {:>11d} {:>12d} {:>9.2f}".format(
+            r["operacion"], r["dias"], r["pedidos_por_dia"], r["items"], r["sentencias"], r["presupuesto"], r["ms"]))
+
+    print("\n=== crear_pedido: idas y vueltas por tamaño de pedido ===")
+    print("{:>7s} {:>8s} {:>11s} {:>8s} {:>9s}".format("Líneas", "Unidades", "Sentencias", "Commits", "ms"))
+    for r in benchmark_crear_pedido():
+        print("{:>7d} {:>8d} {:>11d} {:>8d} {:>9.2f}".format(
+            r["lineas"], r["unidades"], r["sentencias"], r["commits"], r["ms"]))
+
+    print("\n=== Pantallas: entidades ORM contra modelos de lectura, por cada 10 000 detalles ===")
+    print("{:<14s} {:>9s} {:>12s} {:>9s} {:>12s}".format("Consulta", "ms ORM", "ms lectura", "KB ORM", "KB lectura"))
+    for r in benchmark_lecturas():
+        print("{:<14s} {:>9.1f} {:>12.1f} {:>9.0f} {:>12.0f}".format(
+            r["consulta"], r["ms_orm"], r["ms_lectura"], r["kb_orm"], r["kb_lectura"]))
+
+    print("\n=== Cocina: tiempo de ticket (min) con FIFO y con el planificador (simulación) ===")
+    print("{:<14s} {:>8s} {:>7s} {:>7s} {:>7s} {:>7s}".format("Política", "Medio", "p50", "p95", "p99", "Máx"))
+    for r in comparar_politicas():
+        print("{:<14s} {:>8.1f} {:>7.1f} {:>7.1f} {:>7.1f} {:>7.1f}".format(
+            r["politica"], r["ticket_medio"], r["p50"], r["p95"], r["p99"], r["max"]))
+
+    print("\n=== API HTTP: peticiones por segundo según clientes concurrentes ===")
+    print("{:>9s} {:>11s} {:>8s} {:>9s}".format("Clientes", "Peticiones", "Errores", "Pet/s"))
+    for r in benchmark_api():
+        print("{:>9d} {:>11d} {:>8d} {:>9.1f}".format(r["clientes"], r["peticiones"], r["errores"], r["rps"]))
+
+    excesos = excesos_de_presupuesto(resultados_servicios)
+    if excesos:
+        print("\nOperaciones fuera de presupuesto:")
+        for mensaje in excesos:
+            print(f"  {mensaje}")
+        sys.exit(1)
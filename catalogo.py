@@ -0,0 +1,117 @@
+from collections import namedtuple
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import Producto
+from repository import Repository
+
+# Copia inmutable de un producto: no expira con los commits de la sesión ni dispara consultas
+ProductoCatalogo = namedtuple("ProductoCatalogo", ["id", "nombre", "categoria", "precio"])
+
+# Sello de versión del catálogo en este proceso; cualquier cambio en productos lo incrementa
+_version_catalogo = 0
+
+
+def version_catalogo():
+    return _version_catalogo
+
+
+def invalidar_catalogo():
+    global _version_catalogo
+    _version_catalogo += 1
+
+
+@event.listens_for(Session, "after_flush")
+def _productos_modificados(session, flush_context):
+    # Altas, bajas o cambios de precio hechos a través de la unidad de trabajo del ORM
+    for entidad in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(entidad, Producto):
+            invalidar_catalogo()
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _productos_modificados_en_lote(orm_execute_state):
+    # INSERT/UPDATE/DELETE por lotes (bulk_add, bulk_update) que no pasan por el flush
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ is Producto:
+        invalidar_catalogo()
+
+
+class ProductCatalog:
+    def __init__(self, repo: Repository = None, max_edad=None, sesiones=None):
+        # max_edad (segundos) fuerza una recarga periódica para ver cambios hechos por otros procesos.
+        # sesiones: fábrica de sesiones para recargar en una sesión propia y corta, en lugar de la
+        # del repo; permite compartir un catálogo entre hilos que atienden peticiones distintas.
+        self.repo = repo
+        self.max_edad = max_edad
+        self.sesiones = sesiones
+        self._bloqueo = threading.Lock()
+        self._version = None
+        self._cargado_en = 0.0
+        self._por_id = {}
+        self._por_categoria = {}
+        self._texto_menu = ""
+
+    def _vigente(self):
+        if self._version != _version_catalogo:
+            return False
+        if self.max_edad is not None and time.monotonic() - self._cargado_en > self.max_edad:
+            return False
+        return True
+
+    def _cargar(self):
+        version = _version_catalogo
+        if self.sesiones is not None:
+            with self.sesiones() as session:
+                productos = self._leer_productos(Repository(session))
+        else:
+            productos = self._leer_productos(self.repo)
+        por_categoria = {}
+        for prod in productos:
+            por_categoria.setdefault(prod.categoria, []).append(prod)
+        self._por_id = {prod.id: prod for prod in productos}
+        self._por_categoria = por_categoria
+        self._texto_menu = "\n".join(
+            f"ID: {prod.id}, {prod.nombre} ({prod.categoria}) - S/. {prod.precio:.2f}" for prod in productos)
+        self._version = version
+        self._cargado_en = time.monotonic()
+
+    @staticmethod
+    def _leer_productos(repo):
+        # Del primario: los precios del catálogo se usan al tomar pedidos
+        with repo.leer_del_primario():
+            return [ProductoCatalogo(*fila) for fila in repo.iter_all(
+                Producto, columnas=(Producto.id, Producto._nombre, Producto._categoria, Producto._precio))]
+
+    def _asegurar_vigente(self):
+        if not self._vigente():
+            with self._bloqueo:
+                if not self._vigente():
+                    self._cargar()
+
+    def invalidar(self):
+        self._version = None
+
+    def get(self, prod_id):
+        self._asegurar_vigente()
+        return self._por_id.get(prod_id)
+
+    def __contains__(self, prod_id):
+        self._asegurar_vigente()
+        return prod_id in self._por_id
+
+    def productos(self):
+        self._asegurar_vigente()
+        return list(self._por_id.values())
+
+    def por_categoria(self):
+        self._asegurar_vigente()
+        return self._por_categoria
+
+    def texto_menu(self):
+        self._asegurar_vigente()
+        return self._texto_menu
@@ -0,0 +1,257 @@
+# Planificador de cocina: reparte los detalles pendientes entre estaciones según la categoría del
+# producto y ordena la cola de cada estación con un heap de prioridad. Los detalles pendientes de un
+# mismo producto se agrupan en lotes (varias pizzas iguales se hacen juntas). La prioridad de un lote
+# combina lo que lleva esperando su detalle más antiguo y los minutos de preparación esperados por
+# línea, aprendidos de las duraciones registradas (también las archivadas, ver archivo.py).
+#
+# simular_cocina compara el planificador con FIFO (el detalle más antiguo primero, de a uno) en una
+# simulación de eventos discretos, sin base de datos; benchmarks.py imprime la comparación.
+
+from collections import namedtuple
+from datetime import datetime
+import heapq
+from itertools import count
+import random
+import statistics
+from catalogo import ProductCatalog
+from estados import EstadoPedido
+
+Estacion = namedtuple("Estacion", ["nombre", "rol", "categorias"])
+
+# Estaciones del catálogo de cargar_datos_iniciales y el rol que las atiende
+ESTACIONES = (
+    Estacion("Parrilla", "Cocinero", ("Al Fuego",)),
+    Estacion("Horno", "Cocinero", ("Pizzas Roll", "Pizzas Clásicas", "Pizzas Fusión", "Lasagnas")),
+    Estacion("Cocina caliente", "Cocinero", ("Pastas", "Especialidad de la Casa")),
+    Estacion("Fríos", "Ayudante de Cocina", ("Aperitivos", "Piqueos")),
+    Estacion("Barra", "Bartender", ("Postres",)),
+)
+# Las categorías sin estación asignada van a esta
+ESTACION_POR_DEFECTO = "Cocina caliente"
+
+# Minutos de preparación por categoría del catálogo de cargar_datos_iniciales
+TIEMPOS_PREPARACION = {
+    "Al Fuego": 18,
+    "Aperitivos": 10,
+    "Postres": 6,
+    "Piqueos": 8,
+    "Pizzas Roll": 12,
+    "Pizzas Clásicas": 15,
+    "Pizzas Fusión": 16,
+    "Especialidad de la Casa": 15,
+    "Pastas": 14,
+    "Lasagnas": 20,
+}
+TIEMPO_PREPARACION_POR_DEFECTO = 12
+
+# Cada unidad extra de un lote suma esta fracción del tiempo de una línea: se preparan juntas
+FACTOR_UNIDAD_EXTRA = 0.15
+MAX_UNIDADES_LOTE = 6
+# Minutos de preparación esperados que compensa cada minuto de espera; evita que un plato largo
+# quede relegado indefinidamente detrás de los cortos
+PESO_ESPERA = 1.0
+# Líneas con duración registrada necesarias para usar la media de un producto o categoría
+MINIMO_HISTORIAL = 3
+MINUTOS_POR_DEFECTO = 12.0
+
+# espera: minutos desde que se pidió el detalle
+Pendiente = namedtuple("Pendiente", ["detalle_id", "pedido_id", "producto_id", "cantidad", "espera"])
+# espera: la del detalle más antiguo; minutos: preparación esperada del lote completo
+Lote = namedtuple("Lote", ["producto_id", "detalle_ids", "pedido_ids", "unidades", "espera", "minutos"])
+
+
+def estacion_de(categoria, estaciones=ESTACIONES):
+    for estacion in estaciones:
+        if categoria in estacion.categorias:
+            return estacion.nombre
+    nombres = [estacion.nombre for estacion in estaciones]
+    return ESTACION_POR_DEFECTO if ESTACION_POR_DEFECTO in nombres else nombres[0]
+
+
+class TiemposPreparacion:
+    # Minutos esperados por línea: la media del producto si tiene historial suficiente, si no la de
+    # su categoría y, si tampoco, MINUTOS_POR_DEFECTO
+    def __init__(self, categorias, historial=(), minimo=MINIMO_HISTORIAL, por_defecto=MINUTOS_POR_DEFECTO):
+        # categorias: {producto_id: categoría}; historial: (producto_id, líneas, minutos medios)
+        self.categorias = categorias
+        self.por_defecto = por_defecto
+        self.por_producto = {}
+        sumas = {}
+        for producto_id, lineas, media in historial:
+            if media is None:
+                continue
+            if lineas >= minimo:
+                self.por_producto[producto_id] = media
+            total, cantidad = sumas.get(categorias.get(producto_id), (0.0, 0))
+            sumas[categorias.get(producto_id)] = (total + media * lineas, cantidad + lineas)
+        self.por_categoria = {categoria: total / cantidad for categoria, (total, cantidad) in sumas.items()
+                              if cantidad >= minimo}
+
+    @classmethod
+    def desde_historial(cls, repo, categorias, **opciones):
+        return cls(categorias, repo.get_tiempos_preparacion(), **opciones)
+
+    def minutos(self, producto_id, unidades=1):
+        base = self.por_producto.get(producto_id)
+        if base is None:
+            base = self.por_categoria.get(self.categorias.get(producto_id), self.por_defecto)
+        return base * (1 + FACTOR_UNIDAD_EXTRA * (max(unidades, 1) - 1))
+
+
+def armar_lotes(pendientes, tiempos, max_unidades=MAX_UNIDADES_LOTE):
+    # pendientes: del más antiguo al más nuevo. Agrupa por producto en lotes de hasta max_unidades
+    # (una línea más grande va sola) y los devuelve en orden de prioridad: primero el de menor
+    # minutos esperados por línea - PESO_ESPERA * espera
+    grupos = {}
+    for pendiente in pendientes:
+        lotes = grupos.setdefault(pendiente.producto_id, [])
+        if not lotes or lotes[-1][0] + pendiente.cantidad > max_unidades:
+            lotes.append([0, []])
+        lotes[-1][0] += pendiente.cantidad
+        lotes[-1][1].append(pendiente)
+    heap = []
+    for producto_id, lotes in grupos.items():
+        for unidades, lineas in lotes:
+            lote = Lote(producto_id, tuple(p.detalle_id for p in lineas),
+                        tuple(sorted({p.pedido_id for p in lineas})), unidades,
+                        max(p.espera for p in lineas), tiempos.minutos(producto_id, unidades))
+            heap.append((lote.minutos / len(lineas) - PESO_ESPERA * lote.espera, lote.detalle_ids[0], lote))
+    heapq.heapify(heap)
+    return [heapq.heappop(heap)[2] for _ in range(len(heap))]
+
+
+class PlanificadorCocina:
+    def __init__(self, repo, catalogo: ProductCatalog = None, tiempos: TiemposPreparacion = None,
+                 estaciones=ESTACIONES, max_unidades=MAX_UNIDADES_LOTE):
+        # Los tiempos se aprenden del historial al crear el planificador
+        self.repo = repo
+        self.catalogo = catalogo or ProductCatalog(repo)
+        self.estaciones = {estacion.nombre: estacion for estacion in estaciones}
+        self.max_unidades = max_unidades
+        self.tiempos = tiempos or TiemposPreparacion.desde_historial(
+            repo, {producto.id: producto.categoria for producto in self.catalogo.productos()})
+
+    def estacion_de(self, categoria):
+        return estacion_de(categoria, tuple(self.estaciones.values()))
+
+    def estaciones_de_rol(self, rol):
+        return [estacion.nombre for estacion in self.estaciones.values() if estacion.rol == rol]
+
+    def cola(self, estacion, ahora=None, limite=200):
+        # Lotes de la estación en orden de prioridad, a partir de sus limite detalles pendientes más antiguos
+        ahora = ahora or datetime.now()
+        productos = [producto.id for producto in self.catalogo.productos()
+                     if self.estacion_de(producto.categoria) == estacion]
+        if not productos:
+            return []
+        pendientes = [Pendiente(fila.id, fila._pedido_id, fila._producto_id, fila._cantidad,
+                                (ahora - fila._fecha_creacion).total_seconds() / 60 if fila._fecha_creacion else 0.0)
+                      for fila in self.repo.get_detalles_pendientes(productos, limite=limite)]
+        return armar_lotes(pendientes, self.tiempos, self.max_unidades)
+
+    def siguiente(self, estacion, ahora=None):
+        lotes = self.cola(estacion, ahora)
+        return lotes[0] if lotes else None
+
+    def tomar(self, lote, pedido_service):
+        # Un solo UPDATE para todo el lote; devuelve cuántos detalles pasaron a "En preparación"
+        return pedido_service.avanzar_detalles(EstadoPedido.EN_PREPARACION, detalle_ids=lote.detalle_ids)
+
+    def entregar(self, lote, pedido_service):
+        return pedido_service.avanzar_detalles(EstadoPedido.ENTREGADO, detalle_ids=lote.detalle_ids)
+
+
+# --- Simulación: planificador contra FIFO ---
+
+def _cocina_simulada(azar, productos_por_categoria, lineas_historial):
+    # Productos con un tiempo medio real alrededor del de su categoría (TIEMPOS_PREPARACION) y los
+    # tiempos que el planificador aprende de un historial simulado de esos productos
+    reales, categorias, historial = {}, {}, []
+    for categoria, minutos in sorted(TIEMPOS_PREPARACION.items()):
+        for _ in range(productos_por_categoria):
+            producto_id = len(reales) + 1
+            reales[producto_id] = minutos * azar.uniform(0.7, 1.3)
+            categorias[producto_id] = categoria
+            historial.append((producto_id, lineas_historial, statistics.fmean(
+                reales[producto_id] * azar.lognormvariate(0, 0.25) for _ in range(lineas_historial))))
+    return reales, categorias, TiemposPreparacion(categorias, historial)
+
+
+def simular_cocina(politica="planificador", pedidos=400, minutos_entre_pedidos=6.0, cocineros=None,
+                   semilla=1, max_unidades=MAX_UNIDADES_LOTE, productos_por_categoria=3):
+    # Llegan pedidos (proceso de Poisson) de 1 a 4 líneas de 1 a 3 unidades; cada estación tiene
+    # cocineros[estación] personas y cada lote tarda su tiempo real con variación aleatoria, que el
+    # planificador no conoce. El ticket de un pedido va de su llegada a la entrega de su última línea.
+    azar = random.Random(semilla)
+    reales, categorias, tiempos = _cocina_simulada(azar, productos_por_categoria, 20)
+    estaciones = {producto_id: estacion_de(categoria) for producto_id, categoria in categorias.items()}
+    libres = dict(cocineros or {"Parrilla": 2, "Horno": 4, "Cocina caliente": 2, "Fríos": 2, "Barra": 1})
+    # Mientras un detalle está en la cola, su "espera" guarda el minuto en que llegó
+    colas = {estacion: [] for estacion in libres}
+    # (minuto, secuencia, detalles terminados o None si es una llegada, estación o (pedido, líneas))
+    eventos, secuencia = [], count()
+    llegada, restantes, tickets = {}, {}, []
+    minuto = 0.0
+    for pedido_id in range(1, pedidos + 1):
+        minuto += azar.expovariate(1 / minutos_entre_pedidos)
+        lineas = [(producto_id, azar.randint(1, 3)) for producto_id in azar.sample(sorted(reales), azar.randint(1, 4))]
+        heapq.heappush(eventos, (minuto, next(secuencia), None, (pedido_id, lineas)))
+
+    def despachar(estacion, ahora):
+        cola = colas[estacion]
+        while libres[estacion] and cola:
+            if politica == "fifo":
+                tomados = [cola[0]]
+            else:
+                lote = armar_lotes([p._replace(espera=ahora - p.espera) for p in cola], tiempos, max_unidades)[0]
+                tomados = [p for p in cola if p.detalle_id in lote.detalle_ids]
+            for pendiente in tomados:
+                cola.remove(pendiente)
+            unidades = sum(p.cantidad for p in tomados)
+            duracion = (reales[tomados[0].producto_id] * (1 + FACTOR_UNIDAD_EXTRA * (unidades - 1))
+                        * azar.lognormvariate(0, 0.25))
+            libres[estacion] -= 1
+            heapq.heappush(eventos, (ahora + duracion, next(secuencia), tomados, estacion))
+
+    detalle_id = 0
+    while eventos:
+        ahora, _, terminados, dato = heapq.heappop(eventos)
+        if terminados is None:
+            pedido_id, lineas = dato
+            llegada[pedido_id], restantes[pedido_id] = ahora, len(lineas)
+            afectadas = set()
+            for producto_id, cantidad in lineas:
+                detalle_id += 1
+                colas[estaciones[producto_id]].append(Pendiente(detalle_id, pedido_id, producto_id, cantidad, ahora))
+                afectadas.add(estaciones[producto_id])
+            for estacion in afectadas:
+                despachar(estacion, ahora)
+            continue
+        libres[dato] += 1
+        for pendiente in terminados:
+            restantes[pendiente.pedido_id] -= 1
+            if restantes[pendiente.pedido_id] == 0:
+                tickets.append(ahora - llegada[pendiente.pedido_id])
+        despachar(dato, ahora)
+    percentiles = statistics.quantiles(tickets, n=100, method="inclusive")
+    return {
+        "politica": politica,
+        "pedidos": len(tickets),
+        "ticket_medio": statistics.fmean(tickets),
+        "p50": percentiles[49],
+        "p95": percentiles[94],
+        "p99": percentiles[98],
+        "max": max(tickets),
+    }
+
+
+def comparar_politicas(semillas=(1, 2, 3), **opciones):
+    # Promedio de varias semillas de simular_cocina para FIFO y para el planificador
+    resultados = []
+    for politica in ("fifo", "planificador"):
+        corridas = [simular_cocina(politica, semilla=semilla, **opciones) for semilla in semillas]
+        resultado = {clave: statistics.fmean(c[clave] for c in corridas)
+                     for clave in ("ticket_medio", "p50", "p95", "p99", "max")}
+        resultado.update({"politica": politica, "pedidos": sum(c["pedidos"] for c in corridas)})
+        resultados.append(resultado)
+    return resultados
@@ -0,0 +1,187 @@
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from migraciones import migrar
+
+URL_POR_DEFECTO = "mysql+pymysql://root:@localhost/restaurante"
+
+# Driver asyncio usado por crear_engine_async para cada backend
+DRIVERS_ASYNC = {"mysql": "aiomysql", "sqlite": "aiosqlite"}
+
+# Variables de entorno reconocidas y el parámetro de create_engine que alimentan
+_VARIABLES_ENTORNO = {
+    "RESTAURANTE_DB_URL": ("url", str),
+    "RESTAURANTE_DB_POOL_SIZE": ("pool_size", int),
+    "RESTAURANTE_DB_MAX_OVERFLOW": ("max_overflow", int),
+    "RESTAURANTE_DB_POOL_TIMEOUT": ("pool_timeout", float),
+    "RESTAURANTE_DB_POOL_RECYCLE": ("pool_recycle", int),
+    "RESTAURANTE_DB_PRE_PING": ("pool_pre_ping", lambda v: v.strip().lower() in ("1", "true", "si", "sí", "yes")),
+    "RESTAURANTE_DB_ECHO": ("echo", lambda v: v.strip().lower() in ("1", "true", "si", "sí", "yes")),
+}
+
+# URL opcional de una réplica de solo lectura para listados y reportes (ver Repository.session_lectura)
+VARIABLE_URL_LECTURA = "RESTAURANTE_DB_URL_LECTURA"
+
+# Valores pensados para varias terminales concurrentes contra MySQL
+CONFIGURACION_POR_DEFECTO = {
+    "url": URL_POR_DEFECTO,
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30.0,
+    "pool_recycle": 1800,  # Menor que wait_timeout de MySQL para no reutilizar conexiones cerradas
+    "pool_pre_ping": True,
+    "echo": False,
+}
+
+
+def configuracion_desde_entorno(entorno=None):
+    entorno = os.environ if entorno is None else entorno
+    configuracion = dict(CONFIGURACION_POR_DEFECTO)
+    for variable, (parametro, convertir) in _VARIABLES_ENTORNO.items():
+        if entorno.get(variable):
+            configuracion[parametro] = convertir(entorno[variable])
+    return configuracion
+
+
+def url_lectura_desde_entorno(entorno=None):
+    entorno = os.environ if entorno is None else entorno
+    return entorno.get(VARIABLE_URL_LECTURA) or None
+
+
+def es_sqlite_en_memoria(url):
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _argumentos_engine(url, opciones):
+    # Los argumentos explícitos tienen prioridad sobre el entorno y este sobre los valores por defecto
+    configuracion = configuracion_desde_entorno()
+    if url is not None:
+        configuracion["url"] = url
+    configuracion.update({clave: valor for clave, valor in opciones.items() if valor is not None})
+    url = configuracion.pop("url")
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        argumentos = {"echo": configuracion["echo"],
+                      "connect_args": {"check_same_thread": False}}
+        if es_sqlite_en_memoria(url):
+            # Una sola conexión compartida: cada conexión nueva vería una base vacía
+            argumentos["poolclass"] = StaticPool
+        else:
+            argumentos.update({clave: configuracion[clave] for clave in
+                               ("pool_size", "max_overflow", "pool_timeout", "pool_pre_ping")})
+        return url, argumentos
+    return url, configuracion
+
+
+def _transacciones_sqlite(engine):
+    # pysqlite abre la transacción recién con el primer INSERT/UPDATE; un SAVEPOINT previo iniciaba
+    # su propia transacción y liberarlo confirmaba toda la unidad de trabajo. Se abre antes con BEGIN.
+    @event.listens_for(engine, "savepoint")
+    def _begin_antes_de_savepoint(conexion, nombre):
+        if not conexion.connection.driver_connection.in_transaction:
+            conexion.exec_driver_sql("BEGIN")
+
+    # SQLite ignora FOR UPDATE: una lectura con bloqueo abre la transacción con BEGIN IMMEDIATE, que
+    # toma el bloqueo de escritura de la base y hace esperar al segundo cajero como el bloqueo de fila.
+    # Va directo al driver, como el BEGIN implícito de MySQL, y no cuenta como sentencia (ContadorSQL).
+    @event.listens_for(engine, "before_execute")
+    def _begin_immediate_antes_de_bloquear(conexion, sentencia, *argumentos):
+        if (getattr(sentencia, "_for_update_arg", None) is not None
+                and not conexion.connection.driver_connection.in_transaction):
+            cursor = conexion.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.close()
+
+
+def crear_engine(url=None, **opciones):
+    url, argumentos = _argumentos_engine(url, opciones)
+    engine = create_engine(url, **argumentos)
+    if engine.dialect.name == "sqlite":
+        _transacciones_sqlite(engine)
+    return engine
+
+
+def url_async(url):
+    # Misma base con el driver asyncio del backend (pymysql -> aiomysql, pysqlite -> aiosqlite)
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in DRIVERS_ASYNC:
+        raise ValueError(f"No hay driver asyncio configurado para el backend '{backend}'.")
+    return url.set(drivername=f"{backend}+{DRIVERS_ASYNC[backend]}")
+
+
+def crear_engine_async(url=None, **opciones):
+    url, argumentos = _argumentos_engine(url, opciones)
+    engine = create_async_engine(url_async(url), **argumentos)
+    if engine.dialect.name == "sqlite":
+        _transacciones_sqlite(engine.sync_engine)
+    return engine
+
+
+def sesiones_async(engine):
+    # expire_on_commit=False: en asyncio no se puede recargar un atributo expirado de forma perezosa
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+def crear_esquema(engine):
+    # Crea las tablas que falten y aplica las migraciones pendientes (ver migraciones.py)
+    migrar(engine)
+
+
+async def crear_esquema_async(engine):
+    async with engine.begin() as conexion:
+        await conexion.run_sync(migrar)
+
+
+_engine = None
+_SessionLocal = None
+_engine_lectura = None
+_SessionLectura = None
+
+
+def obtener_engine():
+    # El engine se crea en el primer uso, no al importar los modelos
+    global _engine
+    if _engine is None:
+        _engine = crear_engine()
+    return _engine
+
+
+def obtener_engine_lectura():
+    # Engine de la réplica, o None si RESTAURANTE_DB_URL_LECTURA no está definida
+    global _engine_lectura
+    if _engine_lectura is None:
+        url = url_lectura_desde_entorno()
+        if url is not None:
+            _engine_lectura = crear_engine(url)
+    return _engine_lectura
+
+
+def configurar(engine, engine_lectura=None):
+    global _engine, _SessionLocal, _engine_lectura, _SessionLectura
+    _engine = engine
+    _SessionLocal = None
+    _engine_lectura = engine_lectura
+    _SessionLectura = None
+
+
+def SessionLocal():
+    global _SessionLocal
+    if _SessionLocal is None:
+        _SessionLocal = sessionmaker(bind=obtener_engine())
+    return _SessionLocal()
+
+
+def SessionLectura():
+    # Sesión sobre la réplica, o None si no hay réplica configurada
+    global _SessionLectura
+    if _SessionLectura is None:
+        engine = obtener_engine_lectura()
+        if engine is None:
+            return None
+        _SessionLectura = sessionmaker(bind=engine)
+    return _SessionLectura()
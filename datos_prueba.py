@@ -0,0 +1,65 @@
+# Bases SQLite con datos sintéticos, compartidas por los benchmarks y las pruebas: un mesero (B001,
+# clave 1234), mesas libres y productos "Producto i" de precio 10 + i, y opcionalmente historial facturado.
+
+from datetime import datetime, time as hora, timedelta
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+from database import crear_engine, crear_esquema
+from estados import EstadoPedido
+from models import Empleado, Mesa, Producto, Pedido, DetallePedido, Factura, DetalleFactura
+
+
+def crear_base_benchmark(num_mesas=20, num_productos=20, url="sqlite://"):
+    engine = crear_engine(url)
+    crear_esquema(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Empleado(_codigo="B001", _nombre="Mesero Benchmark", _rol="Mesero", _clave="1234"))
+    session.add_all(Mesa(_numero=i, _estado="Libre") for i in range(1, num_mesas + 1))
+    session.add_all(Producto(_nombre=f"Producto {i}", _categoria="Benchmark", _precio=10.0 + i)
+                    for i in range(1, num_productos + 1))
+    session.commit()
+    session.close()
+    return engine
+
+
+def crear_base_historial(num_mesas=20, dias=30, pedidos_por_dia=50, items_por_pedido=4, num_productos=20,
+                         url="sqlite://", tamano_lote=5000):
+    # Base de benchmark con dias de historial ya facturado: pedidos_por_dia pedidos diarios de
+    # items_por_pedido líneas, cada uno con su factura. Se inserta por lotes, sin pasar por los servicios.
+    engine = crear_base_benchmark(num_mesas, num_productos, url)
+    inicio = datetime.combine(datetime.now().date() - timedelta(days=dias), hora(12))
+    pedidos, detalles, facturas, detalles_factura = [], [], [], []
+    pedido_id = 0
+    for dia in range(dias):
+        for n in range(pedidos_por_dia):
+            pedido_id += 1
+            fecha = inicio + timedelta(days=dia, minutes=n * 600 // max(pedidos_por_dia, 1))
+            mesa_id = pedido_id % num_mesas + 1
+            pedidos.append({"id": pedido_id, "_mesa_id": mesa_id, "_mesero_id": 1,
+                            "_estado": EstadoPedido.FACTURADO, "_fecha_inicio": fecha,
+                            "_fecha_fin": fecha + timedelta(minutes=40)})
+            total = 0.0
+            for item in range(items_por_pedido):
+                producto_id = (pedido_id + item) % num_productos + 1
+                cantidad = item % 3 + 1
+                precio = 10.0 + producto_id
+                total += cantidad * precio
+                detalles.append({"_pedido_id": pedido_id, "_producto_id": producto_id,
+                                 "_estado": EstadoPedido.FINALIZADO, "_cantidad": cantidad,
+                                 "_unidades_preparacion": cantidad, "_unidades_entregadas": cantidad,
+                                 "_unidades_finalizadas": cantidad, "_fecha_creacion": fecha,
+                                 "_inicio_preparacion": fecha + timedelta(minutes=5),
+                                 "_fin_preparacion": fecha + timedelta(minutes=20),
+                                 "_duracion_preparacion": 15.0,
+                                 "_fin_finalizacion": fecha + timedelta(minutes=40)})
+                detalles_factura.append({"_factura_id": pedido_id, "_pedido_id": pedido_id,
+                                         "_producto_id": producto_id, "_cantidad": cantidad,
+                                         "_precio_unitario": precio, "_subtotal": cantidad * precio})
+            facturas.append({"id": pedido_id, "_mesa_id": mesa_id, "_mesero_id": 1,
+                             "_fecha_hora": fecha + timedelta(minutes=45), "_total": total})
+    with engine.begin() as conexion:
+        for modelo, filas in ((Pedido, pedidos), (DetallePedido, detalles),
+                              (Factura, facturas), (DetalleFactura, detalles_factura)):
+            for desde in range(0, len(filas), tamano_lote):
+                conexion.execute(insert(modelo), filas[desde:desde + tamano_lote])
+    return engine
@@ -0,0 +1,217 @@
+import enum
+from datetime import datetime
+from sqlalchemy import DateTime, Float, SmallInteger, and_, case, func, literal
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import TypeDecorator
+
+# Máquina de estados única para pedidos y detalles de pedido.
+# El estado se guarda como un entero pequeño (ColumnaEstado) y las transiciones se consultan
+# en una tabla precalculada indexada por código, sin listas ni comparaciones de texto.
+
+
+class EstadoPedido(enum.IntEnum):
+    PEDIDO_REALIZADO = 0
+    EN_PREPARACION = 1
+    ENTREGADO = 2
+    FINALIZADO = 3
+    FACTURADO = 4
+
+    @property
+    def etiqueta(self):
+        return _ETIQUETAS[self]
+
+    @classmethod
+    def desde(cls, valor):
+        # Acepta un miembro, su código o su etiqueta; None si no corresponde a ningún estado
+        if isinstance(valor, cls):
+            return valor
+        if isinstance(valor, str):
+            return _POR_ETIQUETA.get(valor)
+        if isinstance(valor, int) and 0 <= valor < len(_ETIQUETAS):
+            return cls(valor)
+        return None
+
+    # Se muestra con su etiqueta para que la interfaz y los mensajes sigan en texto. Se compara solo
+    # como entero: las etiquetas se convierten con desde() al entrar (menú, API, servicios).
+    def __str__(self):
+        return self.etiqueta
+
+    def __format__(self, especificacion):
+        return format(self.etiqueta, especificacion)
+
+
+_ETIQUETAS = {
+    EstadoPedido.PEDIDO_REALIZADO: "Pedido realizado",
+    EstadoPedido.EN_PREPARACION: "En preparación",
+    EstadoPedido.ENTREGADO: "Entregado",
+    EstadoPedido.FINALIZADO: "Finalizado",
+    EstadoPedido.FACTURADO: "Facturado",
+}
+_POR_ETIQUETA = {etiqueta: estado for estado, etiqueta in _ETIQUETAS.items()}
+
+# Estados que recorren los detalles en cocina; "Facturado" es solo del pedido
+ESTADOS_DETALLE = (EstadoPedido.PEDIDO_REALIZADO, EstadoPedido.EN_PREPARACION,
+                   EstadoPedido.ENTREGADO, EstadoPedido.FINALIZADO)
+
+
+class ColumnaEstado(TypeDecorator):
+    # SMALLINT en la base; al escribir o filtrar acepta miembros, códigos o etiquetas
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, valor, dialect):
+        if valor is None:
+            return None
+        estado = EstadoPedido.desde(valor)
+        if estado is None:
+            raise ValueError(f"Estado desconocido: {valor!r}")
+        return int(estado)
+
+    def process_result_value(self, valor, dialect):
+        return None if valor is None else EstadoPedido(int(valor))
+
+
+class MaquinaEstados:
+    def __init__(self, transiciones, atributo="_estado"):
+        # transiciones: {origen: destinos permitidos}; se compilan en una tabla origen x destino
+        n = len(EstadoPedido)
+        self.estados = tuple(sorted(transiciones))
+        self.atributo = atributo
+        self._tabla = tuple(tuple(destino in transiciones.get(origen, ()) for destino in EstadoPedido)
+                            for origen in EstadoPedido)
+        self._siguiente = tuple(min(transiciones[origen]) if transiciones.get(origen) else None
+                                for origen in EstadoPedido)
+        self._origenes = tuple(tuple(o for o in EstadoPedido if self._tabla[o][d]) for d in range(n))
+        self._al_pasar = tuple([] for _ in range(n))
+        self._al_pasar_sql = tuple([] for _ in range(n))
+
+    def permite(self, origen, destino):
+        origen, destino = EstadoPedido.desde(origen), EstadoPedido.desde(destino)
+        return origen is not None and destino is not None and self._tabla[origen][destino]
+
+    def siguiente(self, estado):
+        estado = EstadoPedido.desde(estado)
+        return None if estado is None else self._siguiente[estado]
+
+    def origenes(self, destino):
+        # Estados desde los que se puede llegar a destino, para filtrar UPDATE masivos
+        return self._origenes[EstadoPedido.desde(destino)]
+
+    def al_pasar(self, estado):
+        # Decorador: funcion(entidad, ahora) se ejecuta cuando la entidad llega a estado o lo salta
+        def registrar(funcion):
+            self._al_pasar[estado].append(funcion)
+            return funcion
+        return registrar
+
+    def al_pasar_sql(self, estado):
+        # Decorador: funcion(modelo, ahora) -> {columna: expresión} para los UPDATE masivos.
+        # Las expresiones no conocen el estado de origen de cada fila, así que deben ser idempotentes.
+        def registrar(funcion):
+            self._al_pasar_sql[estado].append(funcion)
+            return funcion
+        return registrar
+
+    def valores_sql(self, modelo, destino, ahora):
+        # SET de un UPDATE que lleva filas de cualquier origen permitido hasta destino
+        destino = EstadoPedido.desde(destino)
+        valores = {}
+        for estado in range(self.estados[0] + 1, destino + 1):
+            for funcion in self._al_pasar_sql[estado]:
+                valores.update(funcion(modelo, literal(ahora, DateTime)))
+        valores[self.atributo] = destino
+        return valores
+
+    def avanzar(self, entidad, destino, ahora=None):
+        # Devuelve True si la transición está permitida y se aplicó
+        destino = EstadoPedido.desde(destino)
+        origen = EstadoPedido.desde(getattr(entidad, self.atributo))
+        if origen is None:
+            origen = self.estados[0]  # Entidad aún sin guardar: toma el estado inicial
+        if destino is None or not self._tabla[origen][destino]:
+            return False
+        ahora = ahora or datetime.now()
+        for estado in range(origen + 1, destino + 1):
+            for funcion in self._al_pasar[estado]:
+                funcion(entidad, ahora)
+        setattr(entidad, self.atributo, destino)
+        return True
+
+
+class minutos_entre(FunctionElement):
+    # Minutos entre dos fechas calculados en la base; cada dialecto tiene su propia aritmética
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(minutos_entre)
+def _minutos_entre(elemento, compilador, **kw):
+    inicio, fin = (compilador.process(argumento, **kw) for argumento in elemento.clauses)
+    return f"(EXTRACT(EPOCH FROM ({fin} - {inicio})) / 60.0)"
+
+
+@compiles(minutos_entre, "sqlite")
+def _minutos_entre_sqlite(elemento, compilador, **kw):
+    inicio, fin = (compilador.process(argumento, **kw) for argumento in elemento.clauses)
+    return f"((julianday({fin}) - julianday({inicio})) * 1440.0)"
+
+
+@compiles(minutos_entre, "mysql")
+def _minutos_entre_mysql(elemento, compilador, **kw):
+    inicio, fin = (compilador.process(argumento, **kw) for argumento in elemento.clauses)
+    return f"(TIMESTAMPDIFF(MICROSECOND, {inicio}, {fin}) / 60000000.0)"
+
+
+def _hacia_adelante(estados):
+    return {origen: frozenset(d for d in estados if d > origen) for origen in estados}
+
+
+# Solo se avanza; a "Facturado" se llega únicamente desde "Finalizado"
+MAQUINA_PEDIDO = MaquinaEstados({
+    **_hacia_adelante(ESTADOS_DETALLE),
+    EstadoPedido.FINALIZADO: frozenset({EstadoPedido.FACTURADO}),
+    EstadoPedido.FACTURADO: frozenset(),
+})
+MAQUINA_DETALLE = MaquinaEstados(_hacia_adelante(ESTADOS_DETALLE))
+
+
+@MAQUINA_PEDIDO.al_pasar(EstadoPedido.FINALIZADO)
+def _fin_pedido(pedido, ahora):
+    pedido._fecha_fin = ahora
+
+
+@MAQUINA_PEDIDO.al_pasar_sql(EstadoPedido.FINALIZADO)
+def _fin_pedido_sql(modelo, ahora):
+    return {"_fecha_fin": ahora}
+
+
+@MAQUINA_DETALLE.al_pasar(EstadoPedido.ENTREGADO)
+def _fin_preparacion(detalle, ahora):
+    if detalle._inicio_preparacion and not detalle._fin_preparacion:
+        detalle._fin_preparacion = ahora
+        diff = detalle._fin_preparacion - detalle._inicio_preparacion
+        detalle._duracion_preparacion = diff.total_seconds() / 60.0
+
+
+@MAQUINA_DETALLE.al_pasar_sql(EstadoPedido.ENTREGADO)
+def _fin_preparacion_sql(modelo, ahora):
+    # La guarda usa _duracion_preparacion y no _fin_preparacion: MySQL evalúa el SET de izquierda
+    # a derecha y la duración vería el fin ya actualizado. Ambas se escriben siempre juntas.
+    pendiente = and_(modelo._inicio_preparacion.is_not(None), modelo._duracion_preparacion.is_(None))
+    return {
+        "_fin_preparacion": case((pendiente, ahora), else_=modelo._fin_preparacion),
+        "_duracion_preparacion": case((pendiente, minutos_entre(modelo._inicio_preparacion, ahora)),
+                                      else_=modelo._duracion_preparacion),
+    }
+
+
+@MAQUINA_DETALLE.al_pasar(EstadoPedido.FINALIZADO)
+def _fin_detalle(detalle, ahora):
+    if not detalle._fin_finalizacion:
+        detalle._fin_finalizacion = ahora
+
+
+@MAQUINA_DETALLE.al_pasar_sql(EstadoPedido.FINALIZADO)
+def _fin_detalle_sql(modelo, ahora):
+    return {"_fin_finalizacion": func.coalesce(modelo._fin_finalizacion, ahora)}
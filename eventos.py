@@ -0,0 +1,134 @@
+from collections import namedtuple
+import queue
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from estados import EstadoPedido
+
+# Eventos de cambio publicados por los servicios; inmutables y sin referencias a la sesión
+PedidoCreado = namedtuple("PedidoCreado", ["pedido_id", "mesa_numero", "mesero_id", "unidades"])
+PedidoCambiado = namedtuple("PedidoCambiado", ["pedido_id", "estado"])
+# unidades: {estado: unidades de la línea en ese estado}
+DetalleCambiado = namedtuple("DetalleCambiado", ["detalle_id", "pedido_id", "estado", "unidades"])
+# Cambio masivo: todos los detalle_ids pasaron completos a estado
+DetallesAvanzados = namedtuple("DetallesAvanzados", ["estado", "detalle_ids", "pedido_ids"])
+MesaCambiada = namedtuple("MesaCambiada", ["mesa_numero", "estado"])
+MesaFacturada = namedtuple("MesaFacturada", ["mesa_numero", "factura_id", "total"])
+# Estado y resumen de pedidos sin facturar de una mesa tras un cambio (valores finales, no variaciones);
+# version: Mesa._version_resumen escrita con ellos, para ordenar eventos y descartar los ya leídos
+ResumenMesaCambiado = namedtuple("ResumenMesaCambiado", ["mesa_id", "version", "estado", "pedidos_abiertos",
+                                                         "pedidos_finalizados", "importe_abierto"])
+
+
+def evento_a_dict(evento):
+    # Los estados de pedido viajan como su etiqueta, no como el código entero
+    return {"tipo": type(evento).__name__,
+            **{campo: valor.etiqueta if isinstance(valor, EstadoPedido) else valor
+               for campo, valor in evento._asdict().items()}}
+
+
+class Suscripcion:
+    def __init__(self, bus, tipos=None, capacidad=256):
+        self._bus = bus
+        self._cola = queue.Queue(maxsize=capacidad)
+        self.tipos = tuple(tipos) if tipos else None
+        self.perdidos = 0
+
+    def _entregar(self, evento):
+        if self.tipos and not isinstance(evento, self.tipos):
+            return
+        # Cola llena: se descarta el evento más antiguo; un suscriptor lento nunca frena a los servicios
+        while True:
+            try:
+                self._cola.put_nowait(evento)
+                return
+            except queue.Full:
+                try:
+                    self._cola.get_nowait()
+                    self.perdidos += 1
+                except queue.Empty:
+                    pass
+
+    def obtener(self, timeout=None):
+        try:
+            return self._cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def pendientes(self):
+        eventos = []
+        while True:
+            try:
+                eventos.append(self._cola.get_nowait())
+            except queue.Empty:
+                return eventos
+
+    def cerrar(self):
+        self._bus._quitar(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+        return False
+
+
+class BusEventos:
+    def __init__(self):
+        self._bloqueo = threading.Lock()
+        self._suscripciones = ()
+
+    def suscribir(self, tipos=None, capacidad=256):
+        suscripcion = Suscripcion(self, tipos, capacidad)
+        with self._bloqueo:
+            self._suscripciones = self._suscripciones + (suscripcion,)
+        return suscripcion
+
+    def _quitar(self, suscripcion):
+        with self._bloqueo:
+            self._suscripciones = tuple(s for s in self._suscripciones if s is not suscripcion)
+
+    def publicar(self, *eventos):
+        for suscripcion in self._suscripciones:
+            for evento in eventos:
+                suscripcion._entregar(evento)
+
+    def publicar_al_confirmar(self, session, *eventos):
+        # Los eventos se entregan solo si la transacción se confirma; un rollback los descarta
+        session.info.setdefault("eventos_pendientes", []).extend((self, evento) for evento in eventos)
+
+
+# Bus del proceso usado por defecto por los servicios
+bus_eventos = BusEventos()
+
+
+# Los savepoints también disparan after_commit/after_rollback: se guarda cuántos eventos había
+# al abrir cada uno para descartar solo los suyos si se deshace, y se publica al confirmar el más externo.
+
+@event.listens_for(Session, "after_transaction_create")
+def _marcar_savepoint(session, transaction):
+    if transaction.nested:
+        marcas = session.info.setdefault("marcas_eventos", [])
+        marcas.append(len(session.info.get("eventos_pendientes", ())))
+
+
+@event.listens_for(Session, "after_commit")
+def _publicar_pendientes(session):
+    if session.in_nested_transaction():
+        if session.info.get("marcas_eventos"):
+            session.info["marcas_eventos"].pop()
+        return
+    for bus, evento in session.info.pop("eventos_pendientes", ()):
+        bus.publicar(evento)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_pendientes(session):
+    if session.in_nested_transaction():
+        if session.info.get("marcas_eventos"):
+            marca = session.info["marcas_eventos"].pop()
+            del session.info.get("eventos_pendientes", [])[marca:]
+        return
+    session.info.pop("eventos_pendientes", None)
+    session.info.pop("marcas_eventos", None)
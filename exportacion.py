@@ -0,0 +1,190 @@
+import csv
+import json
+import os
+import time
+from repository import Repository
+from reportes import ReporteFacturacion
+
+# Exportación de la facturación por flujo: las filas pasan de la base al archivo por lotes,
+# sin listas ni DataFrames intermedios, así que la memoria no depende del número de filas.
+# openpyxl (XLSX) y pyarrow (Parquet) se importan solo al usar ese formato.
+
+COLUMNAS_CABECERA = [("Factura ID", "int64"), ("Mesa", "int64"), ("Mesero", "string"),
+                     ("Fecha", "string"), ("Hora", "string"), ("Total", "float64")]
+COLUMNAS_DETALLE = [("Factura ID", "int64"), ("Producto", "string"), ("Cantidad", "int64"),
+                    ("Precio Unitario", "float64"), ("Subtotal", "float64")]
+
+FORMATOS = ("xlsx", "csv", "parquet")
+
+# El id de una factura se asigna al insertarla pero solo se ve al confirmar: la de un cajero más lento
+# puede aparecer después de exportar ids mayores. Los ids que faltaban entre los últimos
+# VENTANA_PENDIENTES se vuelven a buscar en las exportaciones incrementales siguientes durante
+# ESPERA_PENDIENTES segundos; después se dan por descartados (transacción deshecha).
+VENTANA_PENDIENTES = 1000
+ESPERA_PENDIENTES = 3600
+
+
+def _filas_cabecera(facturas):
+    for f in facturas:
+        yield (f.factura_id, f.mesa, f.mesero, f"{f.fecha_hora:%Y-%m-%d}", f"{f.fecha_hora:%H:%M}", f.total)
+
+
+def _anotar_ids(facturas, exportadas, desde_id, pendientes):
+    # Guarda en exportadas los ids de la ventana de pendientes que pasan por el flujo
+    for f in facturas:
+        if f.factura_id > desde_id or f.factura_id in pendientes:
+            exportadas.add(f.factura_id)
+        yield f
+
+
+def _filas_detalle(detalles):
+    for d in detalles:
+        yield (d.factura_id, d.producto, d.cantidad, d.precio_unitario, d.subtotal)
+
+
+class _EscritorXLSX:
+    # Modo write-only: cada fila se vuelca a disco al agregarla en lugar de quedar en el libro
+    def __init__(self, ruta, tamano_lote):
+        from openpyxl import Workbook
+        self.ruta = ruta
+        self.libro = Workbook(write_only=True)
+
+    def hoja(self, nombre, columnas, filas):
+        hoja = self.libro.create_sheet(nombre)
+        hoja.append([columna for columna, _ in columnas])
+        total = 0
+        for fila in filas:
+            hoja.append(fila)
+            total += 1
+        return total
+
+    def cerrar(self):
+        self.libro.save(self.ruta)
+        return [self.ruta]
+
+
+class _EscritorCSV:
+    # Un archivo por hoja: <base>_cabecera.csv y <base>_detalle.csv
+    def __init__(self, ruta, tamano_lote):
+        self.base = os.path.splitext(ruta)[0]
+        self.rutas = []
+
+    def hoja(self, nombre, columnas, filas):
+        ruta = f"{self.base}_{nombre.lower()}.csv"
+        total = 0
+        with open(ruta, "w", newline="", encoding="utf-8") as archivo:
+            escritor = csv.writer(archivo)
+            escritor.writerow([columna for columna, _ in columnas])
+            for fila in filas:
+                escritor.writerow(fila)
+                total += 1
+        self.rutas.append(ruta)
+        return total
+
+    def cerrar(self):
+        return self.rutas
+
+
+class _EscritorParquet:
+    # Un archivo por hoja, escrito en grupos de filas de tamano_lote
+    def __init__(self, ruta, tamano_lote):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.base = os.path.splitext(ruta)[0]
+        self.tamano_lote = tamano_lote
+        self.rutas = []
+
+    def _escribir_lote(self, escritor, esquema, lote):
+        columnas = list(zip(*lote))
+        escritor.write_batch(self.pa.record_batch(
+            [self.pa.array(valores, type=campo.type) for valores, campo in zip(columnas, esquema)],
+            schema=esquema))
+
+    def hoja(self, nombre, columnas, filas):
+        ruta = f"{self.base}_{nombre.lower()}.parquet"
+        esquema = self.pa.schema([(columna, self.pa.type_for_alias(tipo)) for columna, tipo in columnas])
+        total = 0
+        with self.pq.ParquetWriter(ruta, esquema) as escritor:
+            lote = []
+            for fila in filas:
+                lote.append(fila)
+                if len(lote) == self.tamano_lote:
+                    self._escribir_lote(escritor, esquema, lote)
+                    total += len(lote)
+                    lote = []
+            if lote:
+                self._escribir_lote(escritor, esquema, lote)
+                total += len(lote)
+        self.rutas.append(ruta)
+        return total
+
+    def cerrar(self):
+        return self.rutas
+
+
+_ESCRITORES = {"xlsx": _EscritorXLSX, "csv": _EscritorCSV, "parquet": _EscritorParquet}
+
+
+def _leer_estado(ruta_estado):
+    if not os.path.exists(ruta_estado):
+        return {}
+    with open(ruta_estado, encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+
+def _guardar_estado(ruta_estado, estado):
+    temporal = f"{ruta_estado}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump(estado, archivo)
+    os.replace(temporal, ruta_estado)
+
+
+def exportar_facturacion(repo: Repository, ruta, formato=None, desde=None, hasta=None,
+                         incremental=False, ruta_estado="exportacion_facturacion.json", tamano_lote=1000):
+    # incremental=True exporta solo las facturas que la última exportación con el mismo ruta_estado no
+    # incluyó; el estado se actualiza únicamente si la exportación termina bien. No admite rango de
+    # fechas: las facturas fuera del rango quedarían detrás del id guardado y no se exportarían nunca.
+    formato = (formato or os.path.splitext(ruta)[1].lstrip(".")).lower()
+    if formato not in _ESCRITORES:
+        raise ValueError(f"Formato '{formato}' no soportado; use uno de: {', '.join(FORMATOS)}.")
+    if incremental and (desde is not None or hasta is not None):
+        raise ValueError("La exportación incremental no admite rango de fechas.")
+    reporte = ReporteFacturacion(repo, tamano_lote)
+    estado = _leer_estado(ruta_estado) if incremental else {}
+    despues_de_id = estado.get("ultima_factura_id") if incremental else None
+    ahora = time.time()
+    pendientes = {int(factura_id): visto for factura_id, visto in estado.get("pendientes", {}).items()
+                  if ahora - visto < ESPERA_PENDIENTES}
+    # Tope de ids leído en la misma sesión que las hojas: con REPEATABLE READ todo sale de una sola
+    # foto, y cabecera y detalle cubren exactamente las mismas facturas
+    hasta_id = reporte.ultima_factura_id()
+    desde_ventana = max(despues_de_id or 0, hasta_id - VENTANA_PENDIENTES)
+    exportadas = set()
+
+    inicio = time.perf_counter()
+    escritor = _ESCRITORES[formato](ruta, tamano_lote)
+    facturas = escritor.hoja("Cabecera", COLUMNAS_CABECERA, _filas_cabecera(_anotar_ids(
+        reporte.iterar_facturas(desde, hasta, despues_de_id, hasta_id, pendientes),
+        exportadas, desde_ventana, pendientes)))
+    detalles = escritor.hoja("Detalle", COLUMNAS_DETALLE, _filas_detalle(
+        reporte.iterar_detalles(desde, hasta, despues_de_id, hasta_id, pendientes)))
+    archivos = escritor.cerrar()
+    segundos = time.perf_counter() - inicio
+
+    if incremental:
+        # Pendientes: los que siguen sin verse y los ids nuevos de la ventana que no aparecieron
+        pendientes = {factura_id: visto for factura_id, visto in pendientes.items() if factura_id not in exportadas}
+        pendientes.update((factura_id, ahora) for factura_id in range(desde_ventana + 1, hasta_id + 1)
+                          if factura_id not in exportadas)
+        _guardar_estado(ruta_estado, {"ultima_factura_id": hasta_id,
+                                      "pendientes": {str(factura_id): visto
+                                                     for factura_id, visto in sorted(pendientes.items())}})
+    return {
+        "archivos": archivos,
+        "facturas": facturas,
+        "detalles": detalles,
+        "segundos": segundos,
+        "filas_por_segundo": (facturas + detalles) / segundos if segundos else 0.0,
+    }
@@ -0,0 +1,131 @@
+from collections import namedtuple
+import threading
+import time
+from sqlalchemy import select
+from models import Mesa
+from eventos import BusEventos, bus_eventos, ResumenMesaCambiado
+
+# Índice en memoria del estado de las mesas para las pantallas de sala y de facturación.
+# Se carga con una consulta a las columnas de resumen de mesas (sin recorrer el historial de pedidos)
+# y luego se actualiza con los eventos del bus; las consultas no acceden a la base.
+# Los servicios mantienen esas columnas en la misma transacción que cada alta, cambio o factura.
+#
+# Los eventos se publican después del commit, así que uno puede llegar cuando su cambio ya está en lo
+# leído, o después de un evento más nuevo de la misma mesa. Cada evento lleva los valores finales y la
+# versión del resumen de la mesa: solo se aplica si es más nuevo que lo que el índice ya tiene.
+
+ResumenMesa = namedtuple("ResumenMesa", ["id", "numero", "estado", "pedidos_abiertos",
+                                         "pedidos_finalizados", "importe_abierto"])
+
+
+class IndiceMesas:
+    def __init__(self, repo=None, sesiones=None, bus: BusEventos = None, max_edad=None):
+        # Igual que ProductCatalog: repo o una fábrica de sesiones para cargar, y max_edad (segundos)
+        # para recargar periódicamente y ver los cambios hechos por otros procesos
+        self.repo = repo
+        self.sesiones = sesiones
+        self.max_edad = max_edad
+        self._bloqueo = threading.Lock()
+        self._suscripcion = (bus or bus_eventos).suscribir(tipos=(ResumenMesaCambiado,), capacidad=4096)
+        self._perdidos = 0
+        self._cargado_en = None
+        self._por_id = {}
+        self._versiones = {}
+        self._id_por_numero = {}
+        self._libres = set()
+        self._ocupadas = set()
+        self._finalizados = {}
+
+    def _leer(self, session):
+        # (resumen, versión) de cada mesa
+        consulta = select(Mesa.id, Mesa._numero, Mesa._estado, Mesa._pedidos_abiertos, Mesa._pedidos_finalizados,
+                          Mesa._importe_abierto, Mesa._version_resumen).order_by(Mesa._numero)
+        return [(ResumenMesa(*fila[:-1]), fila[-1]) for fila in session.execute(consulta)]
+
+    def _cargar(self):
+        # Los eventos ya en cola son de transacciones confirmadas, incluidas en lo que se lee; los que
+        # lleguen después pueden estarlo o no, y _aplicar los filtra por versión
+        self._suscripcion.pendientes()
+        self._perdidos = self._suscripcion.perdidos
+        if self.sesiones is not None:
+            with self.sesiones() as session:
+                mesas = self._leer(session)
+        else:
+            mesas = self._leer(self.repo.session)
+        self._por_id, self._versiones, self._id_por_numero = {}, {}, {}
+        self._libres, self._ocupadas, self._finalizados = set(), set(), {}
+        for mesa, version in mesas:
+            self._guardar(mesa, version)
+        self._cargado_en = time.monotonic()
+
+    def _guardar(self, mesa, version):
+        self._por_id[mesa.id] = mesa
+        self._versiones[mesa.id] = version
+        self._id_por_numero[mesa.numero] = mesa.id
+        (self._ocupadas if mesa.estado == "Ocupada" else self._libres).add(mesa.numero)
+        (self._libres if mesa.estado == "Ocupada" else self._ocupadas).discard(mesa.numero)
+        if mesa.pedidos_finalizados > 0:
+            self._finalizados[mesa.numero] = mesa.pedidos_finalizados
+        else:
+            self._finalizados.pop(mesa.numero, None)
+
+    def _aplicar(self, evento):
+        # Devuelve False si el evento nombra una mesa desconocida (alta posterior a la carga).
+        # Un evento con versión no mayor que la guardada ya está en lo leído o es de un cambio anterior
+        mesa = self._por_id.get(evento.mesa_id)
+        if mesa is None:
+            return False
+        if evento.version > self._versiones[mesa.id]:
+            self._guardar(mesa._replace(estado=evento.estado, pedidos_abiertos=evento.pedidos_abiertos,
+                                        pedidos_finalizados=evento.pedidos_finalizados,
+                                        importe_abierto=evento.importe_abierto), evento.version)
+        return True
+
+    def _sincronizar(self):
+        # Aplica los eventos recibidos desde la última consulta; si se perdieron eventos por cola
+        # llena, hay una mesa desconocida o venció max_edad, vuelve a cargar desde la base.
+        # Se llama con _bloqueo tomado, y las copias que devuelven las consultas se arman sin soltarlo:
+        # otro hilo puede estar aplicando eventos sobre los mismos conjuntos.
+        vencido = (self._cargado_en is None or self._suscripcion.perdidos != self._perdidos or
+                   self.max_edad is not None and time.monotonic() - self._cargado_en > self.max_edad)
+        if not vencido:
+            vencido = not all([self._aplicar(evento) for evento in self._suscripcion.pendientes()])
+        if vencido:
+            self._cargar()
+
+    def recargar(self):
+        with self._bloqueo:
+            self._cargar()
+
+    def cerrar(self):
+        self._suscripcion.cerrar()
+
+    def libres(self):
+        with self._bloqueo:
+            self._sincronizar()
+            return sorted(self._libres)
+
+    def ocupadas(self):
+        with self._bloqueo:
+            self._sincronizar()
+            return sorted(self._ocupadas)
+
+    def con_finalizados(self):
+        # {número de mesa: pedidos finalizados por facturar}, solo mesas con alguno
+        with self._bloqueo:
+            self._sincronizar()
+            return dict(sorted(self._finalizados.items()))
+
+    def resumen(self, mesa_numero):
+        with self._bloqueo:
+            self._sincronizar()
+            return self._por_id.get(self._id_por_numero.get(mesa_numero))
+
+    def importe_abierto(self, mesa_numero):
+        mesa = self.resumen(mesa_numero)
+        return mesa.importe_abierto if mesa else 0.0
+
+    def mesas(self):
+        with self._bloqueo:
+            self._sincronizar()
+            return sorted(self._por_id.values(), key=lambda mesa: mesa.numero)
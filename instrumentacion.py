@@ -0,0 +1,274 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+import functools
+import logging
+import os
+import threading
+import time
+import weakref
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Instrumentación de operaciones: tiempo total, sentencias SQL, filas leídas y tiempo de commit por
+# llamada, con histogramas de latencia en memoria y un registro de operaciones lentas con su SQL.
+# Inactiva hasta llamar a activar(engine); mientras tanto los métodos decorados con @medido solo
+# pagan una comprobación. Uso: instrumentacion.activar(engine, umbral_lento_ms=200)
+#
+# Las filas se cuentan sobre el resultado de cada SELECT ejecutado por una Session (do_orm_execute), sin
+# tocar el cursor DBAPI. Las consultas por flujo (yield_per, stream_results) no se cuentan: contarlas
+# obligaría a leerlas enteras en memoria.
+
+# Límites superiores (ms) de los intervalos del histograma; el último intervalo es "más de 5000"
+LIMITES_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+registro_lentas = logging.getLogger("restaurante.lentas")
+
+# Mediciones abiertas en el hilo o tarea actual; las anidadas suman también a las externas
+_activas = ContextVar("mediciones_activas", default=())
+
+
+class _Medicion:
+    def __init__(self, nombre, max_sql):
+        self.nombre = nombre
+        self.max_sql = max_sql
+        self.sentencias = 0
+        self.filas = 0
+        self.commit_ms = 0.0
+        self.sql = []
+        self.inicio_commit = None
+
+
+class _Estadistica:
+    def __init__(self):
+        self.llamadas = 0
+        self.errores = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.sentencias = 0
+        self.max_sentencias = 0
+        self.filas = 0
+        self.commit_ms = 0.0
+        self.histograma = [0] * (len(LIMITES_MS) + 1)
+
+    def agregar(self, ms, medicion, error):
+        self.llamadas += 1
+        self.errores += error
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.sentencias += medicion.sentencias
+        self.max_sentencias = max(self.max_sentencias, medicion.sentencias)
+        self.filas += medicion.filas
+        self.commit_ms += medicion.commit_ms
+        self.histograma[bisect_left(LIMITES_MS, ms)] += 1
+
+    def percentil(self, p):
+        # Límite superior del intervalo que contiene el percentil p (aproximación del histograma)
+        objetivo = self.llamadas * p / 100.0
+        acumulado = 0
+        for indice, cuenta in enumerate(self.histograma):
+            acumulado += cuenta
+            if cuenta and acumulado >= objetivo:
+                return float(LIMITES_MS[indice]) if indice < len(LIMITES_MS) else self.max_ms
+        return 0.0
+
+    def resumen(self):
+        llamadas = self.llamadas or 1
+        etiquetas = [f"<={limite}ms" for limite in LIMITES_MS] + [f">{LIMITES_MS[-1]}ms"]
+        return {
+            "llamadas": self.llamadas,
+            "errores": self.errores,
+            "ms_medio": self.total_ms / llamadas,
+            "ms_max": self.max_ms,
+            "p50_ms": self.percentil(50),
+            "p95_ms": self.percentil(95),
+            "p99_ms": self.percentil(99),
+            "sentencias_media": self.sentencias / llamadas,
+            "sentencias_max": self.max_sentencias,
+            "filas_media": self.filas / llamadas,
+            "commit_ms_medio": self.commit_ms / llamadas,
+            "histograma": dict(zip(etiquetas, self.histograma)),
+        }
+
+
+class Instrumentacion:
+    def __init__(self, umbral_lento_ms=250.0, max_lentas=100, max_sql=50):
+        # umbral_lento_ms: a partir de cuánto una llamada va al registro de lentas;
+        # max_lentas: cuántas se conservan en memoria; max_sql: sentencias guardadas por llamada lenta
+        self.umbral_lento_ms = umbral_lento_ms
+        self.max_sql = max_sql
+        self.activa = False
+        self._bloqueo = threading.Lock()
+        self._estadisticas = {}
+        self._lentas = deque(maxlen=max_lentas)
+        # Engines instrumentados; WeakSet para no retenerlos ni confundir uno nuevo con uno ya liberado
+        self._engines = weakref.WeakSet()
+
+    def _eventos_engine(self):
+        return (("before_cursor_execute", self._antes_de_sentencia),
+                ("after_cursor_execute", self._despues_de_sentencia),
+                ("commit", self._antes_de_commit))
+
+    def _eventos_session(self):
+        return (("after_commit", self._despues_de_commit),
+                ("do_orm_execute", self._al_ejecutar_en_session))
+
+    def activar(self, engine=None, umbral_lento_ms=None, max_lentas=None):
+        # Se puede llamar varias veces, una por engine; cada engine se instrumenta una sola vez
+        with self._bloqueo:
+            if umbral_lento_ms is not None:
+                self.umbral_lento_ms = umbral_lento_ms
+            if max_lentas is not None:
+                self._lentas = deque(self._lentas, maxlen=max_lentas)
+            if engine is not None and engine not in self._engines:
+                self._engines.add(engine)
+                for nombre, funcion in self._eventos_engine():
+                    event.listen(engine, nombre, funcion)
+            for nombre, funcion in self._eventos_session():
+                if not event.contains(Session, nombre, funcion):
+                    event.listen(Session, nombre, funcion)
+            self.activa = True
+
+    def desactivar(self):
+        # Quita los listeners de todos los engines y de Session; activar() los vuelve a poner
+        with self._bloqueo:
+            self.activa = False
+            for engine in list(self._engines):
+                for nombre, funcion in self._eventos_engine():
+                    if event.contains(engine, nombre, funcion):
+                        event.remove(engine, nombre, funcion)
+            self._engines.clear()
+            for nombre, funcion in self._eventos_session():
+                if event.contains(Session, nombre, funcion):
+                    event.remove(Session, nombre, funcion)
+
+    def reiniciar(self):
+        with self._bloqueo:
+            self._estadisticas.clear()
+            self._lentas.clear()
+
+    # --- Eventos de SQLAlchemy ---
+
+    def _antes_de_sentencia(self, conn, cursor, statement, parameters, context, executemany):
+        if _activas.get():
+            context._instrumentacion_inicio = time.perf_counter()
+
+    def _despues_de_sentencia(self, conn, cursor, statement, parameters, context, executemany):
+        activas = _activas.get()
+        if not activas:
+            return
+        ms = (time.perf_counter() - getattr(context, "_instrumentacion_inicio", time.perf_counter())) * 1000
+        for medicion in activas:
+            medicion.sentencias += 1
+            if len(medicion.sql) < medicion.max_sql:
+                medicion.sql.append({"sql": statement, "ms": ms})
+
+    def _al_ejecutar_en_session(self, estado):
+        # Cuenta las filas del SELECT devolviendo a la Session una copia congelada del resultado
+        activas = _activas.get()
+        opciones = estado.execution_options
+        if not activas or not estado.is_select or opciones.get("yield_per") or opciones.get("stream_results"):
+            return None
+        congelado = estado.invoke_statement().freeze()
+        for medicion in activas:
+            medicion.filas += len(congelado.data)
+        return congelado()
+
+    def _antes_de_commit(self, conn):
+        ahora = time.perf_counter()
+        for medicion in _activas.get():
+            medicion.inicio_commit = ahora
+
+    def _despues_de_commit(self, session):
+        ahora = time.perf_counter()
+        for medicion in _activas.get():
+            if medicion.inicio_commit is not None:
+                medicion.commit_ms += (ahora - medicion.inicio_commit) * 1000
+                medicion.inicio_commit = None
+
+    # --- Medición de operaciones ---
+
+    @contextmanager
+    def medir(self, nombre):
+        if not self.activa:
+            yield None
+            return
+        medicion = _Medicion(nombre, self.max_sql)
+        token = _activas.set(_activas.get() + (medicion,))
+        inicio = time.perf_counter()
+        error = False
+        try:
+            yield medicion
+        except BaseException:
+            error = True
+            raise
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            _activas.reset(token)
+            self._registrar(medicion, ms, error)
+
+    def medido(self, funcion):
+        # Decorador: mide cada llamada con el nombre calificado de la función
+        nombre = funcion.__qualname__
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not self.activa:
+                return funcion(*args, **kwargs)
+            with self.medir(nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+
+    def _registrar(self, medicion, ms, error):
+        lenta = ms >= self.umbral_lento_ms
+        with self._bloqueo:
+            estadistica = self._estadisticas.get(medicion.nombre)
+            if estadistica is None:
+                estadistica = self._estadisticas[medicion.nombre] = _Estadistica()
+            estadistica.agregar(ms, medicion, error)
+            if lenta:
+                self._lentas.append({
+                    "operacion": medicion.nombre,
+                    "fecha": datetime.now().isoformat(timespec="seconds"),
+                    "ms": ms,
+                    "sentencias": medicion.sentencias,
+                    "filas": medicion.filas,
+                    "commit_ms": medicion.commit_ms,
+                    "error": error,
+                    "sql": medicion.sql,
+                })
+        if lenta:
+            registro_lentas.warning("%s tardó %.1f ms (%d sentencias, %d filas, commit %.1f ms)",
+                                    medicion.nombre, ms, medicion.sentencias, medicion.filas, medicion.commit_ms)
+
+    # --- Consulta y exportación ---
+
+    def lentas(self):
+        with self._bloqueo:
+            return list(self._lentas)
+
+    def snapshot(self):
+        # Copia serializable en JSON de todas las métricas acumuladas
+        with self._bloqueo:
+            return {
+                "fecha": datetime.now().isoformat(timespec="seconds"),
+                "umbral_lento_ms": self.umbral_lento_ms,
+                "operaciones": {nombre: estadistica.resumen()
+                                for nombre, estadistica in sorted(self._estadisticas.items())},
+                "lentas": list(self._lentas),
+            }
+
+
+instrumentacion = Instrumentacion()
+medido = instrumentacion.medido
+
+
+def activar_desde_entorno(engine, entorno=None):
+    # RESTAURANTE_UMBRAL_LENTO_MS activa la instrumentación con ese umbral; sin ella no se activa
+    entorno = os.environ if entorno is None else entorno
+    if entorno.get("RESTAURANTE_UMBRAL_LENTO_MS"):
+        instrumentacion.activar(engine, umbral_lento_ms=float(entorno["RESTAURANTE_UMBRAL_LENTO_MS"]))
+        return True
+    return False
@@ -0,0 +1,20 @@
+from collections import namedtuple
+from models import unidades_por_estado
+
+# Modelos de lectura para pantallas y reportes: tuplas con nombre (sin __dict__, sin estado de
+# sesión ni seguimiento de cambios) que se llenan con consultas de solo columnas, ver
+# Repository.get_cola_lectura. Son de solo lectura; los cambios se hacen por id con los servicios.
+# Comparación de memoria y tiempo con las entidades: benchmark_lecturas en benchmarks.py.
+
+PedidoCola = namedtuple("PedidoCola", ["id", "mesa", "estado", "mesero", "detalles"])
+
+
+class DetalleCola(namedtuple("DetalleCola", [
+        "id", "pedido_id", "producto", "cantidad", "estado", "fecha_creacion", "inicio_preparacion",
+        "fin_preparacion", "fin_finalizacion", "duracion_preparacion", "unidades_preparacion",
+        "unidades_entregadas", "unidades_finalizadas"])):
+    __slots__ = ()
+
+    def unidades_por_estado(self):
+        return unidades_por_estado(self.cantidad, self.unidades_preparacion, self.unidades_entregadas,
+                                   self.unidades_finalizadas)
@@ -1,10 +1,16 @@
 from models import Empleado, Mesa, Producto, Pedido, Factura, DetallePedido
 from repository import Repository
 from services import PedidoService, FacturaService
-from sqlalchemy.orm import sessionmaker
-from models import engine
-import pandas as pd
-SessionLocal = sessionmaker(bind=engine)
+from catalogo import ProductCatalog
+from cocina import PlanificadorCocina
+from indice_mesas import IndiceMesas
+from estados import EstadoPedido, MAQUINA_DETALLE
+from database import SessionLectura, SessionLocal, crear_esquema, obtener_engine
+from reportes import ReporteFacturacion
+from exportacion import exportar_facturacion
+from datetime import date, datetime
+from sqlalchemy import select
+from instrumentacion import activar_desde_entorno, medido
 
 class SesionUsuario:
     _instance = None
@@ -29,7 +35,15 @@ class SesionUsuario:
         return self._empleado_actual
 
 def cargar_datos_iniciales(repo: Repository):
-    if not repo.get_all(Empleado):
+    # Del primario: con una réplica atrasada se volverían a cargar los datos
+    with repo.leer_del_primario():
+        _cargar_datos_iniciales(repo)
+
+def _vacia(repo: Repository, entity_class):
+    return not repo.get_pagina(entity_class, limite=1, columnas=(entity_class.id,))
+
+def _cargar_datos_iniciales(repo: Repository):
+    if _vacia(repo, Empleado):
         empleados = [
             Empleado(_codigo="M001", _nombre="Juan Pérez", _rol="Mesero", _clave="1234"),
             Empleado(_codigo="M002", _nombre="María Gómez", _rol="Mesero", _clave="1234"),
@@ -48,12 +62,12 @@ def cargar_datos_iniciales(repo: Repository):
         for emp in empleados:
             repo.add(emp)
         print("Empleados cargados exitosamente.")
-    if not repo.get_all(Mesa):
+    if _vacia(repo, Mesa):
         for i in range(1, 16):
             mesa = Mesa(_numero=i, _estado="Libre")
             repo.add(mesa)
         print("Mesas cargadas exitosamente.")
-    if not repo.get_all(Producto):
+    if _vacia(repo, Producto):
         productos = [
             Producto(_nombre="Lomo Fino", _categoria="Al Fuego", _precio=48),
             Producto(_nombre="Baby Beef", _categoria="Al Fuego", _precio=48),
@@ -108,11 +122,9 @@ def cargar_datos_iniciales(repo: Repository):
             repo.add(prod)
         print("Productos cargados exitosamente.")
 
-def mostrar_menu_productos(repo: Repository):
-    productos = repo.get_all(Producto)
+def mostrar_menu_productos(catalogo: ProductCatalog):
     print("\nProductos disponibles:")
-    for prod in productos:
-        print(f"ID: {prod.id}, {prod.nombre} ({prod._categoria}) - S/. {prod.precio:.2f}")
+    print(catalogo.texto_menu())
 
 def tomar_pedido(repo: Repository, pedido_service: PedidoService, mesero_id: int):
     try:
@@ -125,7 +137,7 @@ def tomar_pedido(repo: Repository, pedido_service: PedidoService, mesero_id: int
         if mesa.estado != "Libre":
             print(f"Error: la mesa {mesa_numero} ya está ocupada.")
             return
-        mostrar_menu_productos(repo)
+        mostrar_menu_productos(pedido_service.catalogo)
         productos = []
         while True:
             prod_input = input("ID del producto (0 para terminar): ")
@@ -136,9 +148,7 @@ def tomar_pedido(repo: Repository, pedido_service: PedidoService, mesero_id: int
             except ValueError:
                 print("Error: ID inválido.")
                 continue
-            productos_disponibles = repo.get_all(Producto)
-            producto_encontrado = next((prod for prod in productos_disponibles if prod.id == prod_id), None)
-            if not producto_encontrado:
+            if prod_id not in pedido_service.catalogo:
                 print("Error: Producto no existe.")
                 continue
             try:
@@ -158,55 +168,68 @@ def tomar_pedido(repo: Repository, pedido_service: PedidoService, mesero_id: int
         print(f"Error: {e}")
 
 
-def ver_cola_pedidos(repo: Repository):
-    pedidos = repo.get_all(Pedido)
+@medido
+def ver_cola_pedidos(repo: Repository, tamano_pagina=50):
+    # Solo pedidos abiertos, como modelos de lectura (lecturas.py) y paginados por id
+    pedidos = repo.get_cola_lectura(limite=tamano_pagina)
     if not pedidos:
         print("No hay pedidos en la cola.")
         return
     print("\nCola de Pedidos:")
-    for pedido in pedidos:
-        mesero_nombre = pedido.mesero.nombre if pedido.mesero else "Sin Mesero"
-        print(f"Pedido ID: {pedido.id}, Mesa: {pedido.mesa.numero}, Estado: {pedido.estado}, Mesero: {mesero_nombre}")
-        print("Detalles:")
-        for idx, detalle in enumerate(pedido.detalles, start=1):
-            linea = f"  Item {idx}: Producto: {detalle.producto.nombre}, Estado: {detalle.estado}"
-            if detalle.estado == "Pedido realizado":
-                linea += f", Creado: {detalle._fecha_creacion:%H:%M:%S}"
-            elif detalle.estado == "En preparación":
-                if detalle._inicio_preparacion:
-                    linea += f", Inicio preparación: {detalle._inicio_preparacion:%H:%M:%S}"
-            elif detalle.estado == "Entregado":
-                if detalle._inicio_preparacion and detalle._fin_preparacion:
-                    linea += f", Inicio: {detalle._inicio_preparacion:%H:%M:%S}, Fin: {detalle._fin_preparacion:%H:%M:%S}, Duración: {detalle._duracion_preparacion:.2f} min"
-            elif detalle.estado == "Finalizado":
-                if detalle._fin_finalizacion:
-                    linea += f", Finalizado: {detalle._fin_finalizacion:%H:%M:%S}"
-            print(linea)
-        print("-" * 50)
+    while pedidos:
+        for pedido in pedidos:
+            _imprimir_pedido_cola(pedido)
+        if len(pedidos) < tamano_pagina:
+            break
+        pedidos = repo.get_cola_lectura(despues_de_id=pedidos[-1].id, limite=tamano_pagina)
+
+def _imprimir_pedido_cola(pedido):
+    print(f"Pedido ID: {pedido.id}, Mesa: {pedido.mesa}, Estado: {pedido.estado}, "
+          f"Mesero: {pedido.mesero or 'Sin Mesero'}")
+    print("Detalles:")
+    for idx, detalle in enumerate(pedido.detalles, start=1):
+        linea = f"  Item {idx}: {detalle.cantidad} x {detalle.producto}, Estado: {detalle.estado}"
+        avance = {estado: n for estado, n in detalle.unidades_por_estado().items() if n}
+        if len(avance) > 1:
+            linea += " (" + ", ".join(f"{n} {estado}" for estado, n in avance.items()) + ")"
+        if detalle.estado == EstadoPedido.PEDIDO_REALIZADO:
+            linea += f", Creado: {detalle.fecha_creacion:%H:%M:%S}"
+        elif detalle.estado == EstadoPedido.EN_PREPARACION:
+            if detalle.inicio_preparacion:
+                linea += f", Inicio preparación: {detalle.inicio_preparacion:%H:%M:%S}"
+        elif detalle.estado == EstadoPedido.ENTREGADO:
+            if detalle.inicio_preparacion and detalle.fin_preparacion:
+                linea += f", Inicio: {detalle.inicio_preparacion:%H:%M:%S}, Fin: {detalle.fin_preparacion:%H:%M:%S}, Duración: {detalle.duracion_preparacion:.2f} min"
+        elif detalle.estado == EstadoPedido.FINALIZADO:
+            if detalle.fin_finalizacion:
+                linea += f", Finalizado: {detalle.fin_finalizacion:%H:%M:%S}"
+        print(linea)
+    print("-" * 50)
 
 def cambiar_estado_global(repo: Repository, pedido_service: PedidoService):
-    pedidos_cambiables = [p for p in repo.get_all(Pedido) if p.estado in ["Pedido realizado", "En preparación", "Entregado"]]
+    estados_cambiables = [e for e in MAQUINA_DETALLE.estados if MAQUINA_DETALLE.siguiente(e) is not None]
+    # Solo las columnas que se muestran, sin entidades ni detalles
+    mesa = select(Mesa._numero).where(Mesa.id == Pedido._mesa_id).scalar_subquery()
+    pedidos_cambiables = repo.get_pagina(Pedido, Pedido._estado.in_(estados_cambiables), limite=None,
+                                         columnas=(Pedido.id, mesa.label("mesa"), Pedido._estado.label("estado")))
     if not pedidos_cambiables:
         print("No hay pedidos que permitan cambio global de estado.")
         return
     print("Pedidos disponibles para cambio global:")
     for idx, pedido in enumerate(pedidos_cambiables, 1):
-        print(f"{idx}. Pedido ID: {pedido.id}, Mesa: {pedido.mesa.numero}, Estado: {pedido.estado}")
+        print(f"{idx}. Pedido ID: {pedido.id}, Mesa: {pedido.mesa}, Estado: {pedido.estado}")
     opcion = int(input("Seleccione el pedido a modificar: "))
     if 1 <= opcion <= len(pedidos_cambiables):
         pedido_seleccionado = pedidos_cambiables[opcion - 1]
     else:
         print("Opción inválida.")
         return
-    if pedido_seleccionado.estado == "Pedido realizado":
-        nuevos_estados = ["En preparación"]
-    elif pedido_seleccionado.estado == "En preparación":
-        nuevos_estados = ["Entregado"]
-    elif pedido_seleccionado.estado == "Entregado":
-        nuevos_estados = ["Finalizado"]
-    else:
+    # "Facturado" no se ofrece: se llega a él solo al facturar la mesa
+    siguiente = MAQUINA_DETALLE.siguiente(pedido_seleccionado.estado)
+    if siguiente is None:
         print("El pedido no puede cambiar de estado.")
         return
+    nuevos_estados = [siguiente]
     print("Seleccione nuevo estado global:")
     for i, estado in enumerate(nuevos_estados, 1):
         print(f"{i}. {estado}")
@@ -218,15 +241,11 @@ def cambiar_estado_global(repo: Repository, pedido_service: PedidoService):
         print("Opción inválida.")
 
 def cambiar_estado_detalle(repo: Repository, pedido_service: PedidoService):
-    # Se agrupan los detalles cambiables por pedido
+    # Se agrupan por pedido las líneas cambiables, leídas como proyección (sin entidades)
+    estados_cambiables = [e for e in MAQUINA_DETALLE.estados if MAQUINA_DETALLE.siguiente(e) is not None]
     agrupados = {}
-    for pedido in repo.get_all(Pedido):
-        detalles_cambiables = []
-        for detalle in pedido.detalles:
-            if detalle.estado in ["Pedido realizado", "En preparación", "Entregado"]:
-                detalles_cambiables.append(detalle)
-        if detalles_cambiables:
-            agrupados[pedido.id] = detalles_cambiables
+    for detalle in repo.get_detalles_cambiables(estados_cambiables):
+        agrupados.setdefault(detalle.pedido_id, []).append(detalle)
 
     if not agrupados:
         print("No hay detalles que permitan cambio de estado individual.")
@@ -237,10 +256,9 @@ def cambiar_estado_detalle(repo: Repository, pedido_service: PedidoService):
     opcion_num = 1
     print("Detalles agrupados por Pedido:")
     for pedido_id, detalles in agrupados.items():
-        pedido = repo.get(Pedido, pedido_id)
-        print(f"Pedido ID: {pedido_id}, Mesa: {pedido.mesa.numero}, Mesero: {pedido.mesero.nombre}")
+        print(f"Pedido ID: {pedido_id}, Mesa: {detalles[0].mesa}, Mesero: {detalles[0].mesero or 'Sin Mesero'}")
         for idx, detalle in enumerate(detalles, start=1):
-            print(f"  {opcion_num}. Item {idx}: Producto: {detalle.producto.nombre}, Estado: {detalle.estado}")
+            print(f"  {opcion_num}. Item {idx}: {detalle.cantidad} x {detalle.producto}, Estado: {detalle.estado}")
             opcion_map[opcion_num] = detalle
             opcion_num += 1
 
@@ -255,15 +273,11 @@ def cambiar_estado_detalle(repo: Repository, pedido_service: PedidoService):
         return
 
     detalle_seleccionado = opcion_map[opcion]
-    if detalle_seleccionado.estado == "Pedido realizado":
-        nuevos_estados = ["En preparación"]
-    elif detalle_seleccionado.estado == "En preparación":
-        nuevos_estados = ["Entregado"]
-    elif detalle_seleccionado.estado == "Entregado":
-        nuevos_estados = ["Finalizado"]
-    else:
+    siguiente = MAQUINA_DETALLE.siguiente(detalle_seleccionado.estado)
+    if siguiente is None:
         print("El detalle no puede cambiar de estado.")
         return
+    nuevos_estados = [siguiente]
 
     print("Seleccione nuevo estado para el detalle:")
     for i, estado in enumerate(nuevos_estados, 1):
@@ -276,23 +290,129 @@ def cambiar_estado_detalle(repo: Repository, pedido_service: PedidoService):
 
     if 1 <= idx <= len(nuevos_estados):
         nuevo_estado = nuevos_estados[idx - 1]
-        pedido_service.cambiar_estado_detalle(detalle_seleccionado.id, nuevo_estado)
+        unidades = None
+        if detalle_seleccionado.cantidad > 1:
+            try:
+                texto = input("Unidades a mover (vacío = todas): ").strip()
+                unidades = int(texto) if texto else None
+            except ValueError:
+                print("Cantidad inválida.")
+                return
+        pedido_service.cambiar_estado_detalle(detalle_seleccionado.id, nuevo_estado, unidades)
     else:
         print("Opción inválida.")
 
-def ver_disponibilidad_mesas(repo: Repository):
-    mesas = repo.get_all(Mesa)
+def ver_disponibilidad_mesas(indice: IndiceMesas):
+    # Cada pantalla recarga el índice desde las columnas de resumen (una fila por mesa): el bus de eventos
+    # es del proceso y no trae los pedidos ni las facturas de otras terminales o de la API
+    indice.recargar()
     print("\nDisponibilidad de Mesas:")
-    for mesa in mesas:
-        print(f"Mesa {mesa.numero}: {mesa.estado}")
+    for mesa in indice.mesas():
+        if mesa.pedidos_abiertos:
+            print(f"Mesa {mesa.numero}: {mesa.estado} | Pedidos abiertos: {mesa.pedidos_abiertos} "
+                  f"| S/. {mesa.importe_abierto:.2f}")
+        else:
+            print(f"Mesa {mesa.numero}: {mesa.estado}")
+    print(f"Libres: {len(indice.libres())} | Ocupadas: {len(indice.ocupadas())}")
+
+def facturar_mesa(indice: IndiceMesas, factura_service: FacturaService):
+    indice.recargar()  # Ver ver_disponibilidad_mesas
+    mesas_finalizadas = list(indice.con_finalizados().items())
+    if not mesas_finalizadas:
+        print("No hay órdenes finalizadas para facturar.")
+        return
+    print("\nÓrdenes finalizadas disponibles para facturar:")
+    for idx, (mesa_numero, finalizados) in enumerate(mesas_finalizadas, 1):
+        print(f"{idx}. Mesa {mesa_numero} (Pedidos finalizados: {finalizados})")
+    opcion_mesa = int(input("Seleccione la opción de mesa a facturar: "))
+    if 1 <= opcion_mesa <= len(mesas_finalizadas):
+        factura_service.facturar_mesa(mesas_finalizadas[opcion_mesa - 1][0])
+    else:
+        print("Opción inválida.")
+
+def ver_cola_cocina(planificador: PlanificadorCocina, pedido_service: PedidoService, empleado):
+    # Lotes de la estación en orden de prioridad; cada rol ve sus estaciones (los demás, todas)
+    estaciones = planificador.estaciones_de_rol(empleado.rol) or list(planificador.estaciones)
+    if len(estaciones) > 1:
+        for idx, nombre in enumerate(estaciones, 1):
+            print(f"{idx}. {nombre}")
+        opcion = int(input("Seleccione la estación: "))
+        if not 1 <= opcion <= len(estaciones):
+            print("Opción inválida.")
+            return
+        estacion = estaciones[opcion - 1]
+    else:
+        estacion = estaciones[0]
+    lotes = planificador.cola(estacion)
+    if not lotes:
+        print(f"No hay pendientes en {estacion}.")
+        return
+    print(f"\nCola de {estacion}:")
+    for idx, lote in enumerate(lotes, 1):
+        producto = planificador.catalogo.get(lote.producto_id)
+        print(f"{idx}. {lote.unidades} x {producto.nombre if producto else lote.producto_id} | "
+              f"Pedidos {', '.join(map(str, lote.pedido_ids))} | Espera {lote.espera:.0f} min | "
+              f"Estimado {lote.minutos:.0f} min")
+    if input("¿Tomar el primer lote? (s/N): ").strip().lower() == "s":
+        planificador.tomar(lotes[0], pedido_service)
+
+def _leer_fecha(mensaje, por_defecto):
+    texto = input(mensaje).strip()
+    return date.fromisoformat(texto) if texto else por_defecto
+
+def resumen_facturacion(repo: Repository):
+    hoy = date.today()
+    desde = _leer_fecha(f"Desde (AAAA-MM-DD, vacío = {hoy}): ", hoy)
+    hasta = _leer_fecha(f"Hasta (AAAA-MM-DD, vacío = {desde}): ", desde)
+    reporte = ReporteFacturacion(repo)
+    totales = {fila.fecha: fila.total for fila in reporte.resumen_diario(desde, hasta)}
+    if not totales:
+        print("No hay facturas registradas en el rango.")
+        return
+
+    # Las facturas llegan ordenadas por fecha y por lotes; los totales del día vienen del GROUP BY
+    fecha_actual = None
+    for f in reporte.iterar_facturas(desde, hasta):
+        if f.fecha_hora.date() != fecha_actual:
+            if fecha_actual is not None:
+                print(f"Total del día S/. {totales[fecha_actual]:.2f}")
+            fecha_actual = f.fecha_hora.date()
+            print(f"\n=== Resumen de Facturación {fecha_actual:%Y-%m-%d} ===")
+        print(f"Mesa {f.mesa} | Hora {f.fecha_hora:%H:%M} | Mesero {f.mesero} | Total S/. {f.total:.2f}")
+    print(f"Total del día S/. {totales[fecha_actual]:.2f}")
+
+    print("\n=== Totales por Mesero ===")
+    for fila in reporte.resumen_por_mesero(desde, hasta):
+        print(f"{fila.mesero} | Facturas {fila.facturas} | Total S/. {fila.total:.2f}")
+
+    # Exportación por flujo; el nombre del archivo incluye el rango para no sobrescribir otros reportes
+    formato = input("Exportar (xlsx/csv/parquet, vacío = xlsx, 'no' para omitir): ").strip().lower() or "xlsx"
+    if formato == "no":
+        return
+    incremental = input("¿Solo facturas nuevas desde la última exportación? (s/N): ").strip().lower() == "s"
+    if incremental:
+        ruta = f"reporte_facturacion_incremental_{datetime.now():%Y%m%d_%H%M%S}.{formato}"
+        resultado = exportar_facturacion(repo, ruta, formato, incremental=True)
+    else:
+        ruta = f"reporte_facturacion_{desde}_{hasta}.{formato}"
+        resultado = exportar_facturacion(repo, ruta, formato, desde, hasta)
+    print(f"Reporte generado: {', '.join(resultado['archivos'])} "
+          f"({resultado['facturas']} facturas, {resultado['detalles']} detalles, "
+          f"{resultado['filas_por_segundo']:.0f} filas/s)")
 
 def menu():
+    crear_esquema(obtener_engine())
+    activar_desde_entorno(obtener_engine())
     session = SessionLocal()
-    repo = Repository(session)
-    pedido_service = PedidoService(repo)
+    session_lectura = SessionLectura()
+    repo = Repository(session, session_lectura)
+    catalogo = ProductCatalog(repo)
+    pedido_service = PedidoService(repo, catalogo)
     factura_service = FacturaService(repo)
     sesion = SesionUsuario()
     cargar_datos_iniciales(repo)
+    indice = IndiceMesas(repo)
+    planificador = PlanificadorCocina(repo, catalogo)
     while True:
         if not sesion.empleado_actual:
             codigo = input("Código de empleado: ")
@@ -311,7 +431,8 @@ def menu():
         print("6. Cambiar estado de pedido global")
         print("7. Cambiar estado de detalle de pedido individual")
         print("8. Resumen Facturación Diaria")
-        print("9. Salir")
+        print("9. Cola de Cocina por Estación")
+        print("10. Salir")
         opcion = input("Seleccione una opción: ")
         try:
             if opcion == "1":
@@ -321,79 +442,22 @@ def menu():
             elif opcion == "3":
                 ver_cola_pedidos(repo)
             elif opcion == "4":
-                mesas_finalizadas = [mesa for mesa in repo.get_all(Mesa) if any(p.estado == "Finalizado" for p in mesa.pedidos)]
-                if not mesas_finalizadas:
-                    print("No hay órdenes finalizadas para facturar.")
-                else:
-                    print("\nÓrdenes finalizadas disponibles para facturar:")
-                    for idx, mesa in enumerate(mesas_finalizadas, 1):
-                        pedidos_finalizados = [p for p in mesa.pedidos if p.estado == "Finalizado"]
-                        print(f"{idx}. Mesa {mesa.numero} (Pedidos finalizados: {len(pedidos_finalizados)})")
-                    opcion_mesa = int(input("Seleccione la opción de mesa a facturar: "))
-                    if 1 <= opcion_mesa <= len(mesas_finalizadas):
-                        mesa_seleccionada = mesas_finalizadas[opcion_mesa - 1]
-                        factura_service.facturar_mesa(mesa_seleccionada.numero)
-                    else:
-                        print("Opción inválida.")
+                facturar_mesa(indice, factura_service)
             elif opcion == "5":
-                ver_disponibilidad_mesas(repo)
+                ver_disponibilidad_mesas(indice)
             elif opcion == "6":
                 cambiar_estado_global(repo, pedido_service)
             elif opcion == "7":
                 cambiar_estado_detalle(repo, pedido_service)
             elif opcion == "8":
-                facturas = repo.get_all(Factura)
-                if not facturas:
-                    print("No hay facturas registradas.")
-                else:
-                    from collections import defaultdict
-                    grupos = defaultdict(list)
-                    for f in facturas:
-                        if f._total is None:
-                            continue
-                        grupos[f._fecha_hora.date()].append(f)
-                    for fecha in sorted(grupos):
-                        print(f"\n=== Resumen de Facturación {fecha:%Y-%m-%d} ===")
-                        total_fecha = sum(f._total for f in grupos[fecha])
-                        for f in grupos[fecha]:
-                            hora = f._fecha_hora.strftime("%H:%M")
-                            print(f"Mesa {f.mesa.numero} | Hora {hora} | Mesero {f.mesero.nombre} | Total S/. {f._total:.2f}")
-                        print(f"Total del día S/. {total_fecha:.2f}")
-
-                    # Preparar datos para el reporte Excel con cabecera y detalle
-                    header_data = []
-                    detail_data = []
-                    for f in facturas:
-                        header_data.append({
-                            "Factura ID": f.id,
-                            "Mesa": f.mesa.numero,
-                            "Mesero": f.mesero.nombre,
-                            "Fecha": f._fecha_hora.strftime("%Y-%m-%d"),
-                            "Hora": f._fecha_hora.strftime("%H:%M"),
-                            "Total": f._total,
-                        })
-                        # Se asume que cada factura tiene un atributo 'detalles'
-                        for detalle in getattr(f, "detalles", []):
-                            # Se usan los atributos reales del objeto DetalleFactura para obtener los datos
-                            cantidad = detalle.cantidad
-                            nombre_producto = detalle.producto.nombre if detalle.producto else "N/A"
-                            precio = detalle.producto.precio if detalle.producto else 0
-                            detail_data.append({
-                                "Factura ID": f.id,
-                                "Producto": nombre_producto,
-                                "Cantidad": cantidad,
-                                "Precio Unitario": precio,
-                                "Subtotal": cantidad * precio,
-                            })
-                    df_header = pd.DataFrame(header_data)
-                    df_detail = pd.DataFrame(detail_data)
-                    with pd.ExcelWriter("reporte_facturacion_diaria.xlsx", engine="openpyxl") as writer:
-                        df_header.to_excel(writer, sheet_name="Cabecera", index=False)
-                        df_detail.to_excel(writer, sheet_name="Detalle", index=False)
-                    print("Reporte Excel generado: reporte_facturacion_diaria.xlsx")
+                resumen_facturacion(repo)
             elif opcion == "9":
+                ver_cola_cocina(planificador, pedido_service, sesion.empleado_actual)
+            elif opcion == "10":
                 print("Saliendo del sistema…")
                 session.close()
+                if session_lectura is not None:
+                    session_lectura.close()
                 break
             else:
                 print("Opción no válida, intente de nuevo.")
@@ -401,6 +465,9 @@ def menu():
             print(f"Error: {e}")
         except Exception as e:
             print(f"Error inesperado: {e}")
+        finally:
+            # Cada pantalla lee una foto nueva de la réplica
+            repo.terminar_lectura()
 
 if __name__ == "__main__":
     menu()
@@ -0,0 +1,260 @@
+# Migraciones versionadas de datos y esquema para bases creadas con versiones anteriores.
+# Uso: python migraciones.py   (usa la base configurada en RESTAURANTE_DB_URL)
+#
+# Cada migración tiene un número; las aplicadas se registran en la tabla versiones_esquema y
+# migrar() ejecuta solo las pendientes, en orden. Una base nueva se crea con create_all y se marca
+# directamente con la última versión. Las funciones reciben un engine o una conexión abierta.
+
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table, bindparam, case, column, delete,
+                        func, insert, inspect, select, table, update)
+from sqlalchemy.engine import Engine
+from estados import ESTADOS_DETALLE, EstadoPedido
+from models import (Base, DetalleFactura, DetallePedido, Mesa, Pedido, Producto, detalles_pedido_historico,
+                    pedidos_historico)
+
+versiones_esquema = Table(
+    "versiones_esquema", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("descripcion", String(200)),
+    Column("aplicada", DateTime),
+)
+
+
+@contextmanager
+def _transaccion(conectable):
+    # Con un engine abre y confirma su propia transacción; una conexión se usa tal cual
+    if isinstance(conectable, Engine):
+        with conectable.begin() as conexion:
+            yield conexion
+    else:
+        yield conectable
+
+
+def _agregar_columnas(conectable, tabla, columnas):
+    # columnas: {nombre: definición SQL}; solo se agregan las que faltan
+    with _transaccion(conectable) as conexion:
+        existentes = {columna["name"] for columna in inspect(conexion).get_columns(tabla)}
+        preparador = conexion.dialect.identifier_preparer
+        for nombre, definicion in columnas.items():
+            if nombre not in existentes:
+                conexion.exec_driver_sql(
+                    f"ALTER TABLE {preparador.quote(tabla)} ADD COLUMN {preparador.quote(nombre)} {definicion}")
+
+
+def _estado_por_unidades(cantidad, preparacion, entregadas, finalizadas):
+    if finalizadas == cantidad:
+        return EstadoPedido.FINALIZADO
+    if entregadas == cantidad:
+        return EstadoPedido.ENTREGADO
+    if preparacion == cantidad:
+        return EstadoPedido.EN_PREPARACION
+    return EstadoPedido.PEDIDO_REALIZADO
+
+
+def estados_a_enteros(conectable):
+    # Pasa _estado de String(30) con la etiqueta a SMALLINT con el código de EstadoPedido.
+    # Devuelve las tablas convertidas; ejecutarla de nuevo no cambia nada.
+    convertidas = []
+    with _transaccion(conectable) as conexion:
+        preparador = conexion.dialect.identifier_preparer
+        for nombre in (Pedido.__tablename__, DetallePedido.__tablename__):
+            columnas = {c["name"]: c["type"] for c in inspect(conexion).get_columns(nombre)}
+            if not isinstance(columnas.get("_estado"), String):
+                continue
+            _agregar_columnas(conexion, nombre, {"_estado_codigo": "SMALLINT NOT NULL DEFAULT 0"})
+            legado = table(nombre, column("_estado", String), column("_estado_codigo"))
+            codigos = {estado.etiqueta: int(estado) for estado in EstadoPedido}
+            tabla = preparador.quote(nombre)
+            conexion.execute(update(legado).values(
+                _estado_codigo=case(codigos, value=legado.c._estado, else_=0)))
+            conexion.exec_driver_sql(f"ALTER TABLE {tabla} DROP COLUMN {preparador.quote('_estado')}")
+            conexion.exec_driver_sql(f"ALTER TABLE {tabla} RENAME COLUMN {preparador.quote('_estado_codigo')} "
+                                     f"TO {preparador.quote('_estado')}")
+            convertidas.append(nombre)
+    return convertidas
+
+
+def colapsar_detalles_por_cantidad(conectable):
+    # Pasa de una fila de detalle por unidad a una fila por pedido y producto con su cantidad.
+    # Devuelve el número de filas eliminadas; ejecutarla de nuevo no cambia nada.
+    with _transaccion(conectable) as conexion:
+        return _colapsar_detalles(conexion)
+
+
+def _colapsar_detalles(conexion):
+    estados_a_enteros(conexion)  # Las comparaciones de estado de abajo usan los códigos enteros
+    _agregar_columnas(conexion, DetallePedido.__tablename__, {
+        "_cantidad": "INTEGER NOT NULL DEFAULT 1",
+        "_unidades_preparacion": "INTEGER NOT NULL DEFAULT 0",
+        "_unidades_entregadas": "INTEGER NOT NULL DEFAULT 0",
+        "_unidades_finalizadas": "INTEGER NOT NULL DEFAULT 0",
+    })
+    tabla = DetallePedido.__table__
+    c = tabla.c
+    # Filas de una unidad: los contadores se deducen del estado
+    def alcanzo(estado):
+        return case((c._estado.in_(ESTADOS_DETALLE[estado:]), 1), else_=0)
+    conexion.execute(update(tabla).where(c._cantidad == 1).values(
+        _unidades_preparacion=alcanzo(EstadoPedido.EN_PREPARACION),
+        _unidades_entregadas=alcanzo(EstadoPedido.ENTREGADO),
+        _unidades_finalizadas=alcanzo(EstadoPedido.FINALIZADO)))
+
+    grupos = conexion.execute(
+        select(c._pedido_id, c._producto_id,
+               func.min(c.id).label("conservar"),
+               func.count().label("filas"),
+               func.sum(c._cantidad).label("cantidad"),
+               func.sum(c._unidades_preparacion).label("preparacion"),
+               func.sum(c._unidades_entregadas).label("entregadas"),
+               func.sum(c._unidades_finalizadas).label("finalizadas"),
+               func.min(c._fecha_creacion).label("creacion"),
+               func.min(c._inicio_preparacion).label("inicio"),
+               func.max(c._fin_preparacion).label("fin"),
+               func.max(c._fin_finalizacion).label("finalizacion"))
+        .group_by(c._pedido_id, c._producto_id)
+        .having(func.count() > 1)).all()
+    if not grupos:
+        return 0
+
+    filas = []
+    for g in grupos:
+        entregado = g.entregadas == g.cantidad
+        filas.append({
+            "b_id": g.conservar,
+            "b_estado": _estado_por_unidades(g.cantidad, g.preparacion, g.entregadas, g.finalizadas),
+            "b_cantidad": g.cantidad,
+            "b_preparacion": g.preparacion,
+            "b_entregadas": g.entregadas,
+            "b_finalizadas": g.finalizadas,
+            "b_creacion": g.creacion,
+            "b_inicio": g.inicio,
+            "b_fin": g.fin if entregado else None,
+            "b_duracion": (g.fin - g.inicio).total_seconds() / 60.0 if entregado and g.inicio and g.fin else None,
+            "b_finalizacion": g.finalizacion if g.finalizadas == g.cantidad else None,
+        })
+    conexion.execute(update(tabla).where(c.id == bindparam("b_id")).values(
+        _estado=bindparam("b_estado"),
+        _cantidad=bindparam("b_cantidad"),
+        _unidades_preparacion=bindparam("b_preparacion"),
+        _unidades_entregadas=bindparam("b_entregadas"),
+        _unidades_finalizadas=bindparam("b_finalizadas"),
+        _fecha_creacion=bindparam("b_creacion"),
+        _inicio_preparacion=bindparam("b_inicio"),
+        _fin_preparacion=bindparam("b_fin"),
+        _duracion_preparacion=bindparam("b_duracion"),
+        _fin_finalizacion=bindparam("b_finalizacion")), filas)
+    conexion.execute(delete(tabla).where(
+        c._pedido_id == bindparam("b_pedido"),
+        c._producto_id == bindparam("b_producto"),
+        c.id != bindparam("b_id")), [
+        {"b_pedido": g._pedido_id, "b_producto": g._producto_id, "b_id": g.conservar} for g in grupos])
+    return sum(g.filas - 1 for g in grupos)
+
+
+def crear_indices(conectable):
+    # Crea los índices declarados en los modelos que falten en tablas ya existentes
+    with _transaccion(conectable) as conexion:
+        existentes = set(inspect(conexion).get_table_names())
+        for tabla in Base.metadata.sorted_tables:
+            if tabla.name in existentes:
+                for indice in tabla.indexes:
+                    indice.create(conexion, checkfirst=True)
+
+
+def resumen_de_mesas(conectable):
+    # Agrega el importe de cada pedido y el resumen de pedidos sin facturar de cada mesa, calculados
+    # desde los pedidos abiertos; los ya facturados quedan con importe 0. Recalcular no cambia nada.
+    with _transaccion(conectable) as conexion:
+        _agregar_columnas(conexion, Pedido.__tablename__, {"_importe": "FLOAT NOT NULL DEFAULT 0"})
+        _agregar_columnas(conexion, Mesa.__tablename__, {
+            "_pedidos_abiertos": "INTEGER NOT NULL DEFAULT 0",
+            "_pedidos_finalizados": "INTEGER NOT NULL DEFAULT 0",
+            "_importe_abierto": "FLOAT NOT NULL DEFAULT 0",
+        })
+        pedidos, detalles, productos, mesas = (Pedido.__table__, DetallePedido.__table__,
+                                               Producto.__table__, Mesa.__table__)
+        abierto = pedidos.c._estado != EstadoPedido.FACTURADO
+        importe = (select(func.coalesce(func.sum(detalles.c._cantidad * func.coalesce(productos.c._precio, 0.0)), 0.0))
+                   .join(productos, detalles.c._producto_id == productos.c.id)
+                   .where(detalles.c._pedido_id == pedidos.c.id)
+                   .scalar_subquery())
+        conexion.execute(update(pedidos).where(abierto).values(_importe=importe))
+
+        def de_la_mesa(columna, *condiciones):
+            return (select(columna).where(pedidos.c._mesa_id == mesas.c.id, abierto, *condiciones)
+                    .scalar_subquery())
+        conexion.execute(update(mesas).values(
+            _pedidos_abiertos=de_la_mesa(func.count(pedidos.c.id)),
+            _pedidos_finalizados=de_la_mesa(func.count(pedidos.c.id), pedidos.c._estado == EstadoPedido.FINALIZADO),
+            _importe_abierto=de_la_mesa(func.coalesce(func.sum(pedidos.c._importe), 0.0))))
+
+
+def tablas_historicas(conectable):
+    # Crea las tablas de archivo y quita la clave foránea de detalles_factura a pedidos, que impediría
+    # archivar pedidos facturados. SQLite no puede quitar restricciones, pero no las aplica por defecto.
+    with _transaccion(conectable) as conexion:
+        pedidos_historico.create(conexion, checkfirst=True)
+        detalles_pedido_historico.create(conexion, checkfirst=True)
+        if conexion.dialect.name == "sqlite":
+            return
+        preparador = conexion.dialect.identifier_preparer
+        tabla = DetalleFactura.__tablename__
+        for clave in inspect(conexion).get_foreign_keys(tabla):
+            if clave["referred_table"] == Pedido.__tablename__ and clave.get("name"):
+                quitar = "DROP FOREIGN KEY" if conexion.dialect.name == "mysql" else "DROP CONSTRAINT"
+                conexion.exec_driver_sql(f"ALTER TABLE {preparador.quote(tabla)} {quitar} {preparador.quote(clave['name'])}")
+
+
+def version_resumen_mesas(conectable):
+    # Versión del resumen de cada mesa (ver indice_mesas.py); las mesas existentes empiezan en 0
+    with _transaccion(conectable) as conexion:
+        _agregar_columnas(conexion, Mesa.__tablename__, {"_version_resumen": "INTEGER NOT NULL DEFAULT 0"})
+
+
+# (versión, descripción, función); nunca renumerar ni quitar una migración ya publicada
+MIGRACIONES = [
+    (1, "Estados de pedido como códigos enteros", estados_a_enteros),
+    (2, "Una fila de detalle por línea con cantidad y contadores", colapsar_detalles_por_cantidad),
+    (3, "Índices de la cola, la facturación y los reportes", crear_indices),
+    (4, "Resumen de pedidos abiertos por mesa", resumen_de_mesas),
+    (5, "Tablas de archivo de pedidos facturados", tablas_historicas),
+    (6, "Versión del resumen de mesas", version_resumen_mesas),
+]
+
+
+def version_actual(conectable):
+    with _transaccion(conectable) as conexion:
+        if not inspect(conexion).has_table(versiones_esquema.name):
+            return 0
+        return conexion.execute(select(func.max(versiones_esquema.c.version))).scalar() or 0
+
+
+def migrar(conectable):
+    # Lleva la base a la última versión y devuelve las versiones aplicadas
+    with _transaccion(conectable) as conexion:
+        base_nueva = not inspect(conexion).has_table(Pedido.__tablename__)
+        versiones_esquema.create(conexion, checkfirst=True)
+        # Tablas que aún no existan, ya con sus índices; create_all no modifica las existentes
+        Base.metadata.create_all(conexion)
+        version = conexion.execute(select(func.max(versiones_esquema.c.version))).scalar() or 0
+        aplicadas = []
+        for numero, descripcion, funcion in MIGRACIONES:
+            if numero <= version:
+                continue
+            if not base_nueva:
+                funcion(conexion)
+            conexion.execute(insert(versiones_esquema).values(
+                version=numero, descripcion=descripcion, aplicada=datetime.now()))
+            aplicadas.append(numero)
+    return [] if base_nueva else aplicadas
+
+
+if __name__ == "__main__":
+    from database import crear_engine
+    engine = crear_engine()
+    aplicadas = migrar(engine)
+    if aplicadas:
+        print(f"Migraciones aplicadas: {', '.join(map(str, aplicadas))}.")
+    print(f"Esquema en la versión {version_actual(engine)}.")
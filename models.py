@@ -1,9 +1,23 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, Table, func
+from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
+from estados import EstadoPedido, ColumnaEstado, ESTADOS_DETALLE, MAQUINA_PEDIDO, MAQUINA_DETALLE
 
 Base = declarative_base()
 
+# Estados en los que un pedido sigue siendo trabajo abierto (aún no facturado)
+ESTADOS_COLA = ESTADOS_DETALLE
+
+def unidades_por_estado(cantidad, preparacion, entregadas, finalizadas):
+    # {etiqueta: unidades de la línea que están exactamente en ese estado}, a partir de los contadores
+    # acumulados de DetallePedido; lo usan también los modelos de lectura (lecturas.py)
+    return {
+        EstadoPedido.PEDIDO_REALIZADO.etiqueta: cantidad - preparacion,
+        EstadoPedido.EN_PREPARACION.etiqueta: preparacion - entregadas,
+        EstadoPedido.ENTREGADO.etiqueta: entregadas - finalizadas,
+        EstadoPedido.FINALIZADO.etiqueta: finalizadas,
+    }
+
 class Empleado(Base):
     __tablename__ = 'empleados'
     id = Column(Integer, primary_key=True)
@@ -32,6 +46,13 @@ class Mesa(Base):
     id = Column(Integer, primary_key=True)
     _numero = Column(Integer, unique=True)
     _estado = Column(String(20), default="Libre")
+    # Resumen de los pedidos sin facturar, mantenido por los servicios en la misma transacción
+    # (ver indice_mesas.py): las pantallas de sala y facturación no recorren el historial de pedidos
+    _pedidos_abiertos = Column(Integer, nullable=False, default=0, server_default="0")
+    _pedidos_finalizados = Column(Integer, nullable=False, default=0, server_default="0")
+    _importe_abierto = Column(Float, nullable=False, default=0.0, server_default="0")
+    # Sube en uno con cada cambio del resumen; los eventos la llevan para descartar los ya leídos
+    _version_resumen = Column(Integer, nullable=False, default=0, server_default="0")
     pedidos = relationship("Pedido", back_populates="mesa")
 
     @property
@@ -46,75 +67,133 @@ class Mesa(Base):
         if estado in ["Libre", "Ocupada"]:
             self._estado = estado
 
+    def _sumar_resumen(self, pedidos=0, finalizados=0, importe=0.0):
+        # Solo sobre una mesa bloqueada (SELECT ... FOR UPDATE): los valores cargados son los de la base.
+        # Se escriben en el mismo UPDATE que el estado de la mesa, junto con la versión siguiente
+        self._pedidos_abiertos += pedidos
+        self._pedidos_finalizados += finalizados
+        self._importe_abierto += importe
+        self._version_resumen += 1
+
 class Pedido(Base):
     __tablename__ = 'pedidos'
     id = Column(Integer, primary_key=True)
     _mesa_id = Column(Integer, ForeignKey('mesas.id'))
     _mesero_id = Column(Integer, ForeignKey('empleados.id'))
-    _estado = Column(String(30), default="Pedido realizado")
+    _estado = Column(ColumnaEstado, nullable=False, default=EstadoPedido.PEDIDO_REALIZADO)
     _fecha_inicio = Column(DateTime, default=datetime.now)
     _fecha_fin = Column(DateTime, nullable=True)
+    _importe = Column(Float, nullable=False, default=0.0, server_default="0")  # Con los precios al tomarlo
 
     mesa = relationship("Mesa", back_populates="pedidos")
     mesero = relationship("Empleado")
-    detalles = relationship("DetallePedido", back_populates="pedido")
+    detalles = relationship("DetallePedido", back_populates="pedido", order_by="DetallePedido.id")
+
+    # Cola de pedidos (estado + paginación por id) y pedidos por facturar de una mesa
+    __table_args__ = (
+        Index("ix_pedidos_estado_id", "_estado", "id"),
+        Index("ix_pedidos_mesa_estado", "_mesa_id", "_estado"),
+    )
 
     @property
     def estado(self):
         return self._estado
 
+    @property
+    def mesero_id(self):
+        return self._mesero_id
+
     def _cambiar_estado(self, nuevo_estado):
-        allowed_states = ["Pedido realizado", "En preparación", "Entregado", "Finalizado"]
-        if nuevo_estado not in allowed_states:
-            return
-        current_index = allowed_states.index(self._estado)
-        new_index = allowed_states.index(nuevo_estado)
-        if new_index <= current_index:
-            return  # No se permite retroceder
-        if nuevo_estado == "Finalizado":
-            self._fecha_fin = datetime.now()
-        self._estado = nuevo_estado
+        # La máquina de estados impide retroceder y registra _fecha_fin al finalizar
+        return MAQUINA_PEDIDO.avanzar(self, nuevo_estado)
 
 class DetallePedido(Base):
     __tablename__ = 'detalles_pedido'
     id = Column(Integer, primary_key=True, autoincrement=True)
     _pedido_id = Column(Integer, ForeignKey('pedidos.id'))
     _producto_id = Column(Integer, ForeignKey('productos.id'))
-    _estado = Column(String(30), default="Pedido realizado")
+    _estado = Column(ColumnaEstado, nullable=False, default=EstadoPedido.PEDIDO_REALIZADO)
     # Se reemplaza _fecha_inicio por _fecha_creacion y se agregan nuevos campos
     _fecha_creacion = Column(DateTime, default=datetime.now)
     _inicio_preparacion = Column(DateTime, nullable=True)
     _fin_preparacion = Column(DateTime, nullable=True)
     _fin_finalizacion = Column(DateTime, nullable=True)
     _duracion_preparacion = Column(Float, nullable=True)
+    # Una fila por línea del pedido. Los contadores acumulan las unidades que ya llegaron a cada
+    # estado (finalizadas <= entregadas <= en preparación <= cantidad), así una línea puede estar
+    # en parte en preparación o entregada; _estado es el estado que alcanzaron todas sus unidades.
+    _cantidad = Column(Integer, nullable=False, default=1)
+    _unidades_preparacion = Column(Integer, nullable=False, default=0)
+    _unidades_entregadas = Column(Integer, nullable=False, default=0)
+    _unidades_finalizadas = Column(Integer, nullable=False, default=0)
 
     pedido = relationship("Pedido", back_populates="detalles")
     producto = relationship("Producto")
 
+    # Detalles de un pedido (carga de la cola, facturación) y cambios masivos por producto o categoría
+    __table_args__ = (
+        Index("ix_detalles_pedido_pedido_estado", "_pedido_id", "_estado"),
+        Index("ix_detalles_pedido_producto_estado", "_producto_id", "_estado"),
+    )
+
+    # Contador de unidades de cada estado posterior a "Pedido realizado"
+    _CONTADORES = {
+        EstadoPedido.EN_PREPARACION: "_unidades_preparacion",
+        EstadoPedido.ENTREGADO: "_unidades_entregadas",
+        EstadoPedido.FINALIZADO: "_unidades_finalizadas",
+    }
+
     @property
     def estado(self):
         return self._estado
 
-    def _cambiar_estado(self, nuevo_estado):
-        allowed_states = ["Pedido realizado", "En preparación", "Entregado", "Finalizado"]
-        if nuevo_estado not in allowed_states:
-            return
-        current_index = allowed_states.index(self._estado)
-        new_index = allowed_states.index(nuevo_estado)
-        if new_index <= current_index:
-            return  # No se permite retroceder
-        if nuevo_estado == "En preparación":
-            if not self._inicio_preparacion:
-                self._inicio_preparacion = datetime.now()
-        elif nuevo_estado == "Entregado":
-            if self._inicio_preparacion and not self._fin_preparacion:
-                self._fin_preparacion = datetime.now()
-                diff = self._fin_preparacion - self._inicio_preparacion
-                self._duracion_preparacion = diff.total_seconds() / 60.0
-        elif nuevo_estado == "Finalizado":
-            if not self._fin_finalizacion:
-                self._fin_finalizacion = datetime.now()
-        self._estado = nuevo_estado
+    @property
+    def cantidad(self):
+        return self._cantidad if self._cantidad is not None else 1
+
+    def _unidades(self, estado):
+        return getattr(self, self._CONTADORES[estado]) or 0
+
+    def unidades_por_estado(self):
+        return unidades_por_estado(self.cantidad, self._unidades(EstadoPedido.EN_PREPARACION),
+                                   self._unidades(EstadoPedido.ENTREGADO), self._unidades(EstadoPedido.FINALIZADO))
+
+    def _cambiar_estado(self, nuevo_estado, unidades=None):
+        # unidades=None mueve toda la línea; un número mueve solo esa cantidad de unidades.
+        # ValueError si el estado no es de un detalle, las unidades no son positivas o no queda nada que mover.
+        if EstadoPedido.desde(nuevo_estado) not in self._CONTADORES:
+            raise ValueError(f"Un detalle de pedido no puede pasar a '{nuevo_estado}'.")
+        if unidades is not None and unidades <= 0:
+            raise ValueError("Las unidades a mover deben ser mayores que cero.")
+        nuevo_estado = EstadoPedido.desde(nuevo_estado)
+        actual = self._unidades(nuevo_estado)
+        if actual >= self.cantidad:
+            # No se permite retroceder ni repetir un estado ya alcanzado por toda la línea
+            raise ValueError(f"El detalle {self.id} ya está en '{nuevo_estado}' o más adelante.")
+        objetivo = self.cantidad if unidades is None else min(self.cantidad, actual + unidades)
+        # Las unidades que avanzan pasan también por los estados intermedios
+        for estado in ESTADOS_DETALLE[1:nuevo_estado + 1]:
+            setattr(self, self._CONTADORES[estado], max(self._unidades(estado), objetivo))
+        ahora = datetime.now()
+        if nuevo_estado == EstadoPedido.EN_PREPARACION and not self._inicio_preparacion:
+            self._inicio_preparacion = ahora
+        # La línea pasa al estado que ya alcanzaron todas sus unidades; los hooks de la máquina
+        # registran el fin de preparación y de finalización
+        alcanzado = next((estado for estado in reversed(ESTADOS_DETALLE[1:])
+                          if self._unidades(estado) == self.cantidad), None)
+        if alcanzado is not None:
+            MAQUINA_DETALLE.avanzar(self, alcanzado, ahora)
+
+    @classmethod
+    def _valores_avance(cls, nuevo_estado, ahora):
+        # Equivalente en SQL de _cambiar_estado(nuevo_estado) para toda la línea, para un UPDATE masivo
+        valores = MAQUINA_DETALLE.valores_sql(cls, nuevo_estado, ahora)
+        for estado, contador in cls._CONTADORES.items():
+            if estado <= nuevo_estado:
+                valores[contador] = cls._cantidad
+        if nuevo_estado == EstadoPedido.EN_PREPARACION:
+            valores["_inicio_preparacion"] = func.coalesce(cls._inicio_preparacion, ahora)
+        return valores
 
 class Producto(Base):
     __tablename__ = 'productos'
@@ -123,6 +202,8 @@ class Producto(Base):
     _categoria = Column(String(50))
     _precio = Column(Float)
 
+    __table_args__ = (Index("ix_productos_categoria", "_categoria"),)
+
     @property
     def nombre(self):
         return self._nombre
@@ -142,6 +223,9 @@ class Factura(Base):
     mesero = relationship("Empleado")
     detalles = relationship("DetalleFactura", back_populates="factura")
 
+    # Reportes y exportaciones acotados por fecha
+    __table_args__ = (Index("ix_facturas_fecha_hora_id", "_fecha_hora", "id"),)
+
     def _calcular_total(self):
         self._total = sum(detalle.subtotal for detalle in self.detalles)
 
@@ -151,16 +235,18 @@ class DetalleFactura(Base):
     __tablename__ = 'detalles_factura'
     id = Column(Integer, primary_key=True, autoincrement=True)
     _factura_id = Column(Integer, ForeignKey('facturas.id'), nullable=False)
-    _pedido_id = Column(Integer, ForeignKey('pedidos.id'))
+    _pedido_id = Column(Integer)  # Sin clave foránea: el pedido puede estar archivado (ver archivo.py)
     _producto_id = Column(Integer, ForeignKey('productos.id'), nullable=False)
     _cantidad = Column(Integer, nullable=False, default=1)
     _precio_unitario = Column(Float, nullable=False)
     _subtotal = Column(Float, nullable=False)
 
     factura = relationship("Factura", back_populates="detalles")
-    pedido = relationship("Pedido")
+    pedido = relationship("Pedido", primaryjoin="foreign(DetalleFactura._pedido_id) == Pedido.id", viewonly=True)
     producto = relationship("Producto")
 
+    __table_args__ = (Index("ix_detalles_factura_factura", "_factura_id"),)
+
     @property
     def producto_id(self):
         return self._producto_id
@@ -201,6 +287,27 @@ class DetalleFactura(Base):
         else:
             self._subtotal = self._cantidad * self._precio_unitario
 
-engine = create_engine('mysql+pymysql://root:@localhost/restaurante')
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
\ No newline at end of file
+# El engine y el esquema ya no se crean al importar (ver database.py); "from models import engine"
+# se mantiene por compatibilidad y crea el engine en el primer uso.
+def __getattr__(nombre):
+    if nombre == "engine":
+        from database import obtener_engine
+        return obtener_engine()
+    if nombre == "Session":
+        from database import SessionLocal
+        return SessionLocal
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+
+
+def _tabla_historica(modelo, nombre, *indices):
+    # Misma estructura que la tabla de trabajo, sin claves foráneas ni autoincremento: los ids se conservan
+    columnas = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, autoincrement=False)
+                for c in modelo.__table__.columns]
+    return Table(nombre, Base.metadata, *columnas, *indices)
+
+
+# Pedidos facturados y sus detalles movidos fuera de las tablas de trabajo (ver archivo.py)
+pedidos_historico = _tabla_historica(
+    Pedido, "pedidos_historico", Index("ix_pedidos_historico_fecha_inicio", "_fecha_inicio"))
+detalles_pedido_historico = _tabla_historica(
+    DetallePedido, "detalles_pedido_historico", Index("ix_detalles_pedido_historico_pedido", "_pedido_id"))
@@ -0,0 +1,128 @@
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import Date, func, or_, select
+from models import Empleado, Mesa, Producto, Factura, DetalleFactura
+from repository import Repository, detalles_con_historico, pedidos_con_historico
+
+# Reportes de facturación calculados en la base y acotados a un rango de fechas:
+# el costo depende de la ventana pedida, no de todo el historial.
+# Se leen de la réplica del repositorio si tiene una (Repository.session_lectura).
+
+
+def _inicio(valor):
+    return datetime.combine(valor, time.min) if type(valor) is date else valor
+
+
+def _fin_exclusivo(valor):
+    # Un día completo: hasta=2024-05-01 incluye todas las facturas de ese día
+    return datetime.combine(valor + timedelta(days=1), time.min) if type(valor) is date else valor
+
+
+class ReporteFacturacion:
+    def __init__(self, repo: Repository, tamano_lote=500):
+        self.repo = repo
+        self.tamano_lote = tamano_lote
+
+    def _en_rango(self, consulta, desde, hasta, despues_de_id=None, hasta_id=None, pendientes=()):
+        # Rango de fechas y, para exportaciones incrementales, rango de ids de factura (despues_de_id, hasta_id]
+        # más los ids pendientes: anteriores a despues_de_id pero aún no vistos (ver exportacion.py)
+        if desde is not None:
+            consulta = consulta.where(Factura._fecha_hora >= _inicio(desde))
+        if hasta is not None:
+            consulta = consulta.where(Factura._fecha_hora < _fin_exclusivo(hasta))
+        if despues_de_id is not None:
+            nuevas = Factura.id > despues_de_id
+            consulta = consulta.where(or_(nuevas, Factura.id.in_(sorted(pendientes))) if pendientes else nuevas)
+        if hasta_id is not None:
+            consulta = consulta.where(Factura.id <= hasta_id)
+        return consulta
+
+    def _transmitir(self, consulta):
+        return self.repo.transmitir(consulta, self.tamano_lote)
+
+    def ultima_factura_id(self):
+        return self.repo.session_lectura.execute(select(func.max(Factura.id))).scalar() or 0
+
+    def resumen_diario(self, desde=None, hasta=None):
+        dia = func.date(Factura._fecha_hora, type_=Date)
+        consulta = (select(dia.label("fecha"),
+                           func.count(Factura.id).label("facturas"),
+                           func.sum(Factura._total).label("total"))
+                    .where(Factura._total.is_not(None))
+                    .group_by(dia)
+                    .order_by(dia))
+        return self.repo.session_lectura.execute(self._en_rango(consulta, desde, hasta)).all()
+
+    def resumen_por_mesero(self, desde=None, hasta=None):
+        consulta = (select(Empleado._codigo.label("codigo"),
+                           Empleado._nombre.label("mesero"),
+                           func.count(Factura.id).label("facturas"),
+                           func.sum(Factura._total).label("total"))
+                    .join(Empleado, Factura._mesero_id == Empleado.id)
+                    .where(Factura._total.is_not(None))
+                    .group_by(Empleado.id, Empleado._codigo, Empleado._nombre)
+                    .order_by(func.sum(Factura._total).desc()))
+        return self.repo.session_lectura.execute(self._en_rango(consulta, desde, hasta)).all()
+
+    def iterar_facturas(self, desde=None, hasta=None, despues_de_id=None, hasta_id=None, pendientes=()):
+        consulta = (select(Factura.id.label("factura_id"),
+                           Factura._fecha_hora.label("fecha_hora"),
+                           Mesa._numero.label("mesa"),
+                           Empleado._nombre.label("mesero"),
+                           Factura._total.label("total"))
+                    .join(Mesa, Factura._mesa_id == Mesa.id)
+                    .outerjoin(Empleado, Factura._mesero_id == Empleado.id)
+                    .where(Factura._total.is_not(None))
+                    .order_by(Factura._fecha_hora, Factura.id))
+        return self._transmitir(self._en_rango(consulta, desde, hasta, despues_de_id, hasta_id, pendientes))
+
+    def iterar_detalles(self, desde=None, hasta=None, despues_de_id=None, hasta_id=None, pendientes=()):
+        consulta = (select(DetalleFactura._factura_id.label("factura_id"),
+                           func.coalesce(Producto._nombre, "N/A").label("producto"),
+                           DetalleFactura._cantidad.label("cantidad"),
+                           DetalleFactura._precio_unitario.label("precio_unitario"),
+                           DetalleFactura._subtotal.label("subtotal"))
+                    .join(Factura, DetalleFactura._factura_id == Factura.id)
+                    .outerjoin(Producto, DetalleFactura._producto_id == Producto.id)
+                    .where(Factura._total.is_not(None))  # Las mismas facturas que iterar_facturas
+                    .order_by(DetalleFactura._factura_id, DetalleFactura.id))
+        return self._transmitir(self._en_rango(consulta, desde, hasta, despues_de_id, hasta_id, pendientes))
+
+
+class ReportePedidos:
+    # Reportes de pedidos y tiempos de cocina: leen a la vez las tablas de trabajo y las archivadas
+    # (ver archivo.py), así que el resultado no cambia al archivar
+    def __init__(self, repo: Repository):
+        self.repo = repo
+
+    @staticmethod
+    def _en_rango(consulta, pedidos, desde, hasta):
+        if desde is not None:
+            consulta = consulta.where(pedidos.c._fecha_inicio >= _inicio(desde))
+        if hasta is not None:
+            consulta = consulta.where(pedidos.c._fecha_inicio < _fin_exclusivo(hasta))
+        return consulta
+
+    def resumen_diario(self, desde=None, hasta=None):
+        pedidos = pedidos_con_historico()
+        dia = func.date(pedidos.c._fecha_inicio, type_=Date)
+        consulta = (select(dia.label("fecha"),
+                           func.count(pedidos.c.id).label("pedidos"),
+                           func.sum(pedidos.c._importe).label("importe"))
+                    .group_by(dia)
+                    .order_by(dia))
+        return self.repo.session_lectura.execute(self._en_rango(consulta, pedidos, desde, hasta)).all()
+
+    def tiempos_preparacion(self, desde=None, hasta=None):
+        # Por categoría: líneas, unidades y minutos de preparación (medio y máximo) de las líneas entregadas
+        pedidos, detalles = pedidos_con_historico(), detalles_con_historico()
+        consulta = (select(Producto._categoria.label("categoria"),
+                           func.count(detalles.c.id).label("lineas"),
+                           func.sum(detalles.c._cantidad).label("unidades"),
+                           func.avg(detalles.c._duracion_preparacion).label("minutos_medio"),
+                           func.max(detalles.c._duracion_preparacion).label("minutos_max"))
+                    .join(pedidos, detalles.c._pedido_id == pedidos.c.id)
+                    .join(Producto, detalles.c._producto_id == Producto.id)
+                    .where(detalles.c._duracion_preparacion.is_not(None))
+                    .group_by(Producto._categoria)
+                    .order_by(Producto._categoria))
+        return self.repo.session_lectura.execute(self._en_rango(consulta, pedidos, desde, hasta)).all()
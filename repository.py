@@ -1,28 +1,355 @@
-from sqlalchemy.orm import Session
+from contextlib import contextmanager
+import time
+from sqlalchemy import and_, func, insert, select, union_all, update
+from sqlalchemy.orm import Session, joinedload, selectinload
+from estados import EstadoPedido
+from lecturas import DetalleCola, PedidoCola
+from models import (ESTADOS_COLA, Empleado, Mesa, Pedido, DetallePedido, Producto, detalles_pedido_historico,
+                    pedidos_historico)
+
+def _condiciones_cola(estados, mesa_numero, categoria, despues_de_id):
+    condiciones = [Pedido._estado.in_(estados)]
+    if mesa_numero is not None:
+        mesa_id = select(Mesa.id).where(Mesa._numero == mesa_numero).scalar_subquery()
+        condiciones.append(Pedido._mesa_id == mesa_id)
+    if categoria is not None:
+        productos_categoria = select(Producto.id).where(Producto._categoria == categoria)
+        condiciones.append(Pedido.detalles.any(DetallePedido._producto_id.in_(productos_categoria)))
+    if despues_de_id is not None:
+        condiciones.append(Pedido.id > despues_de_id)
+    return condiciones
+
+
+def consulta_cola_pedidos(estados=ESTADOS_COLA, mesa_numero=None, categoria=None,
+                          despues_de_id=None, limite=50):
+    # Cola de pedidos abiertos filtrada en SQL y con carga anticipada: siempre dos consultas
+    # (pedidos con mesa y mesero, y sus detalles con producto), sin importar el tamaño de la página.
+    # Paginación por clave: pasar el id del último pedido recibido como despues_de_id.
+    return (select(Pedido)
+            .where(*_condiciones_cola(estados, mesa_numero, categoria, despues_de_id))
+            .options(joinedload(Pedido.mesa),
+                     joinedload(Pedido.mesero),
+                     selectinload(Pedido.detalles).joinedload(DetallePedido.producto))
+            .order_by(Pedido.id)
+            .limit(limite))
+
+
+def consulta_cola_lectura(estados=ESTADOS_COLA, mesa_numero=None, categoria=None,
+                          despues_de_id=None, limite=50):
+    # La misma página de la cola, solo con las columnas de PedidoCola (ver lecturas.py)
+    return (select(Pedido.id, Mesa._numero, Pedido._estado, Empleado._nombre)
+            .join(Mesa, Pedido._mesa_id == Mesa.id)
+            .outerjoin(Empleado, Pedido._mesero_id == Empleado.id)
+            .where(*_condiciones_cola(estados, mesa_numero, categoria, despues_de_id))
+            .order_by(Pedido.id)
+            .limit(limite))
+
+
+def consulta_detalles_cola(pedido_ids):
+    # Columnas de DetalleCola de los detalles de los pedidos dados
+    return (select(DetallePedido.id, DetallePedido._pedido_id, Producto._nombre, DetallePedido._cantidad,
+                   DetallePedido._estado, DetallePedido._fecha_creacion, DetallePedido._inicio_preparacion,
+                   DetallePedido._fin_preparacion, DetallePedido._fin_finalizacion,
+                   DetallePedido._duracion_preparacion, DetallePedido._unidades_preparacion,
+                   DetallePedido._unidades_entregadas, DetallePedido._unidades_finalizadas)
+            .join(Producto, DetallePedido._producto_id == Producto.id)
+            .where(DetallePedido._pedido_id.in_(pedido_ids))
+            .order_by(DetallePedido._pedido_id, DetallePedido.id))
+
+
+def pedidos_con_historico():
+    # Pedidos de trabajo y archivados como una sola tabla derivada, con las columnas de Pedido
+    return union_all(select(*Pedido.__table__.columns), select(*pedidos_historico.columns)).subquery("pedidos_todos")
+
+
+def detalles_con_historico():
+    return union_all(select(*DetallePedido.__table__.columns),
+                     select(*detalles_pedido_historico.columns)).subquery("detalles_todos")
+
+
+def consulta_pedidos_por_facturar(mesa_id):
+    # Solo los pedidos "Finalizado" de la mesa, sin recorrer su historial facturado
+    return (select(Pedido.id, Pedido._mesero_id, Pedido._fecha_inicio, Pedido._importe,
+                   Empleado._nombre.label("mesero_nombre"))
+            .outerjoin(Empleado, Pedido._mesero_id == Empleado.id)
+            .where(Pedido._mesa_id == mesa_id, Pedido._estado == EstadoPedido.FINALIZADO)
+            .order_by(Pedido.id))
+
+
+def consulta_items_por_facturar(mesa_id):
+    # Una fila por producto con cantidad y precio, agregada en la base
+    return (select(Producto.id.label("producto_id"),
+                   Producto._nombre.label("nombre"),
+                   func.sum(DetallePedido._cantidad).label("cantidad"),
+                   func.coalesce(Producto._precio, 0.0).label("precio_unitario"),
+                   func.min(Pedido.id).label("pedido_id"))
+            .join(DetallePedido, DetallePedido._pedido_id == Pedido.id)
+            .join(Producto, DetallePedido._producto_id == Producto.id)
+            .where(Pedido._mesa_id == mesa_id, Pedido._estado == EstadoPedido.FINALIZADO)
+            .group_by(Producto.id, Producto._nombre, Producto._precio)
+            .order_by(Producto.id))
+
+
+def condicion_detalles(pedido_id=None, mesa_numero=None, producto_id=None, categoria=None, detalle_ids=None):
+    # Filtros de un cambio masivo de detalles; None si no se indicó ninguno
+    condiciones = []
+    if detalle_ids is not None:
+        condiciones.append(DetallePedido.id.in_(detalle_ids))
+    if pedido_id is not None:
+        condiciones.append(DetallePedido._pedido_id == pedido_id)
+    if mesa_numero is not None:
+        mesa_id = select(Mesa.id).where(Mesa._numero == mesa_numero).scalar_subquery()
+        pedidos_mesa = select(Pedido.id).where(Pedido._mesa_id == mesa_id, Pedido._estado.in_(ESTADOS_COLA))
+        condiciones.append(DetallePedido._pedido_id.in_(pedidos_mesa))
+    if producto_id is not None:
+        condiciones.append(DetallePedido._producto_id == producto_id)
+    if categoria is not None:
+        productos_categoria = select(Producto.id).where(Producto._categoria == categoria)
+        condiciones.append(DetallePedido._producto_id.in_(productos_categoria))
+    return and_(*condiciones) if condiciones else None
+
+
+def consulta_detalles_por_avanzar(condicion, origenes):
+    # Ids de los detalles que pueden avanzar, bloqueados hasta el fin de la transacción
+    return (select(DetallePedido.id, DetallePedido._pedido_id)
+            .where(condicion, DetallePedido._estado.in_(origenes))
+            .order_by(DetallePedido.id)
+            .with_for_update())
+
+
+def consulta_detalles_pendientes(producto_ids, estado=EstadoPedido.PEDIDO_REALIZADO, limite=1):
+    # Los detalles más antiguos en estado de los productos dados (una estación de cocina)
+    return (select(DetallePedido.id, DetallePedido._pedido_id, DetallePedido._producto_id, DetallePedido._cantidad,
+                   DetallePedido._fecha_creacion)
+            .where(DetallePedido._producto_id.in_(producto_ids), DetallePedido._estado == estado)
+            .order_by(DetallePedido.id)
+            .limit(limite))
+
+
+def consulta_detalles_cambiables(estados):
+    # Proyección de las líneas de la cola que pueden avanzar, con solo lo que imprime la pantalla
+    return (select(DetallePedido.id, DetallePedido._pedido_id.label("pedido_id"), Mesa._numero.label("mesa"),
+                   Empleado._nombre.label("mesero"), Producto._nombre.label("producto"),
+                   DetallePedido._cantidad.label("cantidad"), DetallePedido._estado.label("estado"))
+            .join(Pedido, DetallePedido._pedido_id == Pedido.id)
+            .join(Mesa, Pedido._mesa_id == Mesa.id)
+            .outerjoin(Empleado, Pedido._mesero_id == Empleado.id)
+            .join(Producto, DetallePedido._producto_id == Producto.id)
+            .where(Pedido._estado.in_(ESTADOS_COLA), DetallePedido._estado.in_(estados))
+            .order_by(DetallePedido._pedido_id, DetallePedido.id))
+
+
+def consulta_tiempos_preparacion():
+    # Por producto: líneas con duración registrada y minutos medios, de todo el historial
+    detalles = detalles_con_historico()
+    return (select(detalles.c._producto_id, func.count(detalles.c.id), func.avg(detalles.c._duracion_preparacion))
+            .where(detalles.c._duracion_preparacion.is_not(None))
+            .group_by(detalles.c._producto_id))
+
+
+def consulta_pedidos_completos(pedido_ids, estado, origenes):
+    # Pedidos (id, mesa) cuyos detalles ya están todos en estado y que pueden pasar a él
+    return (select(Pedido.id, Pedido._mesa_id)
+            .where(Pedido.id.in_(pedido_ids), Pedido._estado.in_(origenes),
+                   ~Pedido.detalles.any(DetallePedido._estado != estado))
+            .order_by(Pedido.id))
+
+
+def consulta_mesas_bloqueadas(mesa_ids):
+    # Mesas con bloqueo de fila, en orden de id para que dos transacciones no se esperen en cruz;
+    # populate_existing: el resumen que se suma es el de la base tras el bloqueo, no el de la sesión
+    return (select(Mesa).where(Mesa.id.in_(sorted(mesa_ids))).order_by(Mesa.id)
+            .with_for_update().execution_options(populate_existing=True))
+
+
+# Segundos tras un commit propio durante los que las lecturas siguen yendo al primario, para no
+# leer de una réplica que todavía no recibió esa escritura
+VENTANA_LECTURA_PROPIA = 2.0
+
 
 class Repository:
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, lectura: Session = None, ventana_propia=VENTANA_LECTURA_PROPIA):
+        # lectura: sesión opcional sobre una réplica; listados y reportes se leen de ella
+        # (ver session_lectura) y todo lo demás, incluidas las escrituras, va a session
         self.session = session
+        self.lectura = lectura
+        self.ventana_propia = ventana_propia
+        self._profundidad_uow = 0
+        self._primario = 0
+        self._ultimo_commit = None
+
+    @property
+    def session_lectura(self):
+        # La réplica, salvo dentro de una unidad de trabajo, con cambios sin confirmar, dentro de
+        # leer_del_primario() o poco después de un commit propio (leer lo que uno mismo escribió)
+        if self.lectura is None or self._primario or self.en_unidad_de_trabajo:
+            return self.session
+        if self.session.new or self.session.dirty or self.session.deleted:
+            return self.session
+        if self._ultimo_commit is not None and time.monotonic() - self._ultimo_commit < self.ventana_propia:
+            return self.session
+        return self.lectura
+
+    def terminar_lectura(self):
+        # Cierra la transacción abierta en la réplica: en REPEATABLE READ (InnoDB) una transacción ve
+        # la foto de su primera consulta, así que una sesión larga dejaría de ver pedidos nuevos
+        if self.lectura is not None:
+            self.lectura.rollback()
+
+    @contextmanager
+    def leer_del_primario(self):
+        # Fuerza las lecturas al primario dentro del bloque
+        self._primario += 1
+        try:
+            yield self
+        finally:
+            self._primario -= 1
+
+    @property
+    def en_unidad_de_trabajo(self):
+        return self._profundidad_uow > 0
+
+    @contextmanager
+    def unit_of_work(self):
+        # El bloque más externo confirma una sola vez al salir; los anidados son savepoints
+        if self.en_unidad_de_trabajo:
+            self._profundidad_uow += 1
+            try:
+                with self.session.begin_nested():
+                    yield self
+            finally:
+                self._profundidad_uow -= 1
+            return
+        self._profundidad_uow = 1
+        try:
+            yield self
+            self.session.commit()
+            self._ultimo_commit = time.monotonic()
+        except BaseException:
+            self.session.rollback()
+            raise
+        finally:
+            self._profundidad_uow = 0
+
+    def _confirmar(self):
+        # Fuera de una unidad de trabajo cada operación se confirma de inmediato
+        if not self.en_unidad_de_trabajo:
+            self.session.commit()
+            self._ultimo_commit = time.monotonic()
 
     def add(self, entity):
         self.session.add(entity)
-        self.session.commit()
+        self._confirmar()
+
+    def bulk_add(self, entity_class, filas):
+        # INSERT por lotes (executemany) a partir de diccionarios, sin instanciar entidades
+        if filas:
+            self.session.execute(insert(entity_class), filas)
+        self._confirmar()
 
     def get(self, entity_class, id):
         return self.session.query(entity_class).get(id)
 
     def get_all(self, entity_class):
-        return self.session.query(entity_class).all()
+        return self.session_lectura.query(entity_class).all()
+
+    @staticmethod
+    def _seleccion(entity_class, condiciones, iguales, columnas):
+        # condiciones: expresiones SQL; iguales: atributo=valor; columnas: proyección en lugar de entidades
+        consulta = select(*columnas).select_from(entity_class) if columnas else select(entity_class)
+        return consulta.where(*condiciones, *(getattr(entity_class, nombre) == valor
+                                              for nombre, valor in iguales.items()))
+
+    def transmitir(self, consulta, tamano_lote=500, entidades=False):
+        # Filas por lotes desde el cursor (yield_per) en lugar de una lista completa
+        resultado = self.session_lectura.execute(consulta.execution_options(yield_per=tamano_lote))
+        yield from (resultado.scalars() if entidades else resultado)
+
+    def iter_all(self, entity_class, *condiciones, columnas=(), orden=None, tamano_lote=500, **iguales):
+        # Como get_all pero filtrado en SQL y por flujo. Para mostrar: las entidades pueden venir de
+        # la réplica; lo que se vaya a modificar se carga con get
+        consulta = self._seleccion(entity_class, condiciones, iguales, columnas)
+        consulta = consulta.order_by(entity_class.id if orden is None else orden)
+        return self.transmitir(consulta, tamano_lote, entidades=not columnas)
+
+    def get_pagina(self, entity_class, *condiciones, despues_de_id=None, limite=50, columnas=(), **iguales):
+        # Paginación por clave: pasar el id de la última fila recibida como despues_de_id
+        consulta = self._seleccion(entity_class, condiciones, iguales, columnas)
+        if despues_de_id is not None:
+            consulta = consulta.where(entity_class.id > despues_de_id)
+        resultado = self.session_lectura.execute(consulta.order_by(entity_class.id).limit(limite))
+        return resultado.all() if columnas else resultado.scalars().all()
 
     def get_by_codigo(self, entity_class, codigo):
         return self.session.query(entity_class).filter_by(_codigo=codigo).first()
 
-    def get_by_numero(self, entity_class, numero):
-        return self.session.query(entity_class).filter_by(_numero=numero).first()
+    def get_by_numero(self, entity_class, numero, bloquear=False):
+        # bloquear=True toma un bloqueo de fila (SELECT ... FOR UPDATE) hasta el fin de la transacción y
+        # refresca la entidad si ya estaba en la sesión: lo que se valida es lo que hay tras el bloqueo
+        consulta = self.session.query(entity_class).filter_by(_numero=numero)
+        if bloquear:
+            consulta = consulta.with_for_update().populate_existing()
+        return consulta.first()
+
+    def get_cola_pedidos(self, estados=ESTADOS_COLA, mesa_numero=None, categoria=None,
+                         despues_de_id=None, limite=50):
+        return self.session_lectura.scalars(
+            consulta_cola_pedidos(estados, mesa_numero, categoria, despues_de_id, limite)).all()
+
+    def get_cola_lectura(self, estados=ESTADOS_COLA, mesa_numero=None, categoria=None,
+                         despues_de_id=None, limite=50):
+        # Como get_cola_pedidos pero con modelos de lectura en lugar de entidades; también dos consultas
+        session = self.session_lectura
+        filas = session.execute(
+            consulta_cola_lectura(estados, mesa_numero, categoria, despues_de_id, limite)).all()
+        if not filas:
+            return []
+        detalles = {fila[0]: [] for fila in filas}
+        for fila in session.execute(consulta_detalles_cola(list(detalles))):
+            detalles[fila[1]].append(DetalleCola(*fila))
+        return [PedidoCola(*fila, detalles[fila[0]]) for fila in filas]
+
+    def get_detalles_cambiables(self, estados):
+        return self.session_lectura.execute(consulta_detalles_cambiables(estados)).all()
+
+    def get_pedidos_por_facturar(self, mesa_id):
+        return self.session.execute(consulta_pedidos_por_facturar(mesa_id)).all()
+
+    def get_items_por_facturar(self, mesa_id):
+        return self.session.execute(consulta_items_por_facturar(mesa_id)).all()
+
+    def get_detalles_por_avanzar(self, condicion, origenes):
+        return self.session.execute(consulta_detalles_por_avanzar(condicion, origenes)).all()
+
+    def get_detalles_pendientes(self, producto_ids, estado=EstadoPedido.PEDIDO_REALIZADO, limite=1):
+        return self.session.execute(consulta_detalles_pendientes(producto_ids, estado, limite)).all()
+
+    def get_tiempos_preparacion(self):
+        return self.session_lectura.execute(consulta_tiempos_preparacion()).all()
+
+    def get_pedidos_completos(self, pedido_ids, estado, origenes):
+        return self.session.execute(consulta_pedidos_completos(pedido_ids, estado, origenes)).all()
+
+    def get_mesas_bloqueadas(self, mesa_ids):
+        return self.session.scalars(consulta_mesas_bloqueadas(mesa_ids)).all()
+
+    def flush(self):
+        self.session.flush()
 
     def update(self, entity):
-        self.session.commit()
+        self._confirmar()
+
+    def bulk_update(self, entity_class, filas):
+        # UPDATE por lotes según clave primaria: cada diccionario debe incluir "id"
+        if filas:
+            self.session.execute(update(entity_class), filas)
+        self._confirmar()
+
+    def bulk_update_where(self, entity_class, condicion, valores):
+        # Un solo UPDATE ... WHERE; los objetos de la sesión afectados se sincronizan
+        self.session.execute(update(entity_class).where(condicion).values(**valores))
+        self._confirmar()
 
     def delete(self, entity):
         self.session.delete(entity)
-        self.session.commit()
\ No newline at end of file
+        self._confirmar()
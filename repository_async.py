@@ -0,0 +1,115 @@
+from contextlib import asynccontextmanager
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ESTADOS_COLA
+from repository import (consulta_cola_pedidos, consulta_pedidos_por_facturar, consulta_items_por_facturar,
+                        consulta_detalles_por_avanzar, consulta_pedidos_completos, consulta_mesas_bloqueadas)
+
+# Variante asyncio de Repository. En asyncio no hay carga perezosa de relaciones:
+# las relaciones que se vayan a recorrer se piden con opciones de carga (selectinload, joinedload).
+
+class AsyncRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self._profundidad_uow = 0
+
+    @property
+    def en_unidad_de_trabajo(self):
+        return self._profundidad_uow > 0
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        # El bloque más externo confirma una sola vez al salir; los anidados son savepoints
+        if self.en_unidad_de_trabajo:
+            self._profundidad_uow += 1
+            try:
+                async with self.session.begin_nested():
+                    yield self
+            finally:
+                self._profundidad_uow -= 1
+            return
+        self._profundidad_uow = 1
+        try:
+            yield self
+            await self.session.commit()
+        except BaseException:
+            await self.session.rollback()
+            raise
+        finally:
+            self._profundidad_uow = 0
+
+    async def _confirmar(self):
+        # Fuera de una unidad de trabajo cada operación se confirma de inmediato
+        if not self.en_unidad_de_trabajo:
+            await self.session.commit()
+
+    async def add(self, entity):
+        self.session.add(entity)
+        await self._confirmar()
+
+    async def bulk_add(self, entity_class, filas):
+        if filas:
+            await self.session.execute(insert(entity_class), filas)
+        await self._confirmar()
+
+    async def get(self, entity_class, id, opciones=()):
+        return await self.session.get(entity_class, id, options=opciones)
+
+    async def get_many(self, entity_class, ids):
+        ids = set(ids)
+        if not ids:
+            return {}
+        entidades = await self.session.scalars(select(entity_class).where(entity_class.id.in_(ids)))
+        return {entidad.id: entidad for entidad in entidades}
+
+    async def get_all(self, entity_class, opciones=()):
+        return (await self.session.scalars(select(entity_class).options(*opciones))).all()
+
+    async def get_by_codigo(self, entity_class, codigo):
+        consulta = select(entity_class).filter_by(_codigo=codigo).limit(1)
+        return (await self.session.scalars(consulta)).first()
+
+    async def get_by_numero(self, entity_class, numero, opciones=(), bloquear=False):
+        consulta = select(entity_class).filter_by(_numero=numero).options(*opciones).limit(1)
+        if bloquear:
+            consulta = consulta.with_for_update().execution_options(populate_existing=True)
+        return (await self.session.scalars(consulta)).first()
+
+    async def get_cola_pedidos(self, estados=ESTADOS_COLA, mesa_numero=None, categoria=None,
+                               despues_de_id=None, limite=50):
+        consulta = consulta_cola_pedidos(estados, mesa_numero, categoria, despues_de_id, limite)
+        return (await self.session.scalars(consulta)).all()
+
+    async def get_pedidos_por_facturar(self, mesa_id):
+        return (await self.session.execute(consulta_pedidos_por_facturar(mesa_id))).all()
+
+    async def get_items_por_facturar(self, mesa_id):
+        return (await self.session.execute(consulta_items_por_facturar(mesa_id))).all()
+
+    async def get_detalles_por_avanzar(self, condicion, origenes):
+        return (await self.session.execute(consulta_detalles_por_avanzar(condicion, origenes))).all()
+
+    async def get_pedidos_completos(self, pedido_ids, estado, origenes):
+        return (await self.session.execute(consulta_pedidos_completos(pedido_ids, estado, origenes))).all()
+
+    async def get_mesas_bloqueadas(self, mesa_ids):
+        return (await self.session.scalars(consulta_mesas_bloqueadas(mesa_ids))).all()
+
+    async def flush(self):
+        await self.session.flush()
+
+    async def update(self, entity):
+        await self._confirmar()
+
+    async def bulk_update(self, entity_class, filas):
+        if filas:
+            await self.session.execute(update(entity_class), filas)
+        await self._confirmar()
+
+    async def bulk_update_where(self, entity_class, condicion, valores):
+        await self.session.execute(update(entity_class).where(condicion).values(**valores))
+        await self._confirmar()
+
+    async def delete(self, entity):
+        await self.session.delete(entity)
+        await self._confirmar()
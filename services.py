@@ -1,184 +1,344 @@
-from models import Mesa, Pedido, DetallePedido, Producto, Factura, DetalleFactura
-from repository import Repository
+from collections import Counter
+from models import Mesa, Pedido, DetallePedido, Factura, DetalleFactura
+from repository import Repository, condicion_detalles
+from catalogo import ProductCatalog
+from estados import EstadoPedido, MAQUINA_DETALLE, MAQUINA_PEDIDO
+from eventos import (BusEventos, bus_eventos, PedidoCreado, PedidoCambiado, DetalleCambiado,
+                     DetallesAvanzados, MesaCambiada, MesaFacturada, ResumenMesaCambiado)
 from datetime import datetime
+from instrumentacion import medido
+
+
+# Reglas de negocio compartidas por los servicios síncronos y los de services_async.py.
+# Trabajan sobre entidades ya cargadas y no acceden a la base.
+
+def validar_mesa_para_pedido(mesa, mesa_numero):
+    if not mesa:
+        raise ValueError(f"Mesa {mesa_numero} no existe.")
+    if mesa.estado == "Ocupada":
+        raise ValueError("La mesa ya está ocupada.")
+
+
+def validar_lineas_pedido(productos, existe_producto):
+    for prod_id, cantidad in productos:
+        if not existe_producto(prod_id):
+            raise ValueError(f"Producto con ID {prod_id} no existe.")
+        if cantidad <= 0:
+            raise ValueError("La cantidad debe ser mayor que cero.")
+
+
+def filas_detalle_pedido(pedido_id, productos):
+    # Una fila por producto con su cantidad; las líneas repetidas del mismo producto se suman
+    cantidades = {}
+    for prod_id, cantidad in productos:
+        cantidades[prod_id] = cantidades.get(prod_id, 0) + cantidad
+    ahora = datetime.now()
+    return [
+        {
+            "_pedido_id": pedido_id,
+            "_producto_id": prod_id,
+            "_estado": EstadoPedido.PEDIDO_REALIZADO,
+            "_fecha_creacion": ahora,
+            "_cantidad": cantidad,
+        }
+        for prod_id, cantidad in cantidades.items()
+    ]
+
+
+def importe_pedido(productos, precio):
+    # Importe de las líneas con el precio vigente al tomar el pedido; precio(prod_id) puede ser None
+    return sum(cantidad * (precio(prod_id) or 0.0) for prod_id, cantidad in productos)
+
+
+def aplicar_estado_pedido(pedido, nuevo_estado):
+    # Lleva el pedido y todos sus detalles a nuevo_estado y devuelve True (quedan sincronizados).
+    # ValueError si el estado no existe o la máquina de estados no permite la transición.
+    destino = EstadoPedido.desde(nuevo_estado)
+    if destino not in MAQUINA_DETALLE.estados or not MAQUINA_PEDIDO.permite(pedido.estado, destino):
+        raise ValueError(f"El pedido {pedido.id} no puede pasar de '{pedido.estado}' a '{nuevo_estado}'.")
+    if not pedido.detalles:
+        raise ValueError(f"El pedido {pedido.id} no tiene detalles.")
+    for detalle in pedido.detalles:
+        if detalle.estado < destino:
+            detalle._cambiar_estado(destino)
+    pedido._cambiar_estado(destino)
+    return True
+
+
+def progreso_detalles(pedido):
+    # Estado y unidades por estado de cada detalle, para comparar antes y después de un cambio
+    return {d.id: d.unidades_por_estado() for d in pedido.detalles}
+
+
+def eventos_cambio_estado(pedido, progreso_antes, sincronizado):
+    # progreso_antes: resultado de progreso_detalles() tomado antes de aplicar el cambio
+    eventos = [DetalleCambiado(d.id, pedido.id, d.estado, d.unidades_por_estado())
+               for d in pedido.detalles if d.unidades_por_estado() != progreso_antes.get(d.id)]
+    if sincronizado:
+        eventos.append(PedidoCambiado(pedido.id, pedido.estado))
+    return eventos
+
+
+def eventos_facturacion(mesa, factura, pedido_ids):
+    eventos = [PedidoCambiado(pedido_id, EstadoPedido.FACTURADO) for pedido_id in pedido_ids]
+    eventos.append(MesaFacturada(mesa.numero, factura.id, factura._total))
+    eventos.append(MesaCambiada(mesa.numero, mesa.estado))
+    return eventos
+
+
+def aplicar_estado_detalle(pedido, detalle, nuevo_estado, unidades=None):
+    nuevo_estado = EstadoPedido.desde(nuevo_estado)
+    detalle._cambiar_estado(nuevo_estado, unidades)
+    if all(d.estado == nuevo_estado for d in pedido.detalles):
+        pedido._cambiar_estado(nuevo_estado)
+        return True
+    return False
+
+
+def finalizo(pedido, estado_antes):
+    return estado_antes != EstadoPedido.FINALIZADO and pedido.estado == EstadoPedido.FINALIZADO
+
+
+def evento_resumen(mesa):
+    return ResumenMesaCambiado(mesa.id, mesa._version_resumen, mesa.estado, mesa._pedidos_abiertos,
+                               mesa._pedidos_finalizados, mesa._importe_abierto)
+
+
+def resumen_finalizados(mesas, mesa_ids):
+    # mesas: las de mesa_ids, bloqueadas (get_mesas_bloqueadas); mesa_ids: la mesa de cada pedido que
+    # acaba de pasar a "Finalizado", con repeticiones. Suma los finalizados y devuelve un evento por mesa
+    por_mesa = Counter(mesa_ids)
+    for mesa in mesas:
+        mesa._sumar_resumen(finalizados=por_mesa[mesa.id])
+    return [evento_resumen(mesa) for mesa in mesas]
+
+
+def resumen_facturados(mesa, pedidos_facturados):
+    # Descuenta del resumen de la mesa (bloqueada) los pedidos que se acaban de facturar
+    importe = sum(pedido._importe or 0.0 for pedido in pedidos_facturados)
+    cantidad = len(pedidos_facturados)
+    mesa._sumar_resumen(-cantidad, -cantidad, -importe)
+    return evento_resumen(mesa)
+
+
+def condicion_avance_masivo(nuevo_estado, pedido_id=None, mesa_numero=None, producto_id=None, categoria=None,
+                            detalle_ids=None):
+    # Devuelve (estado destino, condición SQL) de un cambio masivo de detalles
+    destino = EstadoPedido.desde(nuevo_estado)
+    if destino not in MAQUINA_DETALLE.estados or not MAQUINA_DETALLE.origenes(destino):
+        raise ValueError(f"Estado '{nuevo_estado}' no válido para un cambio masivo.")
+    condicion = condicion_detalles(pedido_id, mesa_numero, producto_id, categoria, detalle_ids)
+    if condicion is None:
+        raise ValueError("Indique al menos un filtro: pedido, mesa, producto, categoría o detalles.")
+    return destino, condicion
+
+
+def eventos_avance_masivo(destino, filas, pedidos_completos):
+    # filas: (id, _pedido_id) de los detalles que avanzaron
+    eventos = [DetallesAvanzados(destino, tuple(fila.id for fila in filas),
+                                 tuple(sorted({fila._pedido_id for fila in filas})))]
+    eventos.extend(PedidoCambiado(pedido_id, destino) for pedido_id in pedidos_completos)
+    return eventos
+
+
+def valores_facturado(pedido_ids):
+    # Condición y valores del UPDATE masivo a "Facturado": solo desde los estados que la
+    # máquina de estados permite, así un pedido no finalizado no se factura por error
+    condicion = Pedido.id.in_(pedido_ids) & Pedido._estado.in_(MAQUINA_PEDIDO.origenes(EstadoPedido.FACTURADO))
+    return condicion, {"_estado": EstadoPedido.FACTURADO}
+
+
+def items_factura(filas_items):
+    # Filas agregadas por producto de get_items_por_facturar
+    return {
+        fila.producto_id: {
+            "nombre": fila.nombre,
+            "cantidad": fila.cantidad,
+            "precio_unitario": fila.precio_unitario,
+            "pedido_id": fila.pedido_id,
+        }
+        for fila in filas_items
+    }
+
+
+def filas_detalle_factura(factura_id, items):
+    return [
+        {
+            "_factura_id": factura_id,
+            "_pedido_id": info["pedido_id"],
+            "_producto_id": prod_id,
+            "_cantidad": info["cantidad"],
+            "_precio_unitario": info["precio_unitario"],
+            "_subtotal": info["cantidad"] * info["precio_unitario"],
+        }
+        for prod_id, info in items.items()
+    ]
+
+
+def imprimir_factura(mesa_numero, mesero_nombre, fecha_pedido, items, total):
+    print("\n===== FACTURA =====")
+    print(f"Mesa: {mesa_numero}")
+    print(f"Mesero: {mesero_nombre}")
+    print(f"Fecha del pedido: {fecha_pedido:%Y-%m-%d %H:%M:%S}")
+    print("\nDetalle de Ítems:")
+    print("{:<30s} {:>5s} {:>10s} {:>10s}".format("Producto", "Cant", "Precio", "Subtotal"))
+    for info in items.values():
+        subtotal_display = info["cantidad"] * info["precio_unitario"]
+        print("{:<30s} {:>5d} {:>10.2f} {:>10.2f}".format(
+            info["nombre"],
+            info["cantidad"],
+            info["precio_unitario"],
+            subtotal_display))
+    print("-" * 60)
+    print(f"Total: S/. {total:.2f}")
 
 class PedidoService:
-    def __init__(self, repo: Repository):
+    def __init__(self, repo: Repository, catalogo: ProductCatalog = None, bus: BusEventos = None):
         self.repo = repo
+        self.catalogo = catalogo or ProductCatalog(repo)
+        self.bus = bus or bus_eventos
 
+    @medido
     def crear_pedido(self, mesa_numero: int, mesero_id: int, productos: list):
-        try:
-            mesa = self.repo.get_by_numero(Mesa, mesa_numero)
-            if not mesa:
-                raise ValueError(f"Mesa {mesa_numero} no existe.")
-            if mesa.estado == "Ocupada":
-                raise ValueError("La mesa ya está ocupada.")
-
-            # Crear el pedido
-            pedido = Pedido(_mesa_id=mesa.id, _mesero_id=mesero_id)
-            self.repo.add(pedido)  # Guardar el pedido para obtener su ID
-
-            # Crear los detalles del pedido
-            for prod_id, cantidad in productos:
-                producto = self.repo.get(Producto, prod_id)
-                if not producto:
-                    raise ValueError(f"Producto con ID {prod_id} no existe.")
-                if cantidad <= 0:
-                    raise ValueError("La cantidad debe ser mayor que cero.")
-
-                for _ in range(cantidad):
-                    detalle = DetallePedido(
-                        _pedido_id=pedido.id,
-                        _producto_id=prod_id,
-                        _estado="Pedido realizado",
-                        _fecha_creacion=datetime.now()
-                    )
-                    self.repo.add(detalle)  # Guardar el detalle en la base de datos
-                    pedido.detalles.append(detalle)  # Asociar el detalle al pedido
-
-            # Cambiar el estado de la mesa a "Ocupada"
+        with self.repo.unit_of_work():
+            # Bloqueo de la fila de la mesa: dos terminales no pueden abrir pedidos a la vez en la misma mesa
+            mesa = self.repo.get_by_numero(Mesa, mesa_numero, bloquear=True)
+            validar_mesa_para_pedido(mesa, mesa_numero)
+
+            # Validar todas las líneas antes de escribir, contra el catálogo en memoria
+            validar_lineas_pedido(productos, lambda prod_id: prod_id in self.catalogo)
+
+            # Crear el pedido (flush para obtener su ID sin confirmar la transacción)
+            importe = importe_pedido(productos, lambda prod_id: self.catalogo.get(prod_id).precio)
+            pedido = Pedido(_mesa_id=mesa.id, _mesero_id=mesero_id, _importe=importe)
+            self.repo.add(pedido)
+            self.repo.flush()
+            pedido_id = pedido.id
+
+            # Crear los detalles del pedido con un único INSERT por lotes
+            filas_detalle = filas_detalle_pedido(pedido_id, productos)
+            self.repo.bulk_add(DetallePedido, filas_detalle)
+
+            # Cambiar el estado de la mesa a "Ocupada"; todo se confirma al cerrar la unidad de trabajo
             mesa._cambiar_estado("Ocupada")
+            mesa._sumar_resumen(pedidos=1, importe=importe)
             self.repo.update(mesa)
+            self.bus.publicar_al_confirmar(self.repo.session,
+                                           PedidoCreado(pedido_id, mesa_numero, mesero_id,
+                                                        sum(fila["_cantidad"] for fila in filas_detalle)),
+                                           MesaCambiada(mesa_numero, mesa.estado), evento_resumen(mesa))
 
-            print(f"Pedido {pedido.id} creado con {len(pedido.detalles)} detalle(s) para la mesa {mesa_numero}.")
-        except Exception as e:
-            self.repo.session.rollback()
-            raise e
+        unidades = sum(fila["_cantidad"] for fila in filas_detalle)
+        print(f"Pedido {pedido_id} creado con {len(filas_detalle)} línea(s) y {unidades} unidad(es) para la mesa {mesa_numero}.")
+        return pedido
 
+    @medido
     def cambiar_estado(self, pedido_id: int, nuevo_estado: str):
-        try:
+        with self.repo.unit_of_work():
             pedido = self.repo.get(Pedido, pedido_id)
             if not pedido:
                 raise ValueError("Pedido no encontrado.")
-            detalles_actualizados = False
-            allowed_states = ["Pedido realizado", "En preparación", "Entregado", "Finalizado"]
-            for detalle in pedido.detalles:
-                if detalle.estado in allowed_states:
-                    detalle._cambiar_estado(nuevo_estado)
-                    self.repo.update(detalle)
-                    detalles_actualizados = True
-            if detalles_actualizados and all(d.estado == nuevo_estado for d in pedido.detalles):
-                pedido._cambiar_estado(nuevo_estado)
-                self.repo.update(pedido)
-                print(f"Pedido {pedido_id} y todos sus detalles actualizados a '{nuevo_estado}'.")
-            else:
-                print(f"Algunos detalles del pedido {pedido_id} no se pudieron actualizar.")
-        except Exception as e:
-            self.repo.session.rollback()
-            raise e
+            progreso_antes, estado_antes = progreso_detalles(pedido), pedido.estado
+            sincronizado = aplicar_estado_pedido(pedido, nuevo_estado)
+            self.bus.publicar_al_confirmar(self.repo.session,
+                                           *eventos_cambio_estado(pedido, progreso_antes, sincronizado))
+            if finalizo(pedido, estado_antes):
+                self._registrar_finalizados([pedido._mesa_id])
+            self.repo.update(pedido)
+        print(f"Pedido {pedido_id} y todos sus detalles actualizados a '{nuevo_estado}'.")
 
-    def cambiar_estado_detalle(self, detalle_id: int, nuevo_estado: str):
-        try:
+    @medido
+    def cambiar_estado_detalle(self, detalle_id: int, nuevo_estado: str, unidades: int = None):
+        with self.repo.unit_of_work():
             detalle = self.repo.get(DetallePedido, detalle_id)
             if not detalle:
                 raise ValueError("Detalle de pedido no encontrado.")
-            detalle._cambiar_estado(nuevo_estado)
-            self.repo.update(detalle)
             pedido = self.repo.get(Pedido, detalle._pedido_id)
-            if all(d.estado == nuevo_estado for d in pedido.detalles):
-                pedido._cambiar_estado(nuevo_estado)
+            progreso_antes, estado_antes = progreso_detalles(pedido), pedido.estado
+            sincronizado = aplicar_estado_detalle(pedido, detalle, nuevo_estado, unidades)
+            self.bus.publicar_al_confirmar(self.repo.session,
+                                           *eventos_cambio_estado(pedido, progreso_antes, sincronizado))
+            if finalizo(pedido, estado_antes):
+                self._registrar_finalizados([pedido._mesa_id])
+            if sincronizado:
                 self.repo.update(pedido)
                 print(f"Detalle {detalle_id} y pedido {pedido.id} sincronizados a '{nuevo_estado}'.")
             else:
                 print(f"Estado del detalle {detalle_id} actualizado a '{nuevo_estado}'.")
-        except Exception as e:
-            self.repo.session.rollback()
-            raise e
 
+    @medido
+    def avanzar_detalles(self, nuevo_estado, pedido_id=None, mesa_numero=None, producto_id=None, categoria=None,
+                         detalle_ids=None):
+        # Cambio masivo por pedido, mesa, producto, categoría o ids de detalle: un UPDATE para los detalles (con las
+        # fechas calculadas en SQL) y otro para los pedidos que quedan completos, sin cargar entidades.
+        # Devuelve el número de detalles que avanzaron.
+        destino, condicion = condicion_avance_masivo(nuevo_estado, pedido_id, mesa_numero, producto_id, categoria,
+                                                     detalle_ids)
+        origenes = MAQUINA_DETALLE.origenes(destino)
+        with self.repo.unit_of_work():
+            filas = self.repo.get_detalles_por_avanzar(condicion, origenes)
+            if filas:
+                ahora = datetime.now()
+                self.repo.bulk_update_where(
+                    DetallePedido,
+                    DetallePedido.id.in_([fila.id for fila in filas]) & DetallePedido._estado.in_(origenes),
+                    DetallePedido._valores_avance(destino, ahora))
+                completos = self.repo.get_pedidos_completos({fila._pedido_id for fila in filas}, destino,
+                                                            MAQUINA_PEDIDO.origenes(destino))
+                if completos:
+                    self.repo.bulk_update_where(Pedido, Pedido.id.in_([p.id for p in completos]),
+                                                MAQUINA_PEDIDO.valores_sql(Pedido, destino, ahora))
+                    if destino == EstadoPedido.FINALIZADO:
+                        self._registrar_finalizados([p._mesa_id for p in completos])
+                self.bus.publicar_al_confirmar(self.repo.session, *eventos_avance_masivo(
+                    destino, filas, [p.id for p in completos]))
+        print(f"{len(filas)} detalle(s) pasaron a '{destino}'.")
+        return len(filas)
+
+    def _registrar_finalizados(self, mesa_ids):
+        mesas = self.repo.get_mesas_bloqueadas(set(mesa_ids))
+        self.bus.publicar_al_confirmar(self.repo.session, *resumen_finalizados(mesas, mesa_ids))
 
 
 class FacturaService:
-    def __init__(self, repo: Repository):
+    def __init__(self, repo: Repository, bus: BusEventos = None):
         self.repo = repo
+        self.bus = bus or bus_eventos
 
+    @medido
     def facturar_mesa(self, mesa_numero: int):
-        try:
-            mesa = self.repo.get_by_numero(Mesa, mesa_numero)
+        with self.repo.unit_of_work():
+            # Bloqueo de la fila de la mesa: un segundo cajero espera y luego no encuentra qué facturar
+            mesa = self.repo.get_by_numero(Mesa, mesa_numero, bloquear=True)
             if not mesa:
                 raise ValueError(f"Mesa {mesa_numero} no existe.")
 
-            pedidos_finalizados = [p for p in mesa.pedidos if p.estado == "Finalizado"]
+            pedidos_finalizados = self.repo.get_pedidos_por_facturar(mesa.id)
             if not pedidos_finalizados:
                 raise ValueError("No hay pedidos finalizados para facturar.")
+            items = items_factura(self.repo.get_items_por_facturar(mesa.id))
+            pedido_ids = [pedido.id for pedido in pedidos_finalizados]
+            fecha_pedido = pedidos_finalizados[0]._fecha_inicio
+            mesero_nombre = next((p.mesero_nombre for p in pedidos_finalizados if p.mesero_nombre), "")
 
-            items = {}
-            fecha_pedido = None
-            mesero_nombre = ""
-            for pedido in pedidos_finalizados:
-                if not fecha_pedido:
-                    fecha_pedido = pedido._fecha_inicio
-                if not mesero_nombre and pedido.mesero:
-                    mesero_nombre = pedido.mesero.nombre
-                for detalle in pedido.detalles:
-                    prod = detalle.producto
-                    if not prod:
-                        continue
-                    precio = prod.precio if prod.precio is not None else 0.0
-                    if prod.id not in items:
-                        items[prod.id] = {
-                            "nombre": prod.nombre,
-                            "cantidad": 0,
-                            "precio_unitario": precio,
-                            "pedido_id": pedido.id
-                        }
-                    else:
-                        if items[prod.id]["precio_unitario"] is None:
-                            items[prod.id]["precio_unitario"] = precio
-                    items[prod.id]["cantidad"] += 1
-
+            total = sum(info["cantidad"] * info["precio_unitario"] for info in items.values())
             factura = Factura(
                 _mesa_id=mesa.id,
                 _mesero_id=pedidos_finalizados[0]._mesero_id,
                 _fecha_hora=datetime.now(),
-                _total=0
+                _total=total
             )
             self.repo.add(factura)
-            total_fac = 0.0
-
-            for prod_id, info in items.items():
-                cantidad = info["cantidad"]
-                precio_unitario = info["precio_unitario"]
-                subtotal = cantidad * precio_unitario
-                total_fac += subtotal
-
-                detalle_fac = DetalleFactura()
-                detalle_fac._factura_id = factura.id
-                detalle_fac._pedido_id = info["pedido_id"]
-                detalle_fac.producto_id = prod_id
-                # Asignar primero precio_unitario y luego cantidad
-                detalle_fac.precio_unitario = precio_unitario
-                detalle_fac.cantidad = cantidad
-
-                factura.detalles.append(detalle_fac)
-                self.repo.add(detalle_fac)
-
-            factura._total = total_fac
-            self.repo.update(factura)
-
-            # Actualizar el estado de cada pedido finalizado a "Facturado"
-            for pedido in pedidos_finalizados:
-                pedido._estado = "Facturado"
-                self.repo.update(pedido)
+            self.repo.flush()  # Obtener el ID de la factura dentro de la misma transacción
+            self.repo.bulk_add(DetalleFactura, filas_detalle_factura(factura.id, items))
 
-            # Liberar la mesa
+            # Marcar los pedidos como "Facturado" con un solo UPDATE y liberar la mesa
+            self.repo.bulk_update_where(Pedido, *valores_facturado(pedido_ids))
             mesa._cambiar_estado("Libre")
+            resumen = resumen_facturados(mesa, pedidos_finalizados)
             self.repo.update(mesa)
+            self.bus.publicar_al_confirmar(self.repo.session,
+                                           *eventos_facturacion(mesa, factura, pedido_ids), resumen)
 
-            print("\n===== FACTURA =====")
-            print(f"Mesa: {mesa.numero}")
-            print(f"Mesero: {mesero_nombre}")
-            print(f"Fecha del pedido: {fecha_pedido:%Y-%m-%d %H:%M:%S}")
-            print("\nDetalle de Ítems:")
-            print("{:<30s} {:>5s} {:>10s} {:>10s}".format("Producto", "Cant", "Precio", "Subtotal"))
-            for info in items.values():
-                subtotal_display = info["cantidad"] * info["precio_unitario"]
-                print("{:<30s} {:>5d} {:>10.2f} {:>10.2f}".format(
-                    info["nombre"],
-                    info["cantidad"],
-                    info["precio_unitario"],
-                    subtotal_display))
-            print("-" * 60)
-            print(f"Total: S/. {factura._total:.2f}")
-        except Exception as e:
-            self.repo.session.rollback()
-            raise e
\ No newline at end of file
+        imprimir_factura(mesa_numero, mesero_nombre, fecha_pedido, items, total)
+        return factura
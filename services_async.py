@@ -0,0 +1,139 @@
+from datetime import datetime
+from sqlalchemy.orm import selectinload
+from models import Mesa, Pedido, DetallePedido, Producto, Factura, DetalleFactura
+from repository_async import AsyncRepository
+from estados import EstadoPedido, MAQUINA_DETALLE, MAQUINA_PEDIDO
+from services import (condicion_avance_masivo, eventos_avance_masivo, validar_mesa_para_pedido, validar_lineas_pedido, filas_detalle_pedido,
+                      aplicar_estado_pedido, aplicar_estado_detalle, items_factura, progreso_detalles,
+                      filas_detalle_factura, eventos_cambio_estado, eventos_facturacion,
+                      valores_facturado, importe_pedido, finalizo, resumen_finalizados, resumen_facturados,
+                      evento_resumen)
+from eventos import BusEventos, bus_eventos, PedidoCreado, MesaCambiada
+
+# Contrapartes asyncio de PedidoService y FacturaService con las mismas reglas de negocio
+# (las funciones compartidas de services.py). Cada instancia usa su propia AsyncSession:
+# para atender peticiones concurrentes se crea un AsyncRepository por petición.
+# No imprimen; devuelven las entidades creadas o modificadas.
+
+class AsyncPedidoService:
+    def __init__(self, repo: AsyncRepository, bus: BusEventos = None):
+        self.repo = repo
+        self.bus = bus or bus_eventos
+
+    async def crear_pedido(self, mesa_numero: int, mesero_id: int, productos: list):
+        async with self.repo.unit_of_work():
+            mesa = await self.repo.get_by_numero(Mesa, mesa_numero, bloquear=True)
+            validar_mesa_para_pedido(mesa, mesa_numero)
+
+            # Una sola consulta IN para validar todos los productos antes de escribir
+            existentes = await self.repo.get_many(Producto, (prod_id for prod_id, _ in productos))
+            validar_lineas_pedido(productos, lambda prod_id: prod_id in existentes)
+
+            importe = importe_pedido(productos, lambda prod_id: existentes[prod_id]._precio)
+            pedido = Pedido(_mesa_id=mesa.id, _mesero_id=mesero_id, _importe=importe)
+            await self.repo.add(pedido)
+            await self.repo.flush()
+            filas_detalle = filas_detalle_pedido(pedido.id, productos)
+            await self.repo.bulk_add(DetallePedido, filas_detalle)
+
+            mesa._cambiar_estado("Ocupada")
+            mesa._sumar_resumen(pedidos=1, importe=importe)
+            await self.repo.update(mesa)
+            self.bus.publicar_al_confirmar(self.repo.session.sync_session,
+                                           PedidoCreado(pedido.id, mesa_numero, mesero_id,
+                                                        sum(fila["_cantidad"] for fila in filas_detalle)),
+                                           MesaCambiada(mesa_numero, mesa.estado), evento_resumen(mesa))
+        return pedido
+
+    async def cambiar_estado(self, pedido_id: int, nuevo_estado: str):
+        async with self.repo.unit_of_work():
+            pedido = await self.repo.get(Pedido, pedido_id, opciones=[selectinload(Pedido.detalles)])
+            if not pedido:
+                raise ValueError("Pedido no encontrado.")
+            progreso_antes, estado_antes = progreso_detalles(pedido), pedido.estado
+            sincronizado = aplicar_estado_pedido(pedido, nuevo_estado)
+            self.bus.publicar_al_confirmar(self.repo.session.sync_session,
+                                           *eventos_cambio_estado(pedido, progreso_antes, sincronizado))
+            if finalizo(pedido, estado_antes):
+                await self._registrar_finalizados([pedido._mesa_id])
+            await self.repo.update(pedido)
+        return sincronizado
+
+    async def cambiar_estado_detalle(self, detalle_id: int, nuevo_estado: str, unidades: int = None):
+        async with self.repo.unit_of_work():
+            detalle = await self.repo.get(DetallePedido, detalle_id)
+            if not detalle:
+                raise ValueError("Detalle de pedido no encontrado.")
+            pedido = await self.repo.get(Pedido, detalle._pedido_id, opciones=[selectinload(Pedido.detalles)])
+            progreso_antes, estado_antes = progreso_detalles(pedido), pedido.estado
+            sincronizado = aplicar_estado_detalle(pedido, detalle, nuevo_estado, unidades)
+            self.bus.publicar_al_confirmar(self.repo.session.sync_session,
+                                           *eventos_cambio_estado(pedido, progreso_antes, sincronizado))
+            if finalizo(pedido, estado_antes):
+                await self._registrar_finalizados([pedido._mesa_id])
+            await self.repo.update(pedido)
+        return sincronizado
+
+    async def avanzar_detalles(self, nuevo_estado, pedido_id=None, mesa_numero=None, producto_id=None,
+                               categoria=None, detalle_ids=None):
+        destino, condicion = condicion_avance_masivo(nuevo_estado, pedido_id, mesa_numero, producto_id, categoria,
+                                                     detalle_ids)
+        origenes = MAQUINA_DETALLE.origenes(destino)
+        async with self.repo.unit_of_work():
+            filas = await self.repo.get_detalles_por_avanzar(condicion, origenes)
+            if filas:
+                ahora = datetime.now()
+                await self.repo.bulk_update_where(
+                    DetallePedido,
+                    DetallePedido.id.in_([fila.id for fila in filas]) & DetallePedido._estado.in_(origenes),
+                    DetallePedido._valores_avance(destino, ahora))
+                completos = await self.repo.get_pedidos_completos({fila._pedido_id for fila in filas}, destino,
+                                                                  MAQUINA_PEDIDO.origenes(destino))
+                if completos:
+                    await self.repo.bulk_update_where(Pedido, Pedido.id.in_([p.id for p in completos]),
+                                                      MAQUINA_PEDIDO.valores_sql(Pedido, destino, ahora))
+                    if destino == EstadoPedido.FINALIZADO:
+                        await self._registrar_finalizados([p._mesa_id for p in completos])
+                self.bus.publicar_al_confirmar(self.repo.session.sync_session, *eventos_avance_masivo(
+                    destino, filas, [p.id for p in completos]))
+        return len(filas)
+
+    async def _registrar_finalizados(self, mesa_ids):
+        mesas = await self.repo.get_mesas_bloqueadas(set(mesa_ids))
+        self.bus.publicar_al_confirmar(self.repo.session.sync_session, *resumen_finalizados(mesas, mesa_ids))
+
+
+class AsyncFacturaService:
+    def __init__(self, repo: AsyncRepository, bus: BusEventos = None):
+        self.repo = repo
+        self.bus = bus or bus_eventos
+
+    async def facturar_mesa(self, mesa_numero: int):
+        async with self.repo.unit_of_work():
+            mesa = await self.repo.get_by_numero(Mesa, mesa_numero, bloquear=True)
+            if not mesa:
+                raise ValueError(f"Mesa {mesa_numero} no existe.")
+
+            pedidos_finalizados = await self.repo.get_pedidos_por_facturar(mesa.id)
+            if not pedidos_finalizados:
+                raise ValueError("No hay pedidos finalizados para facturar.")
+            items = items_factura(await self.repo.get_items_por_facturar(mesa.id))
+            pedido_ids = [pedido.id for pedido in pedidos_finalizados]
+
+            factura = Factura(
+                _mesa_id=mesa.id,
+                _mesero_id=pedidos_finalizados[0]._mesero_id,
+                _fecha_hora=datetime.now(),
+                _total=sum(info["cantidad"] * info["precio_unitario"] for info in items.values())
+            )
+            await self.repo.add(factura)
+            await self.repo.flush()
+            await self.repo.bulk_add(DetalleFactura, filas_detalle_factura(factura.id, items))
+
+            await self.repo.bulk_update_where(Pedido, *valores_facturado(pedido_ids))
+            mesa._cambiar_estado("Libre")
+            resumen = resumen_facturados(mesa, pedidos_finalizados)
+            await self.repo.update(mesa)
+            self.bus.publicar_al_confirmar(self.repo.session.sync_session,
+                                           *eventos_facturacion(mesa, factura, pedido_ids), resumen)
+        return factura
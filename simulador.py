@@ -0,0 +1,337 @@
+# Simulador de carga del restaurante: meseros y estaciones de cocina simulados, cada uno en su hilo,
+# usando PedidoService y FacturaService como lo haría cada terminal, para medir cuánto personal
+# concurrente soporta el sistema antes de cada temporada.
+# Uso: python simulador.py [meseros] [estaciones] [segundos] [url]
+#      sin url usa un archivo SQLite temporal; para MySQL, p. ej. mysql+pymysql://root:@localhost/carga
+#
+# El reloj del restaurante se comprime: escala es cuántos segundos reales dura un minuto simulado.
+# Los meseros ocupan mesas libres, esperan a que cocina entregue todo, dejan comer a la mesa y la
+# facturan; las estaciones toman el detalle pendiente más antiguo de sus categorías, lo preparan el
+# tiempo de cocina.TIEMPOS_PREPARACION y lo entregan. Cada operación usa su propia sesión, como una petición
+# de la API, y se reintenta ante deadlocks o esperas de bloqueo agotadas.
+#
+# La espera por bloqueos se mide en las sentencias SELECT ... FOR UPDATE y en los intentos que fallan
+# por bloqueo. En SQLite no hay bloqueos de fila: la espera del bloqueo de escritura ocurre dentro del
+# busy timeout del driver y solo se ve cuando se agota.
+
+from contextlib import redirect_stdout
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from catalogo import ProductCatalog
+from cocina import TIEMPOS_PREPARACION, TIEMPO_PREPARACION_POR_DEFECTO
+from database import crear_engine, crear_esquema
+from estados import EstadoPedido
+from eventos import BusEventos, PedidoCambiado
+from indice_mesas import IndiceMesas
+from models import Empleado
+from repository import Repository
+from services import PedidoService, FacturaService
+
+# Minutos simulados que una mesa pasa comiendo y entre acciones de un mesero
+MINUTOS_COMIENDO = 25
+MINUTOS_ENTRE_ACCIONES = 1
+
+# Códigos de error de MySQL: deadlock y espera de bloqueo agotada
+_DEADLOCK_MYSQL = 1213
+_ESPERA_AGOTADA_MYSQL = 1205
+
+
+def tipo_de_conflicto(error):
+    # "deadlock", "espera_agotada" o None si el error no se resuelve reintentando
+    original = getattr(error, "orig", None)
+    codigo = original.args[0] if original is not None and original.args else None
+    mensaje = str(original).lower()
+    if codigo == _DEADLOCK_MYSQL or "deadlock" in mensaje:
+        return "deadlock"
+    if codigo == _ESPERA_AGOTADA_MYSQL or "database is locked" in mensaje or "lock wait timeout" in mensaje:
+        return "espera_agotada"
+    return None
+
+
+def _percentil(ordenados, p):
+    # Percentil por rango más cercano sobre una lista ya ordenada
+    if not ordenados:
+        return 0.0
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100.0 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+class EstadisticasCarga:
+    def __init__(self):
+        self._bloqueo = threading.Lock()
+        self.latencias = {}
+        self.reintentos = {}
+        self.rechazos = {}
+        self.errores = {}
+        self.conflictos = {"deadlock": 0, "espera_agotada": 0}
+        self.colisiones = 0
+        self.bloqueo_ms = 0.0
+
+    def _sumar(self, contador, operacion, cantidad=1):
+        with self._bloqueo:
+            contador[operacion] = contador.get(operacion, 0) + cantidad
+
+    def exito(self, operacion, ms, reintentos):
+        with self._bloqueo:
+            self.latencias.setdefault(operacion, []).append(ms)
+        if reintentos:
+            self._sumar(self.reintentos, operacion, reintentos)
+
+    def conflicto(self, tipo):
+        self._sumar(self.conflictos, tipo)
+
+    def rechazo(self, operacion):
+        self._sumar(self.rechazos, operacion)
+
+    def error(self, operacion):
+        self._sumar(self.errores, operacion)
+
+    def colision(self):
+        with self._bloqueo:
+            self.colisiones += 1
+
+    def espera(self, ms):
+        with self._bloqueo:
+            self.bloqueo_ms += ms
+
+    def reporte(self, segundos):
+        with self._bloqueo:
+            operaciones = {}
+            for operacion in sorted(set(self.latencias) | set(self.rechazos) | set(self.errores)):
+                ordenadas = sorted(self.latencias.get(operacion, ()))
+                operaciones[operacion] = {
+                    "llamadas": len(ordenadas),
+                    "p50_ms": _percentil(ordenadas, 50),
+                    "p95_ms": _percentil(ordenadas, 95),
+                    "p99_ms": _percentil(ordenadas, 99),
+                    "max_ms": ordenadas[-1] if ordenadas else 0.0,
+                    "reintentos": self.reintentos.get(operacion, 0),
+                    "rechazos": self.rechazos.get(operacion, 0),
+                    "errores": self.errores.get(operacion, 0),
+                }
+            minutos = segundos / 60.0
+            pedidos = operaciones.get("crear_pedido", {}).get("llamadas", 0)
+            facturas = operaciones.get("facturar_mesa", {}).get("llamadas", 0)
+            return {
+                "segundos": segundos,
+                "pedidos": pedidos,
+                "facturas": facturas,
+                "pedidos_por_minuto": pedidos / minutos if minutos else 0.0,
+                "facturas_por_minuto": facturas / minutos if minutos else 0.0,
+                "deadlocks": self.conflictos["deadlock"],
+                "esperas_agotadas": self.conflictos["espera_agotada"],
+                "reintentos": sum(self.reintentos.values()),
+                "colisiones_cocina": self.colisiones,
+                "bloqueo_ms": self.bloqueo_ms,
+                "operaciones": operaciones,
+            }
+
+
+class SimuladorCarga:
+    def __init__(self, engine, meseros=6, estaciones=3, escala=0.02, mesas_por_mesero=3,
+                 reintentos=3, semilla=None):
+        self.engine = engine
+        self.num_meseros = meseros
+        self.num_estaciones = estaciones
+        self.escala = escala
+        self.mesas_por_mesero = mesas_por_mesero
+        self.reintentos = reintentos
+        self.semilla = semilla
+        # Sin expirar al confirmar: los ids devueltos por los servicios se leen tras cerrar la sesión
+        self.sesiones = sessionmaker(bind=engine, expire_on_commit=False)
+        self.bus = BusEventos()
+        self.catalogo = ProductCatalog(sesiones=self.sesiones)
+        self.indice = IndiceMesas(sesiones=self.sesiones, bus=self.bus)
+        self.estadisticas = EstadisticasCarga()
+
+    # --- Medición de bloqueos ---
+
+    def _antes(self, conn, cursor, statement, parameters, context, executemany):
+        context._simulador_inicio = time.perf_counter()
+
+    def _despues(self, conn, cursor, statement, parameters, context, executemany):
+        if " FOR UPDATE" in statement:
+            self.estadisticas.espera((time.perf_counter() - context._simulador_inicio) * 1000)
+
+    def _fallo(self, contexto_error):
+        contexto = contexto_error.execution_context
+        inicio = getattr(contexto, "_simulador_inicio", None)
+        if inicio is not None and tipo_de_conflicto(contexto_error.sqlalchemy_exception) is not None:
+            self.estadisticas.espera((time.perf_counter() - inicio) * 1000)
+
+    # --- Operaciones ---
+
+    def _ejecutar(self, operacion, funcion):
+        # funcion(repo) en una sesión propia; devuelve su resultado, o None si fue rechazada o falló
+        inicio = time.perf_counter()
+        for intento in range(self.reintentos + 1):
+            with self.sesiones() as session:
+                try:
+                    resultado = funcion(Repository(session))
+                except OperationalError as e:
+                    tipo = tipo_de_conflicto(e)
+                    if tipo is None:
+                        self.estadisticas.error(operacion)
+                        return None
+                    self.estadisticas.conflicto(tipo)
+                    if intento == self.reintentos:
+                        self.estadisticas.error(operacion)
+                        return None
+                    time.sleep(random.uniform(0, 0.01 * 2 ** intento))
+                    continue
+                except ValueError:
+                    self.estadisticas.rechazo(operacion)
+                    return None
+                except Exception:
+                    self.estadisticas.error(operacion)
+                    return None
+            self.estadisticas.exito(operacion, (time.perf_counter() - inicio) * 1000, intento)
+            return resultado
+
+    def _dormir(self, minutos, azar):
+        time.sleep(minutos * self.escala * azar.uniform(0.7, 1.3))
+
+    def _mesero(self, mesero_id, fin, azar):
+        productos = [producto.id for producto in self.catalogo.productos()]
+        atendiendo = {}  # pedido_id: mesa, mientras cocina no entrega todo
+        comiendo = []  # (momento de pedir la cuenta, pedido_id, mesa)
+        with self.bus.suscribir(tipos=[PedidoCambiado], capacidad=4096) as suscripcion:
+            while time.monotonic() < fin:
+                for evento in suscripcion.pendientes():
+                    if evento.estado == EstadoPedido.ENTREGADO and evento.pedido_id in atendiendo:
+                        cuenta = time.monotonic() + MINUTOS_COMIENDO * self.escala * azar.uniform(0.7, 1.3)
+                        comiendo.append((cuenta, evento.pedido_id, atendiendo.pop(evento.pedido_id)))
+                ahora = time.monotonic()
+                for item in [item for item in comiendo if item[0] <= ahora]:
+                    comiendo.remove(item)
+                    _, pedido_id, mesa = item
+                    self._ejecutar("avanzar_detalles", lambda repo: PedidoService(
+                        repo, self.catalogo, self.bus).avanzar_detalles(EstadoPedido.FINALIZADO, pedido_id=pedido_id))
+                    self._ejecutar("facturar_mesa", lambda repo: FacturaService(repo, self.bus).facturar_mesa(mesa))
+                libres = self.indice.libres()
+                if libres and len(atendiendo) + len(comiendo) < self.mesas_por_mesero:
+                    mesa = azar.choice(libres)
+                    lineas = [(producto_id, azar.randint(1, 3))
+                              for producto_id in azar.sample(productos, azar.randint(1, min(4, len(productos))))]
+                    pedido_id = self._ejecutar("crear_pedido", lambda repo: PedidoService(
+                        repo, self.catalogo, self.bus).crear_pedido(mesa, mesero_id, lineas).id)
+                    if pedido_id is not None:
+                        atendiendo[pedido_id] = mesa
+                self._dormir(MINUTOS_ENTRE_ACCIONES, azar)
+
+    def _estacion(self, categorias, fin, azar):
+        productos = {producto.id: producto.categoria for producto in self.catalogo.productos()
+                     if producto.categoria in categorias}
+        while time.monotonic() < fin:
+            filas = self._ejecutar("detalles_pendientes", lambda repo: repo.get_detalles_pendientes(list(productos)))
+            if not filas:
+                self._dormir(MINUTOS_ENTRE_ACCIONES, azar)
+                continue
+            fila = filas[0]
+            tomados = self._ejecutar("avanzar_detalles", lambda repo: PedidoService(
+                repo, self.catalogo, self.bus).avanzar_detalles(
+                EstadoPedido.EN_PREPARACION, pedido_id=fila._pedido_id, producto_id=fila._producto_id))
+            if not tomados:
+                self.estadisticas.colision()  # Otra estación lo tomó primero
+                continue
+            self._dormir(TIEMPOS_PREPARACION.get(productos[fila._producto_id], TIEMPO_PREPARACION_POR_DEFECTO), azar)
+            self._ejecutar("avanzar_detalles", lambda repo: PedidoService(
+                repo, self.catalogo, self.bus).avanzar_detalles(
+                EstadoPedido.ENTREGADO, pedido_id=fila._pedido_id, producto_id=fila._producto_id))
+
+    def ejecutar(self, segundos):
+        with self.sesiones() as session:
+            meseros = [empleado.id for empleado in Repository(session).get_all(Empleado) if empleado.rol == "Mesero"]
+        categorias = sorted({producto.categoria for producto in self.catalogo.productos()})
+        # Categorías repartidas por turnos; con más estaciones que categorías, varias comparten una
+        # y compiten por los mismos detalles
+        if self.num_estaciones <= len(categorias):
+            por_estacion = [set(categorias[i::self.num_estaciones]) for i in range(self.num_estaciones)]
+        else:
+            por_estacion = [{categorias[i % len(categorias)]} for i in range(self.num_estaciones)]
+        azar = random.Random(self.semilla)
+        semillas = [azar.random() for _ in range(self.num_meseros + self.num_estaciones)]
+        escuchas = (("before_cursor_execute", self._antes), ("after_cursor_execute", self._despues),
+                    ("handle_error", self._fallo))
+        for nombre, funcion in escuchas:
+            event.listen(self.engine, nombre, funcion)
+        inicio = time.perf_counter()
+        fin = time.monotonic() + segundos
+        try:
+            # Los servicios imprimen cada pedido y factura; durante la simulación se descarta
+            with open(os.devnull, "w") as nulo, redirect_stdout(nulo), \
+                    ThreadPoolExecutor(max_workers=self.num_meseros + self.num_estaciones) as ejecutor:
+                tareas = [ejecutor.submit(self._mesero, meseros[i % len(meseros)], fin, random.Random(semillas[i]))
+                          for i in range(self.num_meseros)]
+                tareas += [ejecutor.submit(self._estacion, por_estacion[i], fin,
+                                           random.Random(semillas[self.num_meseros + i]))
+                           for i in range(self.num_estaciones)]
+                for tarea in tareas:
+                    tarea.result()
+        finally:
+            for nombre, funcion in escuchas:
+                event.remove(self.engine, nombre, funcion)
+            self.indice.cerrar()
+        reporte = self.estadisticas.reporte(time.perf_counter() - inicio)
+        reporte.update({"meseros": self.num_meseros, "estaciones": self.num_estaciones,
+                        "backend": self.engine.dialect.name})
+        return reporte
+
+
+def crear_base_simulacion(url=None):
+    # Sin url, un archivo SQLite temporal (cada hilo necesita su propia conexión del pool)
+    from menu import cargar_datos_iniciales
+    ruta = None
+    if url is None:
+        descriptor, ruta = tempfile.mkstemp(suffix=".db")
+        os.close(descriptor)
+        url = f"sqlite:///{ruta}"
+    engine = crear_engine(url)
+    crear_esquema(engine)
+    with sessionmaker(bind=engine)() as session, redirect_stdout(io.StringIO()):
+        cargar_datos_iniciales(Repository(session))
+    return engine, ruta
+
+
+def simular(meseros=6, estaciones=3, segundos=30.0, url=None, escala=0.02, semilla=None):
+    engine, ruta = crear_base_simulacion(url)
+    try:
+        return SimuladorCarga(engine, meseros, estaciones, escala=escala, semilla=semilla).ejecutar(segundos)
+    finally:
+        engine.dispose()
+        if ruta:
+            os.remove(ruta)
+
+
+def imprimir_reporte(r):
+    print(f"\n=== Simulación: {r['meseros']} meseros, {r['estaciones']} estaciones, "
+          f"{r['segundos']:.1f} s sobre {r['backend']} ===")
+    print(f"Pedidos: {r['pedidos']} ({r['pedidos_por_minuto']:.1f}/min) | "
+          f"Facturas: {r['facturas']} ({r['facturas_por_minuto']:.1f}/min)")
+    print(f"Deadlocks: {r['deadlocks']} | Esperas agotadas: {r['esperas_agotadas']} | "
+          f"Reintentos: {r['reintentos']} | Colisiones en cocina: {r['colisiones_cocina']} | "
+          f"Espera por bloqueos: {r['bloqueo_ms']:.1f} ms")
+    print("{:<20s} {:>8s} {:>8s} {:>8s} {:>8s} {:>8s} {:>10s} {:>9s} {:>8s}".format(
+        "Operación", "Llamadas", "p50 ms", "p95 ms", "p99 ms", "máx ms", "Reintentos", "Rechazos", "Errores"))
+    for operacion, o in r["operaciones"].items():
+        print("{:<20s} {:>8d} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>10d} {:>9d} {:>8d}".format(
+            operacion, o["llamadas"], o["p50_ms"], o["p95_ms"], o["p99_ms"], o["max_ms"],
+            o["reintentos"], o["rechazos"], o["errores"]))
+
+
+if __name__ == "__main__":
+    argumentos = sys.argv[1:]
+    imprimir_reporte(simular(
+        meseros=int(argumentos[0]) if len(argumentos) > 0 else 6,
+        estaciones=int(argumentos[1]) if len(argumentos) > 1 else 3,
+        segundos=float(argumentos[2]) if len(argumentos) > 2 else 30.0,
+        url=argumentos[3] if len(argumentos) > 3 else None))
@@ -1,16 +1,98 @@
 # Este archivo contiene pruebas unitarias para validar los servicios.
 
+import asyncio
+import csv
+import gc
+from contextlib import redirect_stderr, redirect_stdout
+import http.client
+import importlib.util
+import io
+import json
+from datetime import date, datetime, timedelta
+import os
+import shutil
+import tempfile
+import threading
 import unittest
-from models import Empleado, Mesa, Producto, Pedido, DetallePedido, Factura
+from unittest import mock
+import numpy as np
+from models import (Base, Empleado, Mesa, Producto, Pedido, DetallePedido, Factura, DetalleFactura,
+                    pedidos_historico, detalles_pedido_historico)
 from repository import Repository
-from services import PedidoService, FacturaService
-from sqlalchemy.orm import Session
+from services import PedidoService, FacturaService, validar_mesa_para_pedido
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+from database import (crear_engine, crear_esquema, configuracion_desde_entorno,
+                      crear_engine_async, crear_esquema_async, sesiones_async)
+from datos_prueba import crear_base_benchmark, crear_base_historial
+from benchmarks import (ContadorSQL, PlanesSQL, benchmark_servicios, benchmark_lecturas, excesos_de_presupuesto,
+                        PRESUPUESTOS_SQL)
+from catalogo import ProductCatalog
+from repository_async import AsyncRepository
+from services_async import AsyncPedidoService, AsyncFacturaService
+from api import RestauranteAPI, crear_servidor
+from reportes import ReporteFacturacion, ReportePedidos
+from archivo import archivar_pedidos
+from analitica import ANCHO_INTERVALO, AnaliticaTiempos
+from exportacion import exportar_facturacion
+from migraciones import (colapsar_detalles_por_cantidad, estados_a_enteros, migrar, resumen_de_mesas,
+                         version_actual, MIGRACIONES)
+from estados import EstadoPedido, MAQUINA_PEDIDO, MAQUINA_DETALLE
+from indice_mesas import IndiceMesas
+from simulador import simular, tipo_de_conflicto
+from menu import ver_disponibilidad_mesas
+from cocina import (FACTOR_UNIDAD_EXTRA, MINUTOS_POR_DEFECTO, Pendiente, PlanificadorCocina, TiemposPreparacion,
+                    armar_lotes, comparar_politicas)
+from instrumentacion import Instrumentacion, activar_desde_entorno, instrumentacion
+from eventos import (BusEventos, PedidoCreado, PedidoCambiado, DetalleCambiado, DetallesAvanzados,
+                     MesaCambiada, MesaFacturada, ResumenMesaCambiado)
+
+def a_la_vez(engine, operacion, hilos=2):
+    """Ejecuta operacion(repo) en varios hilos a la vez, cada uno con su sesión; devuelve "ok" o el nombre del error."""
+    salida = threading.Barrier(hilos)
+    resultados = []
+    def terminal():
+        with sessionmaker(bind=engine)() as session:
+            salida.wait()
+            try:
+                operacion(Repository(session))
+                resultados.append("ok")
+            except Exception as error:
+                resultados.append(type(error).__name__)
+    with redirect_stdout(io.StringIO()):
+        trabajos = [threading.Thread(target=terminal) for _ in range(hilos)]
+        for trabajo in trabajos:
+            trabajo.start()
+        for trabajo in trabajos:
+            trabajo.join()
+    return resultados
+
+class PruebaConBase(unittest.TestCase):
+    """Base de las pruebas sobre crear_base_benchmark: engine, sesión, repositorio y el id del mesero B001."""
+    num_mesas = 2
+    num_productos = 2
+
+    def crear_base(self):
+        return crear_base_benchmark(self.num_mesas, self.num_productos)
+
+    def setUp(self):
+        self.engine = self.crear_base()
+        self.session = sessionmaker(bind=self.engine)()
+        self.repo = Repository(self.session)
+        self.mesero_id = self.repo.get_by_codigo(Empleado, "B001").id
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
 
 class TestRestaurante(unittest.TestCase):
     """Clase para pruebas unitarias del sistema de restaurante."""
     def setUp(self):
         """Configura el entorno de prueba antes de cada test."""
-        self.session = Session()
+        self.engine = crear_engine("sqlite://")
+        crear_esquema(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
         self.repo = Repository(self.session)
 
         # Crear datos de prueba
@@ -42,7 +124,7 @@ class TestRestaurante(unittest.TestCase):
 
         pedidos = [p for p in mesa.pedidos if p.mesero_id == self.empleado_id]
         self.assertEqual(len(pedidos), 1)
-        self.assertEqual(pedidos[0].estado, "Pedido realizado")
+        self.assertEqual(pedidos[0].estado, EstadoPedido.PEDIDO_REALIZADO)
         self.assertEqual(len(pedidos[0].detalles), 1)
         self.assertEqual(pedidos[0].detalles[0]._cantidad, 2)
 
@@ -69,5 +151,1239 @@ class TestRestaurante(unittest.TestCase):
         self.assertEqual(len(facturas), 1)
         self.assertEqual(facturas[0]._total, 20.0)  # 2 * 10.0
 
+class TestConfiguracionEngine(unittest.TestCase):
+    """Pruebas de la fábrica de engines."""
+    def test_configuracion_desde_entorno(self):
+        """Las variables de entorno ajustan URL y pool."""
+        config = configuracion_desde_entorno({
+            "RESTAURANTE_DB_URL": "sqlite:///restaurante.db",
+            "RESTAURANTE_DB_POOL_SIZE": "12",
+            "RESTAURANTE_DB_PRE_PING": "false",
+        })
+        self.assertEqual(config["url"], "sqlite:///restaurante.db")
+        self.assertEqual(config["pool_size"], 12)
+        self.assertFalse(config["pool_pre_ping"])
+        self.assertEqual(config["max_overflow"], 10)
+
+    def test_esquema_explicito(self):
+        """Crear el engine no crea tablas; crear_esquema sí."""
+        engine = crear_engine("sqlite://")
+        self.assertFalse(inspect(engine).has_table("pedidos"))
+        crear_esquema(engine)
+        self.assertTrue(inspect(engine).has_table("pedidos"))
+
+class TestCrearPedidoLote(PruebaConBase):
+    """Pruebas de la creación de pedidos en una sola transacción."""
+    num_mesas = 3
+    num_productos = 8
+
+    def setUp(self):
+        super().setUp()
+        self.service = PedidoService(self.repo)
+
+    def test_idas_y_vueltas_constantes(self):
+        """Las sentencias y commits no crecen con el tamaño del pedido."""
+        self.service.catalogo.productos()  # Calentar el catálogo en memoria
+        with ContadorSQL(self.engine) as pequeno:
+            self.service.crear_pedido(1, self.mesero_id, [(1, 1)])
+        with ContadorSQL(self.engine) as grande:
+            self.service.crear_pedido(2, self.mesero_id, [(prod_id, 3) for prod_id in range(1, 9)])
+        self.assertEqual(pequeno.sentencias, grande.sentencias)
+        self.assertEqual(grande.commits, 1)
+        self.assertEqual(self.session.query(DetallePedido).count(), 1 + 8)
+
+    def test_validacion_previa_sin_escrituras(self):
+        """Un producto inexistente no deja pedido ni mesa ocupada."""
+        with self.assertRaises(ValueError):
+            self.service.crear_pedido(1, self.mesero_id, [(1, 2), (999, 1)])
+        self.assertEqual(self.session.query(Pedido).count(), 0)
+        self.assertEqual(self.repo.get_by_numero(Mesa, 1).estado, "Libre")
+
+    def test_un_solo_pedido_por_mesa_concurrente(self):
+        """Dos meseros abren la misma mesa a la vez sobre una base en archivo: solo uno crea el pedido."""
+        with tempfile.TemporaryDirectory() as directorio:
+            url = f"sqlite:///{os.path.join(directorio, 'sala.db')}"
+            crear_base_benchmark(num_mesas=1, num_productos=1, url=url).dispose()
+            engine = crear_engine(url)
+            self.addCleanup(engine.dispose)
+
+            # Ensancha la ventana entre validar la mesa y ocuparla
+            def validar_despacio(mesa, mesa_numero):
+                validar_mesa_para_pedido(mesa, mesa_numero)
+                threading.Event().wait(0.2)
+
+            with mock.patch("services.validar_mesa_para_pedido", validar_despacio):
+                resultados = a_la_vez(engine, lambda repo: PedidoService(repo).crear_pedido(1, 1, [(1, 1)]))
+
+            self.assertEqual(sorted(resultados), ["ValueError", "ok"])
+            with sessionmaker(bind=engine)() as session:
+                self.assertEqual(session.query(Pedido).count(), 1)
+
+class TestUnidadDeTrabajo(PruebaConBase):
+    """Pruebas del modo unidad de trabajo del repositorio."""
+    num_mesas = 3
+
+    def test_un_solo_commit_y_rollback_total(self):
+        """Todas las escrituras se confirman juntas o ninguna."""
+        with ContadorSQL(self.engine) as contador:
+            with self.repo.unit_of_work():
+                self.repo.add(Producto(_nombre="Nuevo", _categoria="Test", _precio=5.0))
+                self.repo.bulk_add(Producto, [{"_nombre": "Lote", "_categoria": "Test", "_precio": 1.0}])
+                self.repo.bulk_update(Mesa, [{"id": 1, "_estado": "Ocupada"}])
+        self.assertEqual(contador.commits, 1)
+        with self.assertRaises(ValueError):
+            with self.repo.unit_of_work():
+                self.repo.add(Producto(_nombre="Perdido", _categoria="Test", _precio=5.0))
+                raise ValueError("fallo a mitad de camino")
+        self.assertEqual(self.session.query(Producto).count(), 4)
+        self.assertEqual(self.repo.get_by_numero(Mesa, 1).estado, "Ocupada")
+
+    def test_savepoint_anidado(self):
+        """Un fallo en un bloque anidado solo deshace ese bloque."""
+        with self.repo.unit_of_work():
+            self.repo.add(Producto(_nombre="Exterior", _categoria="Test", _precio=5.0))
+            try:
+                with self.repo.unit_of_work():
+                    self.repo.add(Producto(_nombre="Interior", _categoria="Test", _precio=5.0))
+                    raise ValueError("fallo interno")
+            except ValueError:
+                pass
+        nombres = {p.nombre for p in self.repo.get_all(Producto)}
+        self.assertIn("Exterior", nombres)
+        self.assertNotIn("Interior", nombres)
+
+    def test_rollback_exterior_tras_savepoint_liberado(self):
+        """Liberar un bloque anidado no confirma la unidad de trabajo exterior."""
+        with self.assertRaises(ValueError):
+            with self.repo.unit_of_work():
+                with self.repo.unit_of_work():
+                    self.repo.add(Producto(_nombre="Interior", _categoria="Test", _precio=5.0))
+                self.repo.add(Producto(_nombre="Exterior", _categoria="Test", _precio=5.0))
+                raise ValueError("fallo después del bloque anidado")
+        self.session.expire_all()
+        self.assertEqual(self.session.query(Producto).count(), 2)
+
+class TestColaPedidos(PruebaConBase):
+    """Pruebas de la consulta de la cola de pedidos abiertos."""
+    num_mesas = 6
+    num_productos = 4
+
+    def setUp(self):
+        super().setUp()
+        self.repo.bulk_update(Producto, [{"id": 1, "_categoria": "Pizzas"}])
+        service = PedidoService(self.repo)
+        for mesa_numero in range(1, 6):
+            service.crear_pedido(mesa_numero, self.mesero_id, [(mesa_numero % 4 + 1, 2), (2, 1)])
+        self.repo.bulk_update(Pedido, [{"id": 1, "_estado": "Facturado"}])
+        self.session.expire_all()
+
+    def test_consultas_fijas_y_sin_facturados(self):
+        """La cola excluye facturados y no dispara cargas perezosas."""
+        with ContadorSQL(self.engine) as contador:
+            pedidos = self.repo.get_cola_pedidos()
+            for pedido in pedidos:
+                pedido.mesa.numero, pedido.mesero.nombre
+                [detalle.producto.nombre for detalle in pedido.detalles]
+        self.assertEqual(contador.sentencias, 2)
+        self.assertEqual([p.id for p in pedidos], [2, 3, 4, 5])
+
+    def test_paginacion_y_filtros(self):
+        """Paginación por clave y filtros por mesa, categoría y estado."""
+        primera = self.repo.get_cola_pedidos(limite=2)
+        segunda = self.repo.get_cola_pedidos(despues_de_id=primera[-1].id, limite=2)
+        self.assertEqual([p.id for p in primera + segunda], [2, 3, 4, 5])
+        self.assertEqual([p.id for p in self.repo.get_cola_pedidos(mesa_numero=3)], [3])
+        pizzas = self.repo.get_cola_pedidos(categoria="Pizzas")
+        self.assertEqual([p.id for p in pizzas], [4])
+        self.assertEqual(self.repo.get_cola_pedidos(estados=["Entregado"]), [])
+
+class TestCatalogoProductos(PruebaConBase):
+    """Pruebas del catálogo de productos en memoria."""
+    num_mesas = 1
+    num_productos = 3
+
+    def setUp(self):
+        super().setUp()
+        self.catalogo = ProductCatalog(self.repo)
+
+    def test_consultas_solo_cuando_cambia_el_menu(self):
+        """Las búsquedas no tocan la base hasta que cambia un producto."""
+        self.catalogo.productos()
+        with ContadorSQL(self.engine) as contador:
+            self.assertEqual(self.catalogo.get(2).nombre, "Producto 2")
+            self.assertNotIn(99, self.catalogo)
+            self.assertEqual(len(self.catalogo.por_categoria()["Benchmark"]), 3)
+            self.assertIn("S/. 11.00", self.catalogo.texto_menu())
+        self.assertEqual(contador.sentencias, 0)
+
+    def test_invalidacion_por_version(self):
+        """Un cambio de precio, por ORM o en lote, recarga el catálogo."""
+        self.catalogo.productos()
+        producto = self.repo.get(Producto, 1)
+        producto._precio = 99.0
+        self.repo.update(producto)
+        self.assertEqual(self.catalogo.get(1).precio, 99.0)
+        self.repo.bulk_update(Producto, [{"id": 2, "_precio": 5.0}])
+        self.assertEqual(self.catalogo.get(2).precio, 5.0)
+
+class TestServiciosAsync(unittest.IsolatedAsyncioTestCase):
+    """Pruebas de los servicios asyncio sobre aiosqlite."""
+    async def asyncSetUp(self):
+        # Base en archivo: cada sesión concurrente usa su propia conexión del pool
+        descriptor, self.ruta = tempfile.mkstemp(suffix=".db")
+        os.close(descriptor)
+        self.engine = crear_engine_async(f"sqlite:///{self.ruta}")
+        await crear_esquema_async(self.engine)
+        self.sesiones = sesiones_async(self.engine)
+        async with self.sesiones() as session:
+            session.add(Empleado(_codigo="M001", _nombre="Mesero Async", _rol="Mesero", _clave="1234"))
+            session.add_all(Mesa(_numero=i, _estado="Libre") for i in range(1, 6))
+            session.add_all(Producto(_nombre=f"Producto {i}", _categoria="Test", _precio=10.0 * i)
+                            for i in range(1, 3))
+            await session.commit()
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+        os.remove(self.ruta)
+
+    async def _crear_pedido(self, mesa_numero, productos):
+        async with self.sesiones() as session:
+            return await AsyncPedidoService(AsyncRepository(session)).crear_pedido(mesa_numero, 1, productos)
+
+    async def test_pedidos_concurrentes(self):
+        """Varios pedidos en paralelo, cada uno en su sesión, se confirman completos."""
+        pedidos = await asyncio.gather(*(self._crear_pedido(n, [(1, 2), (2, 1)]) for n in range(1, 6)))
+        self.assertEqual(len({p.id for p in pedidos}), 5)
+        async with self.sesiones() as session:
+            repo = AsyncRepository(session)
+            self.assertEqual(len(await repo.get_all(DetallePedido)), 10)
+            self.assertTrue(all(m.estado == "Ocupada" for m in await repo.get_all(Mesa)))
+            with self.assertRaises(ValueError):
+                await AsyncPedidoService(repo).crear_pedido(1, 1, [(1, 1)])
+
+    async def test_flujo_completo_y_facturacion(self):
+        """Mismas reglas que el servicio síncrono: validación, estados y total facturado."""
+        with self.assertRaises(ValueError):
+            await self._crear_pedido(1, [(1, 1), (99, 1)])
+        pedido = await self._crear_pedido(1, [(1, 2), (2, 1)])
+        async with self.sesiones() as session:
+            repo = AsyncRepository(session)
+            self.assertTrue(await AsyncPedidoService(repo).cambiar_estado(pedido.id, "Finalizado"))
+            factura = await AsyncFacturaService(repo).facturar_mesa(1)
+            self.assertEqual(factura._total, 40.0)
+            mesa = await repo.get_by_numero(Mesa, 1)
+            self.assertEqual(mesa.estado, "Libre")
+            self.assertEqual(await repo.get_cola_pedidos(), [])
+
+class TestAPI(unittest.TestCase):
+    """Pruebas de la API HTTP/JSON a nivel de despacho de rutas."""
+    def setUp(self):
+        self.engine = crear_base_benchmark(num_mesas=3, num_productos=2)
+        self.addCleanup(self.engine.dispose)
+        self.api = RestauranteAPI(sesiones=sessionmaker(bind=self.engine))
+
+    def _login(self):
+        estado, datos = self.api.despachar("POST", "/login", cuerpo={"codigo": "B001", "clave": "1234"})
+        self.assertEqual(estado, 200)
+        return datos["token"]
+
+    def test_autenticacion_por_token(self):
+        """Sin token válido no se atiende; cada login da un token distinto."""
+        estado, _ = self.api.despachar("POST", "/login", cuerpo={"codigo": "B001", "clave": "mala"})
+        self.assertEqual(estado, 401)
+        self.assertEqual(self.api.despachar("GET", "/mesas")[0], 401)
+        token = self._login()
+        self.assertNotEqual(token, self._login())
+        self.assertEqual(self.api.despachar("GET", "/mesas", token)[0], 200)
+        self.api.despachar("POST", "/logout", token)
+        self.assertEqual(self.api.despachar("GET", "/mesas", token)[0], 401)
+        self.assertEqual(self.api.despachar("GET", "/nada", token)[0], 404)
+
+    def test_pedido_estado_y_factura(self):
+        """Flujo completo por la API con errores de negocio como 400."""
+        token = self._login()
+        estado, datos = self.api.despachar("POST", "/pedidos", token, {"mesa": 1, "productos": [[1, 2], [2, 1]]})
+        self.assertEqual(estado, 200)
+        pedido_id = datos["pedido_id"]
+        self.assertEqual(self.api.despachar("POST", "/pedidos", token, {"mesa": 1, "productos": [[1, 1]]})[0], 400)
+        cola = self.api.despachar("GET", "/cola?mesa=1", token)[1]
+        self.assertEqual([p["id"] for p in cola], [pedido_id])
+        self.assertEqual(len(cola[0]["detalles"]), 2)
+        self.api.despachar("POST", f"/pedidos/{pedido_id}/estado", token, {"estado": "Finalizado"})
+        estado, factura = self.api.despachar("POST", "/mesas/1/factura", token)
+        self.assertEqual(estado, 200)
+        self.assertEqual(factura["total"], 11.0 * 2 + 12.0)
+        mesas = self.api.despachar("GET", "/mesas", token)[1]
+        self.assertEqual(mesas[0], {"numero": 1, "estado": "Libre"})
+
+    def test_estados_invalidos(self):
+        """Un estado ausente, nulo, desconocido o no permitido da 400 y no cambia nada."""
+        token = self._login()
+        pedido_id = self.api.despachar("POST", "/pedidos", token, {"mesa": 1, "productos": [[1, 2]]})[1]["pedido_id"]
+        detalle_id = self.api.despachar("GET", "/cola", token)[1][0]["detalles"][0]["id"]
+        for ruta in (f"/pedidos/{pedido_id}/estado", f"/detalles/{detalle_id}/estado", "/detalles/estado"):
+            for cuerpo in ({}, {"estado": "Bogus"}, {"estado": None}):
+                estado, datos = self.api.despachar("POST", ruta, token, dict(cuerpo, mesa=1))
+                self.assertEqual(estado, 400, (ruta, cuerpo))
+        self.assertEqual(self.api.despachar("POST", f"/pedidos/{pedido_id}/estado", token,
+                                            {"estado": "Entregado"}), (200, {"ok": True}))
+        for estado_pedido in ("Entregado", "En preparación", "Facturado"):
+            estado, datos = self.api.despachar("POST", f"/pedidos/{pedido_id}/estado", token,
+                                               {"estado": estado_pedido})
+            self.assertEqual(estado, 400)
+            self.assertIn("no puede pasar", datos["error"])
+        self.assertEqual(self.api.despachar("GET", "/cola", token)[1][0]["estado"], "Entregado")
+
+    def test_cuerpos_invalidos_y_errores_internos(self):
+        """Cuerpos mal formados dan 400, fallos inesperados 500, y la conexión sigue atendiendo."""
+        token = self._login()
+        self.assertEqual(self.api.despachar("POST", "/pedidos", token, {"mesa": 1, "productos": 5})[0], 400)
+        fallo = OperationalError("SELECT", {}, Exception("conexión perdida"))
+        with mock.patch.object(Repository, "get_cola_lectura", side_effect=fallo), \
+                redirect_stderr(io.StringIO()):
+            self.assertEqual(self.api.despachar("GET", "/cola", token), (500, {"error": "Error interno del servidor."}))
+        servidor = crear_servidor(self.api, puerto=0)
+        hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+        hilo.start()
+        conexion = http.client.HTTPConnection(*servidor.server_address, timeout=5)
+        try:
+            cabeceras = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+            conexion.request("POST", "/pedidos", body="[1, 2]", headers=cabeceras)
+            respuesta = conexion.getresponse()
+            self.assertEqual((respuesta.status, json.loads(respuesta.read())["error"]),
+                             (400, "El cuerpo debe ser un objeto JSON."))
+            conexion.request("GET", "/mesas", headers=cabeceras)
+            self.assertEqual(conexion.getresponse().status, 200)
+        finally:
+            conexion.close()
+            servidor.shutdown()
+            servidor.server_close()
+
+class TestBusEventos(PruebaConBase):
+    """Pruebas de los eventos publicados por los servicios."""
+    def setUp(self):
+        super().setUp()
+        self.bus = BusEventos()
+        self.pedidos = PedidoService(self.repo, bus=self.bus)
+
+    def test_eventos_del_ciclo_de_un_pedido(self):
+        """Alta, cambios de detalle y pedido, y facturación llegan en orden tras cada commit."""
+        suscripcion = self.bus.suscribir()
+        pedido = self.pedidos.crear_pedido(1, self.mesero_id, [(1, 1), (2, 1)])
+        self.assertEqual(suscripcion.pendientes(), [
+            PedidoCreado(pedido.id, 1, self.mesero_id, 2), MesaCambiada(1, "Ocupada"),
+            ResumenMesaCambiado(1, 1, "Ocupada", 1, 0, 11.0 + 12.0)])
+        detalle = pedido.detalles[0]
+        self.pedidos.cambiar_estado_detalle(detalle.id, "En preparación")
+        evento, = suscripcion.pendientes()
+        self.assertEqual(evento[:3], (detalle.id, pedido.id, EstadoPedido.EN_PREPARACION))
+        self.assertEqual(evento.unidades["En preparación"], 1)
+        self.pedidos.cambiar_estado(pedido.id, "Finalizado")
+        eventos = suscripcion.pendientes()
+        self.assertEqual(eventos[-2:], [PedidoCambiado(pedido.id, EstadoPedido.FINALIZADO),
+                                        ResumenMesaCambiado(1, 2, "Ocupada", 1, 1, 11.0 + 12.0)])
+        self.assertEqual(len(eventos), 4)
+        FacturaService(self.repo, self.bus).facturar_mesa(1)
+        eventos = suscripcion.pendientes()
+        self.assertEqual(eventos[0], PedidoCambiado(pedido.id, EstadoPedido.FACTURADO))
+        self.assertIsInstance(eventos[1], MesaFacturada)
+        self.assertEqual(eventos[2], MesaCambiada(1, "Libre"))
+        self.assertEqual(eventos[3], ResumenMesaCambiado(1, 3, "Libre", 0, 0, 0.0))
+
+    def test_rollback_y_cola_acotada(self):
+        """Un fallo no publica nada y un suscriptor lento pierde solo lo más antiguo."""
+        lenta = self.bus.suscribir(capacidad=1)
+        solo_mesas = self.bus.suscribir(tipos=[MesaCambiada])
+        with self.assertRaises(ValueError):
+            with self.repo.unit_of_work():
+                self.pedidos.crear_pedido(1, self.mesero_id, [(1, 1)])
+                raise ValueError("fallo después del alta")
+        self.assertIsNone(lenta.obtener(timeout=0))
+        self.pedidos.crear_pedido(2, self.mesero_id, [(1, 1)])
+        self.assertEqual(lenta.pendientes(), [ResumenMesaCambiado(2, 1, "Ocupada", 1, 0, 11.0)])
+        self.assertEqual(lenta.perdidos, 2)
+        self.assertEqual(solo_mesas.pendientes(), [MesaCambiada(2, "Ocupada")])
+        solo_mesas.cerrar()
+        self.pedidos.crear_pedido(1, self.mesero_id, [(1, 1)])
+        self.assertEqual(solo_mesas.pendientes(), [])
+
+class TestFacturacionAgregada(PruebaConBase):
+    """Pruebas de la facturación agregada en SQL."""
+    num_productos = 3
+
+    def setUp(self):
+        super().setUp()
+        self.pedidos = PedidoService(self.repo)
+        self.facturas = FacturaService(self.repo)
+
+    def _atender_mesa(self, mesa_numero, productos):
+        pedido = self.pedidos.crear_pedido(mesa_numero, self.mesero_id, productos)
+        self.pedidos.cambiar_estado(pedido.id, "Finalizado")
+
+    def test_consultas_constantes_con_historial(self):
+        """El costo de facturar no crece con los pedidos ya facturados de la mesa."""
+        self._atender_mesa(1, [(1, 2), (2, 1)])
+        with ContadorSQL(self.engine) as primera:
+            self.facturas.facturar_mesa(1)
+        for _ in range(5):
+            self._atender_mesa(1, [(1, 1), (3, 2)])
+            self.facturas.facturar_mesa(1)
+        self._atender_mesa(1, [(1, 2), (2, 1)])
+        with ContadorSQL(self.engine) as ultima:
+            factura = self.facturas.facturar_mesa(1)
+        self.assertEqual(primera.sentencias, ultima.sentencias)
+        self.assertEqual(ultima.commits, 1)
+        detalles = (self.session.query(DetalleFactura).filter_by(_factura_id=factura.id)
+                    .order_by(DetalleFactura._producto_id).all())
+        self.assertEqual([(d.producto_id, d.cantidad, d.subtotal) for d in detalles], [(1, 2, 22.0), (2, 1, 12.0)])
+        self.assertEqual(factura._total, 34.0)
+
+    def test_sin_doble_facturacion(self):
+        """Una segunda facturación de la misma mesa no encuentra pedidos pendientes."""
+        self._atender_mesa(1, [(1, 1)])
+        self.facturas.facturar_mesa(1)
+        with self.assertRaises(ValueError):
+            self.facturas.facturar_mesa(1)
+        self.assertEqual(self.session.query(Factura).count(), 1)
+        self.assertEqual({p.estado for p in self.repo.get_all(Pedido)}, {EstadoPedido.FACTURADO})
+
+    def test_sin_doble_facturacion_concurrente(self):
+        """Dos cajeros facturan la misma mesa a la vez sobre una base en archivo: solo uno genera factura."""
+        with tempfile.TemporaryDirectory() as directorio:
+            url = f"sqlite:///{os.path.join(directorio, 'caja.db')}"
+            crear_base_benchmark(num_mesas=1, num_productos=1, url=url).dispose()
+            engine = crear_engine(url)
+            self.addCleanup(engine.dispose)
+            session = sessionmaker(bind=engine)()
+            repo = Repository(session)
+            pedidos = PedidoService(repo)
+            pedido = pedidos.crear_pedido(1, repo.get_by_codigo(Empleado, "B001").id, [(1, 2)])
+            pedidos.cambiar_estado(pedido.id, "Finalizado")
+            session.close()
+
+            # Ensancha la ventana entre leer lo pendiente y escribir la factura
+            leer_pendientes = Repository.get_pedidos_por_facturar
+            def leer_despacio(repo, mesa_id):
+                pendientes = leer_pendientes(repo, mesa_id)
+                threading.Event().wait(0.2)
+                return pendientes
+
+            with mock.patch.object(Repository, "get_pedidos_por_facturar", leer_despacio):
+                resultados = a_la_vez(engine, lambda repo: FacturaService(repo).facturar_mesa(1))
+
+            self.assertEqual(sorted(resultados), ["ValueError", "ok"])
+            with sessionmaker(bind=engine)() as session:
+                self.assertEqual(session.query(Factura).count(), 1)
+
+def crear_base_facturada():
+    """Base con cuatro facturas en tres días y dos meseros."""
+    engine = crear_base_benchmark(num_mesas=2, num_productos=1)
+    session = sessionmaker(bind=engine)()
+    repo = Repository(session)
+    repo.bulk_add(Empleado, [{"_codigo": "M002", "_nombre": "Otra Mesera", "_rol": "Mesero", "_clave": "1"}])
+    repo.bulk_add(Factura, [
+        {"_mesa_id": 1, "_mesero_id": 1, "_fecha_hora": datetime(2024, 5, 1, 13, 0), "_total": 10.0},
+        {"_mesa_id": 2, "_mesero_id": 2, "_fecha_hora": datetime(2024, 5, 1, 21, 30), "_total": 30.0},
+        {"_mesa_id": 1, "_mesero_id": 1, "_fecha_hora": datetime(2024, 5, 2, 12, 15), "_total": 5.0},
+        {"_mesa_id": 1, "_mesero_id": 1, "_fecha_hora": datetime(2024, 5, 3, 20, 0), "_total": 7.0},
+    ])
+    repo.bulk_add(DetalleFactura, [
+        {"_factura_id": 1, "_producto_id": 1, "_cantidad": 2, "_precio_unitario": 5.0, "_subtotal": 10.0},
+        {"_factura_id": 3, "_producto_id": 1, "_cantidad": 1, "_precio_unitario": 5.0, "_subtotal": 5.0},
+    ])
+    session.close()
+    return engine
+
+class TestReporteFacturacion(PruebaConBase):
+    """Pruebas del reporte de facturación agregado en SQL."""
+    def crear_base(self):
+        return crear_base_facturada()
+
+    def setUp(self):
+        super().setUp()
+        self.reporte = ReporteFacturacion(self.repo, tamano_lote=2)
+
+    def test_totales_por_dia_y_mesero_en_rango(self):
+        """Los totales se agrupan en la base y respetan el rango de fechas."""
+        diario = self.reporte.resumen_diario(date(2024, 5, 1), date(2024, 5, 2))
+        self.assertEqual([(f.fecha, f.facturas, f.total) for f in diario],
+                         [(date(2024, 5, 1), 2, 40.0), (date(2024, 5, 2), 1, 5.0)])
+        meseros = self.reporte.resumen_por_mesero(date(2024, 5, 1), date(2024, 5, 1))
+        self.assertEqual([(f.codigo, f.total) for f in meseros], [("M002", 30.0), ("B001", 10.0)])
+        self.assertEqual(len(self.reporte.resumen_diario()), 3)
+
+    def test_filas_transmitidas_por_lotes(self):
+        """Facturas y detalles del rango llegan ordenados y ya resueltos."""
+        facturas = list(self.reporte.iterar_facturas(date(2024, 5, 2)))
+        self.assertEqual([(f.factura_id, f.mesa, f.mesero) for f in facturas],
+                         [(3, 1, "Mesero Benchmark"), (4, 1, "Mesero Benchmark")])
+        detalles = list(self.reporte.iterar_detalles(hasta=date(2024, 5, 1)))
+        self.assertEqual([(d.factura_id, d.producto, d.subtotal) for d in detalles], [(1, "Producto 1", 10.0)])
+
+    def test_detalles_de_las_mismas_facturas_que_las_cabeceras(self):
+        """Una factura sin total no aparece en cabeceras ni en detalles."""
+        self.repo.bulk_update(Factura, [{"id": 3, "_total": None}])
+        self.assertEqual([f.factura_id for f in self.reporte.iterar_facturas()], [1, 2, 4])
+        self.assertEqual([d.factura_id for d in self.reporte.iterar_detalles()], [1])
+
+class TestExportacion(PruebaConBase):
+    """Pruebas de la exportación por flujo."""
+    def crear_base(self):
+        return crear_base_facturada()
+
+    def setUp(self):
+        super().setUp()
+        self.directorio = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.directorio.cleanup()
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio.name, nombre)
+
+    def _leer_csv(self, ruta):
+        with open(ruta, newline="", encoding="utf-8") as archivo:
+            return list(csv.reader(archivo))
+
+    def test_csv_en_rango_e_incremental(self):
+        """El rango limita las filas y el modo incremental solo exporta facturas nuevas."""
+        resultado = exportar_facturacion(self.repo, self._ruta("rango.csv"), desde=date(2024, 5, 2), tamano_lote=1)
+        self.assertEqual((resultado["facturas"], resultado["detalles"]), (2, 1))
+        cabecera = self._leer_csv(self._ruta("rango_cabecera.csv"))
+        self.assertEqual(cabecera[0], ["Factura ID", "Mesa", "Mesero", "Fecha", "Hora", "Total"])
+        self.assertEqual([fila[0] for fila in cabecera[1:]], ["3", "4"])
+
+        estado = self._ruta("estado.json")
+        primera = exportar_facturacion(self.repo, self._ruta("a.csv"), incremental=True, ruta_estado=estado)
+        self.assertEqual(primera["facturas"], 4)
+        self.repo.bulk_add(Factura, [{"_mesa_id": 2, "_mesero_id": 1, "_fecha_hora": datetime(2024, 5, 4), "_total": 1.0}])
+        segunda = exportar_facturacion(self.repo, self._ruta("b.csv"), incremental=True, ruta_estado=estado)
+        self.assertEqual((segunda["facturas"], segunda["detalles"]), (1, 0))
+        self.assertGreater(segunda["filas_por_segundo"], 0)
+
+    def test_incremental_sin_rango_y_con_facturas_tardias(self):
+        """El modo incremental rechaza un rango de fechas y exporta luego las facturas confirmadas tarde."""
+        estado = self._ruta("estado.json")
+        with self.assertRaises(ValueError):
+            exportar_facturacion(self.repo, self._ruta("a.csv"), desde=date(2024, 5, 2), incremental=True,
+                                 ruta_estado=estado)
+        self.assertFalse(os.path.exists(estado))
+        # El cajero de la factura 5 confirma después que el de la 6
+        factura = {"_mesa_id": 1, "_mesero_id": 1, "_fecha_hora": datetime(2024, 5, 4), "_total": 2.0}
+        self.repo.bulk_add(Factura, [dict(factura, id=6)])
+        primera = exportar_facturacion(self.repo, self._ruta("a.csv"), incremental=True, ruta_estado=estado)
+        self.assertEqual(primera["facturas"], 5)
+        self.repo.bulk_add(Factura, [dict(factura, id=5)])
+        self.repo.bulk_add(DetalleFactura, [{"_factura_id": 5, "_producto_id": 1, "_cantidad": 1,
+                                             "_precio_unitario": 2.0, "_subtotal": 2.0}])
+        segunda = exportar_facturacion(self.repo, self._ruta("b.csv"), incremental=True, ruta_estado=estado)
+        self.assertEqual((segunda["facturas"], segunda["detalles"]), (1, 1))
+        self.assertEqual([fila[0] for fila in self._leer_csv(self._ruta("b_cabecera.csv"))[1:]], ["5"])
+        tercera = exportar_facturacion(self.repo, self._ruta("c.csv"), incremental=True, ruta_estado=estado)
+        self.assertEqual(tercera["facturas"], 0)
+
+    def test_xlsx_solo_escritura_y_parquet(self):
+        """XLSX en modo write-only con dos hojas; Parquet si pyarrow está instalado."""
+        from openpyxl import load_workbook
+        ruta = self._ruta("reporte.xlsx")
+        exportar_facturacion(self.repo, ruta)
+        libro = load_workbook(ruta, read_only=True)
+        self.assertEqual(libro.sheetnames, ["Cabecera", "Detalle"])
+        self.assertEqual(len(list(libro["Detalle"].iter_rows())), 3)
+        libro.close()
+        with self.assertRaises(ValueError):
+            exportar_facturacion(self.repo, self._ruta("reporte.txt"))
+        if importlib.util.find_spec("pyarrow"):
+            import pyarrow.parquet as pq
+            exportar_facturacion(self.repo, self._ruta("reporte.parquet"), tamano_lote=3)
+            tabla = pq.read_table(self._ruta("reporte_cabecera.parquet"))
+            self.assertEqual(tabla.num_rows, 4)
+            self.assertEqual(tabla.column("Total").to_pylist(), [10.0, 30.0, 5.0, 7.0])
+
+class TestDetallesConCantidad(PruebaConBase):
+    """Pruebas de las líneas de pedido con cantidad y avance parcial."""
+    def setUp(self):
+        super().setUp()
+        self.service = PedidoService(self.repo)
+
+    def test_una_fila_por_linea_y_avance_parcial(self):
+        """Diez unidades son una fila; se pueden preparar y entregar por partes."""
+        pedido = self.service.crear_pedido(1, self.mesero_id, [(1, 10), (2, 1), (1, 2)])
+        self.assertEqual([(d.producto.id, d.cantidad) for d in pedido.detalles], [(1, 12), (2, 1)])
+        pan = pedido.detalles[0]
+        self.service.cambiar_estado_detalle(pan.id, "En preparación", unidades=5)
+        self.service.cambiar_estado_detalle(pan.id, "Entregado", unidades=2)
+        self.assertEqual(pan.estado, EstadoPedido.PEDIDO_REALIZADO)
+        self.assertEqual(pan.unidades_por_estado(),
+                         {"Pedido realizado": 7, "En preparación": 3, "Entregado": 2, "Finalizado": 0})
+        self.service.cambiar_estado_detalle(pan.id, "En preparación")
+        self.assertEqual(pan.estado, EstadoPedido.EN_PREPARACION)
+        self.service.cambiar_estado(pedido.id, "Finalizado")
+        self.assertEqual(self.repo.get(Pedido, pedido.id).estado, EstadoPedido.FINALIZADO)
+        FacturaService(self.repo).facturar_mesa(1)
+        factura = self.repo.get_all(Factura)[0]
+        self.assertEqual(factura._total, 12 * 11.0 + 12.0)
+
+    def test_cambios_de_detalle_invalidos(self):
+        """Unidades no positivas, estados ajenos al detalle o ya alcanzados se rechazan sin cambios."""
+        pedido = self.service.crear_pedido(1, self.mesero_id, [(1, 3)])
+        detalle = pedido.detalles[0]
+        self.service.cambiar_estado_detalle(detalle.id, "Entregado", unidades=3)
+        antes = detalle.unidades_por_estado()
+        for estado, unidades in (("Entregado", None), ("En preparación", None), ("Finalizado", 0),
+                                 ("Finalizado", -1), ("Facturado", None), ("Pedido realizado", None), ("Bogus", 1)):
+            with self.assertRaises(ValueError):
+                self.service.cambiar_estado_detalle(detalle.id, estado, unidades)
+        self.session.expire_all()
+        self.assertEqual(self.repo.get(DetallePedido, detalle.id).unidades_por_estado(), antes)
+        api = RestauranteAPI(sesiones=sessionmaker(bind=self.engine))
+        token = api.despachar("POST", "/login", cuerpo={"codigo": "B001", "clave": "1234"})[1]["token"]
+        self.assertEqual(api.despachar("POST", f"/detalles/{detalle.id}/estado", token,
+                                       {"estado": "Finalizado", "unidades": 0})[0], 400)
+
+    def test_migracion_colapsa_filas_por_unidad(self):
+        """Las filas heredadas de una unidad se agrupan por pedido y producto."""
+        with self.engine.begin() as conexion:
+            conexion.exec_driver_sql("DROP TABLE detalles_pedido")
+            conexion.exec_driver_sql(
+                "CREATE TABLE detalles_pedido (id INTEGER PRIMARY KEY, _pedido_id INTEGER, _producto_id INTEGER, "
+                "_estado VARCHAR(30), _fecha_creacion DATETIME, _inicio_preparacion DATETIME, "
+                "_fin_preparacion DATETIME, _fin_finalizacion DATETIME, _duracion_preparacion FLOAT)")
+            conexion.exec_driver_sql(
+                "INSERT INTO detalles_pedido (_pedido_id, _producto_id, _estado) VALUES "
+                "(1, 1, 'Entregado'), (1, 1, 'En preparación'), (1, 1, 'Pedido realizado'), "
+                "(1, 2, 'Finalizado'), (2, 1, 'Entregado'), (2, 1, 'Entregado')")
+        self.assertEqual(colapsar_detalles_por_cantidad(self.engine), 3)
+        self.assertEqual(colapsar_detalles_por_cantidad(self.engine), 0)
+        detalles = self.session.query(DetallePedido).order_by(DetallePedido.id).all()
+        self.assertEqual([(d._pedido_id, d.cantidad, d.estado) for d in detalles],
+                         [(1, 3, EstadoPedido.PEDIDO_REALIZADO), (1, 1, EstadoPedido.FINALIZADO),
+                          (2, 2, EstadoPedido.ENTREGADO)])
+        self.assertEqual(detalles[0].unidades_por_estado(),
+                         {"Pedido realizado": 1, "En preparación": 1, "Entregado": 1, "Finalizado": 0})
+
+class TestMaquinaEstados(PruebaConBase):
+    """Pruebas de la máquina de estados de pedidos y detalles."""
+    def setUp(self):
+        super().setUp()
+        self.service = PedidoService(self.repo)
+
+    def test_transiciones_y_hooks(self):
+        """Solo se avanza, "Facturado" exige "Finalizado" y los hooks fijan las fechas."""
+        self.assertTrue(MAQUINA_PEDIDO.permite("Pedido realizado", "Finalizado"))
+        self.assertFalse(MAQUINA_PEDIDO.permite("Entregado", "En preparación"))
+        self.assertFalse(MAQUINA_PEDIDO.permite("Entregado", "Facturado"))
+        self.assertEqual(MAQUINA_PEDIDO.origenes(EstadoPedido.FACTURADO), (EstadoPedido.FINALIZADO,))
+        self.assertFalse(MAQUINA_DETALLE.permite("Finalizado", "Facturado"))
+        self.assertEqual(MAQUINA_DETALLE.siguiente("En preparación"), EstadoPedido.ENTREGADO)
+        pedido = self.service.crear_pedido(1, self.mesero_id, [(1, 1)])
+        detalle = pedido.detalles[0]
+        self.service.cambiar_estado_detalle(detalle.id, "En preparación")
+        self.service.cambiar_estado(pedido.id, "Finalizado")
+        self.assertIsNotNone(detalle._fin_preparacion)
+        self.assertIsNotNone(detalle._fin_finalizacion)
+        self.assertIsNotNone(pedido._fecha_fin)
+        self.assertFalse(pedido._cambiar_estado("Entregado"))
+        self.assertEqual(f"{pedido.estado}", "Finalizado")
+
+    def test_comparacion_y_hash_coherentes(self):
+        """Los estados se comparan como enteros; las etiquetas se convierten con desde()."""
+        self.assertNotEqual(EstadoPedido.FINALIZADO, "Finalizado")
+        self.assertNotIn("Finalizado", {EstadoPedido.FINALIZADO})
+        self.assertEqual({EstadoPedido.FINALIZADO: 1}.get(EstadoPedido.desde("Finalizado")), 1)
+        self.assertEqual(EstadoPedido.desde("Entregado"), EstadoPedido.ENTREGADO)
+        self.assertIsNone(EstadoPedido.desde("Bogus"))
+
+    def test_columna_entera_y_facturado_solo_desde_finalizado(self):
+        """El estado se guarda como código entero y el UPDATE de facturación respeta la máquina."""
+        pedido = self.service.crear_pedido(1, self.mesero_id, [(1, 1)])
+        otro = self.service.crear_pedido(2, self.mesero_id, [(1, 1)])
+        self.service.cambiar_estado(pedido.id, "Finalizado")
+        with self.engine.connect() as conexion:
+            codigos = conexion.exec_driver_sql("SELECT _estado FROM pedidos ORDER BY id").scalars().all()
+        self.assertEqual(codigos, [3, 0])
+        FacturaService(self.repo).facturar_mesa(1)
+        self.session.expire_all()
+        self.assertEqual(self.repo.get(Pedido, pedido.id).estado, EstadoPedido.FACTURADO)
+        self.assertEqual(self.repo.get(Pedido, otro.id).estado, EstadoPedido.PEDIDO_REALIZADO)
+        self.assertEqual(len(self.repo.get_cola_pedidos(estados=[EstadoPedido.PEDIDO_REALIZADO])), 1)
+
+    def test_migracion_de_texto_a_entero(self):
+        """Las columnas String(30) heredadas pasan a códigos enteros una sola vez."""
+        with self.engine.begin() as conexion:
+            conexion.exec_driver_sql("DROP TABLE pedidos")
+            conexion.exec_driver_sql(
+                "CREATE TABLE pedidos (id INTEGER PRIMARY KEY, _mesa_id INTEGER, _mesero_id INTEGER, "
+                "_estado VARCHAR(30), _fecha_inicio DATETIME, _fecha_fin DATETIME)")
+            conexion.exec_driver_sql(
+                "INSERT INTO pedidos (_mesa_id, _estado) VALUES (1, 'Facturado'), (1, 'En preparación')")
+        self.assertEqual(estados_a_enteros(self.engine), ["pedidos"])
+        self.assertEqual(estados_a_enteros(self.engine), [])
+        resumen_de_mesas(self.engine)  # Columnas de migraciones posteriores que el modelo ya espera
+        self.assertEqual([p.estado for p in self.repo.get_all(Pedido)],
+                         [EstadoPedido.FACTURADO, EstadoPedido.EN_PREPARACION])
+
+class TestAvanceMasivo(PruebaConBase):
+    """Pruebas de los cambios de estado masivos por mesa, producto o categoría."""
+    num_mesas = 4
+
+    def setUp(self):
+        super().setUp()
+        self.bus = BusEventos()
+        self.service = PedidoService(self.repo, bus=self.bus)
+        self.pedidos = [self.service.crear_pedido(mesa, self.mesero_id, [(1, 2), (2, 1)]) for mesa in (1, 2, 3)]
+
+    def test_fechas_en_sql_y_pedidos_completos(self):
+        """Los detalles avanzan con un UPDATE y solo suben los pedidos con todos sus detalles."""
+        suscripcion = self.bus.suscribir()
+        self.assertEqual(self.service.avanzar_detalles("En preparación", categoria="Benchmark"), 6)
+        self.assertEqual({p.estado for p in self.repo.get_all(Pedido)}, {EstadoPedido.EN_PREPARACION})
+        self.assertEqual(self.service.avanzar_detalles("Entregado", producto_id=1), 3)
+        self.assertEqual(self.service.avanzar_detalles("Entregado", producto_id=1), 0)
+        self.assertEqual(self.service.avanzar_detalles("Finalizado", mesa_numero=1), 2)
+        detalles = self.session.query(DetallePedido).order_by(DetallePedido.id).all()
+        pan = detalles[0]
+        self.assertEqual(pan.unidades_por_estado()["Entregado"], 0)
+        self.assertEqual(pan.estado, EstadoPedido.FINALIZADO)
+        self.assertIsNotNone(pan._inicio_preparacion)
+        self.assertGreaterEqual(pan._duracion_preparacion, 0.0)
+        self.assertEqual(detalles[2].estado, EstadoPedido.ENTREGADO)
+        self.assertIsNone(detalles[3]._fin_preparacion)
+        self.assertEqual([p.estado for p in self.repo.get_all(Pedido)],
+                         [EstadoPedido.FINALIZADO, EstadoPedido.EN_PREPARACION, EstadoPedido.EN_PREPARACION])
+        self.assertIsNotNone(self.pedidos[0]._fecha_fin)
+        eventos = suscripcion.pendientes()
+        self.assertIsInstance(eventos[0], DetallesAvanzados)
+        self.assertEqual(eventos[0].pedido_ids, tuple(p.id for p in self.pedidos))
+        self.assertEqual(eventos[-1], PedidoCambiado(self.pedidos[0].id, EstadoPedido.FINALIZADO))
+        with self.assertRaises(ValueError):
+            self.service.avanzar_detalles("Facturado", mesa_numero=2)
+        with self.assertRaises(ValueError):
+            self.service.avanzar_detalles("Entregado")
+
+    def test_sentencias_constantes(self):
+        """El número de sentencias no depende de cuántos detalles avanzan."""
+        with ContadorSQL(self.engine) as una_mesa:
+            self.service.avanzar_detalles("En preparación", mesa_numero=1)
+        with ContadorSQL(self.engine) as todas:
+            self.service.avanzar_detalles("En preparación", categoria="Benchmark")
+        self.assertEqual(una_mesa.sentencias, todas.sentencias)
+        self.assertEqual(todas.commits, 1)
+
+class TestMigracionesEIndices(unittest.TestCase):
+    """Pruebas de las migraciones versionadas y de los planes de las consultas frecuentes."""
+    def test_base_antigua_hasta_la_ultima_version(self):
+        """Una base sin versión ni índices se convierte y queda marcada; repetir no hace nada."""
+        engine = crear_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        with engine.begin() as conexion:
+            conexion.exec_driver_sql("DROP TABLE pedidos")
+            conexion.exec_driver_sql(
+                "CREATE TABLE pedidos (id INTEGER PRIMARY KEY, _mesa_id INTEGER, _mesero_id INTEGER, "
+                "_estado VARCHAR(30), _fecha_inicio DATETIME, _fecha_fin DATETIME)")
+            conexion.exec_driver_sql("DROP INDEX ix_facturas_fecha_hora_id")
+            conexion.exec_driver_sql("INSERT INTO pedidos (_mesa_id, _estado) VALUES (1, 'Finalizado')")
+        self.assertEqual(version_actual(engine), 0)
+        self.assertEqual(migrar(engine), [numero for numero, _, _ in MIGRACIONES])
+        self.assertEqual(migrar(engine), [])
+        self.assertEqual(version_actual(engine), MIGRACIONES[-1][0])
+        indices = {i["name"] for tabla in ("pedidos", "facturas") for i in inspect(engine).get_indexes(tabla)}
+        self.assertTrue({"ix_pedidos_estado_id", "ix_pedidos_mesa_estado", "ix_facturas_fecha_hora_id"} <= indices)
+        with Session(engine) as session:
+            self.assertEqual(session.get(Pedido, 1).estado, EstadoPedido.FINALIZADO)
+
+    def test_consultas_frecuentes_sin_escaneo_completo(self):
+        """Cola, cambios masivos, facturación y reportes usan índices; sin ellos se detecta el escaneo."""
+        engine = crear_base_facturada()
+        session = sessionmaker(bind=engine)()
+        repo = Repository(session)
+        service = PedidoService(repo)
+        service.catalogo.productos()
+        mesero_id = repo.get_by_codigo(Empleado, "B001").id
+        for mesa in (1, 2):
+            service.crear_pedido(mesa, mesero_id, [(1, 2)])
+        reporte = ReporteFacturacion(repo)
+        with PlanesSQL(engine) as planes:
+            repo.get_cola_pedidos()
+            repo.get_cola_pedidos(mesa_numero=1, categoria="Benchmark", despues_de_id=0)
+            service.avanzar_detalles("En preparación", categoria="Benchmark")
+            service.avanzar_detalles("Finalizado", mesa_numero=1)
+            service.avanzar_detalles("Finalizado", producto_id=1)
+            FacturaService(repo).facturar_mesa(1)
+            reporte.resumen_diario(date(2024, 5, 1), date(2024, 5, 2))
+            reporte.resumen_por_mesero(date(2024, 5, 1), date(2024, 5, 2))
+            list(reporte.iterar_facturas(date(2024, 5, 1), date(2024, 5, 2)))
+            list(reporte.iterar_detalles(date(2024, 5, 1), date(2024, 5, 2)))
+        self.assertEqual(planes.escaneos_completos(), [])
+        session.close()
+
+        # Base nueva: pysqlite reutiliza el plan de una sentencia ya preparada aunque cambie el esquema
+        engine = crear_base_benchmark(num_mesas=1, num_productos=1)
+        with engine.begin() as conexion:
+            conexion.exec_driver_sql("DROP INDEX ix_pedidos_estado_id")
+        with PlanesSQL(engine) as planes, Session(engine) as session:
+            Repository(session).get_cola_pedidos()
+        self.assertIn("pedidos", [tabla for tabla, _ in planes.escaneos_completos()])
+
+class TestPresupuestosSQL(unittest.TestCase):
+    """Pruebas de los presupuestos de sentencias de cada operación de servicio."""
+    def test_operaciones_dentro_del_presupuesto(self):
+        """Las sentencias por operación no crecen con el historial ni con el tamaño del pedido."""
+        resultados = benchmark_servicios(volumenes=((1, 5, 1), (4, 30, 6)), repeticiones=2)
+        self.assertEqual({r["operacion"] for r in resultados}, set(PRESUPUESTOS_SQL))
+        self.assertEqual(excesos_de_presupuesto(resultados), [])
+        grandes = {r["operacion"]: r for r in resultados if r["items"] == 6}
+        self.assertEqual(grandes["cola_pedidos"]["sentencias"], PRESUPUESTOS_SQL["cola_pedidos"])
+        self.assertTrue(all(r["commits"] <= 1 for r in resultados))
+        exceso = dict(grandes["cola_pedidos"], sentencias=PRESUPUESTOS_SQL["cola_pedidos"] + 2)
+        self.assertEqual(len(excesos_de_presupuesto([exceso])), 1)
+
+class TestInstrumentacion(PruebaConBase):
+    """Pruebas de las métricas por operación y del registro de operaciones lentas."""
+    def tearDown(self):
+        instrumentacion.desactivar()
+        instrumentacion.reiniciar()
+        super().tearDown()
+
+    def test_metricas_de_servicios_y_sql_lento(self):
+        """Cada método de servicio suma sentencias, filas y commit; las lentas guardan su SQL."""
+        service = PedidoService(self.repo)
+        service.crear_pedido(1, self.mesero_id, [(1, 1)])
+        self.assertEqual(instrumentacion.snapshot()["operaciones"], {})
+        self.assertTrue(activar_desde_entorno(self.engine, {"RESTAURANTE_UMBRAL_LENTO_MS": "0"}))
+        pedido = service.crear_pedido(2, self.mesero_id, [(1, 2), (2, 1)])
+        service.cambiar_estado(pedido.id, "Finalizado")
+        FacturaService(self.repo).facturar_mesa(2)
+        metricas = instrumentacion.snapshot()
+        crear = metricas["operaciones"]["PedidoService.crear_pedido"]
+        self.assertEqual(crear["llamadas"], 1)
+        self.assertGreater(crear["sentencias_max"], 0)
+        self.assertGreater(crear["filas_media"], 0)
+        self.assertGreater(crear["commit_ms_medio"], 0)
+        self.assertEqual(sum(crear["histograma"].values()), 1)
+        self.assertIn("FacturaService.facturar_mesa", metricas["operaciones"])
+        lenta = metricas["lentas"][-1]
+        self.assertEqual(lenta["operacion"], "FacturaService.facturar_mesa")
+        self.assertTrue(any("INSERT INTO facturas" in s["sql"] for s in lenta["sql"]))
+        self.assertEqual(len(lenta["sql"]), lenta["sentencias"])
+
+    def test_histograma_anidado_y_errores(self):
+        """Las mediciones anidadas suman a la externa; los errores se cuentan y se propagan."""
+        medidor = Instrumentacion(umbral_lento_ms=1000, max_lentas=2)
+        medidor.activar(self.engine)
+        with medidor.medir("externa"):
+            with medidor.medir("interna"):
+                self.repo.get_all(Mesa)
+            self.repo.get_all(Producto)
+        with self.assertRaises(ValueError), medidor.medir("externa"):
+            raise ValueError("falla")
+        operaciones = medidor.snapshot()["operaciones"]
+        self.assertEqual((operaciones["interna"]["sentencias_max"], operaciones["interna"]["filas_media"]), (1, 2))
+        self.assertEqual((operaciones["externa"]["sentencias_max"], operaciones["externa"]["filas_media"]), (2, 2))
+        self.assertEqual((operaciones["externa"]["llamadas"], operaciones["externa"]["errores"]), (2, 1))
+        self.assertLessEqual(operaciones["externa"]["p50_ms"], operaciones["externa"]["p99_ms"])
+        self.assertEqual(medidor.lentas(), [])
+        medidor.desactivar()
+        with medidor.medir("externa"):
+            self.repo.get_all(Mesa)
+        self.assertEqual(medidor.snapshot()["operaciones"]["externa"]["llamadas"], 2)
+
+    def test_filas_sin_tocar_el_cursor(self):
+        """Las filas se cuentan sobre el resultado: el cursor DBAPI queda intacto y yield_per no se cuenta."""
+        medidor = Instrumentacion()
+        medidor.activar(self.engine)
+        cursores = []
+        event.listen(self.engine, "after_cursor_execute", lambda conn, cursor, sql, params, context, muchos: cursores.append(
+            context.cursor is cursor))
+        try:
+            with medidor.medir("contar"):
+                self.repo.get_all(Mesa)
+                list(self.session.scalars(select(Producto).execution_options(yield_per=1)))
+        finally:
+            medidor.desactivar()
+        self.assertTrue(cursores and all(cursores))
+        self.assertEqual(medidor.snapshot()["operaciones"]["contar"]["filas_media"], 2)
+
+    def test_desactivar_quita_listeners(self):
+        """desactivar() suelta engines y listeners; un engine nuevo siempre se instrumenta."""
+        medidor = Instrumentacion()
+        medidor.activar(self.engine)
+        self.assertTrue(event.contains(self.engine, "before_cursor_execute", medidor._antes_de_sentencia))
+        medidor.desactivar()
+        self.assertFalse(event.contains(self.engine, "before_cursor_execute", medidor._antes_de_sentencia))
+        self.assertFalse(event.contains(Session, "after_commit", medidor._despues_de_commit))
+        self.assertFalse(event.contains(Session, "do_orm_execute", medidor._al_ejecutar_en_session))
+        for _ in range(3):
+            engine = crear_engine("sqlite://")
+            medidor.activar(engine)
+            self.assertTrue(event.contains(engine, "before_cursor_execute", medidor._antes_de_sentencia))
+            engine.dispose()
+            del engine
+        gc.collect()
+        self.assertEqual(len(medidor._engines), 0)
+        medidor.desactivar()
+
+class TestIndiceMesas(PruebaConBase):
+    """Pruebas del índice de mesas mantenido con el resumen de mesas y los eventos."""
+    num_mesas = 3
+
+    def setUp(self):
+        super().setUp()
+        self.bus = BusEventos()
+        self.pedidos = PedidoService(self.repo, bus=self.bus)
+
+    def test_ciclo_sin_consultas(self):
+        """Alta, avance y factura se reflejan en el índice y en la tabla sin releer la base."""
+        indice = IndiceMesas(sesiones=sessionmaker(bind=self.engine), bus=self.bus)
+        self.assertEqual(indice.libres(), [1, 2, 3])
+        uno = self.pedidos.crear_pedido(1, self.mesero_id, [(1, 2), (2, 1)])
+        dos = self.pedidos.crear_pedido(2, self.mesero_id, [(2, 1)])
+        self.pedidos.cambiar_estado(uno.id, "Finalizado")
+        self.pedidos.avanzar_detalles("Finalizado", pedido_id=dos.id)
+        with ContadorSQL(self.engine) as contador:
+            self.assertEqual((indice.libres(), indice.ocupadas()), ([3], [1, 2]))
+            self.assertEqual(indice.con_finalizados(), {1: 1, 2: 1})
+            self.assertEqual(indice.importe_abierto(1), 11.0 * 2 + 12.0)
+        self.assertEqual(contador.sentencias, 0)
+        FacturaService(self.repo, self.bus).facturar_mesa(1)
+        self.assertEqual(indice.con_finalizados(), {2: 1})
+        self.assertEqual(indice.resumen(1)[2:], ("Libre", 0, 0, 0.0))
+        self.session.expire_all()
+        mesa = self.repo.get_by_numero(Mesa, 2)
+        self.assertEqual((mesa._pedidos_abiertos, mesa._pedidos_finalizados, mesa._importe_abierto), (1, 1, 12.0))
+        self.assertEqual(IndiceMesas(self.repo, bus=self.bus).mesas(), indice.mesas())
+
+    def test_copias_con_el_bloqueo_tomado(self):
+        """Las consultas copian los conjuntos sin soltar el bloqueo que protege a _guardar."""
+        indice = IndiceMesas(sesiones=sessionmaker(bind=self.engine), bus=self.bus)
+        indice.libres()
+        sin_bloqueo = []
+
+        class ConjuntoVigilado(set):
+            def __iter__(self):
+                if not indice._bloqueo.locked():
+                    sin_bloqueo.append(sorted(set.__iter__(self)))
+                return set.__iter__(self)
+
+        indice._libres, indice._ocupadas = ConjuntoVigilado(indice._libres), ConjuntoVigilado(indice._ocupadas)
+        self.pedidos.crear_pedido(1, self.mesero_id, [(1, 1)])
+        self.assertEqual((indice.libres(), indice.ocupadas()), ([2, 3], [1]))
+        self.assertEqual(sin_bloqueo, [])
+        indice.cerrar()
+
+    def test_eventos_tardios_o_desordenados(self):
+        """Un evento que llega cuando su cambio ya se leyó, o después de uno más nuevo, no se vuelve a aplicar."""
+        anterior = IndiceMesas(sesiones=sessionmaker(bind=self.engine), bus=self.bus)
+        anterior.libres()
+        # Los servicios publican en otro bus: los eventos se retienen hasta después de la recarga
+        retenidos = BusEventos()
+        cola = retenidos.suscribir()
+        servicio = PedidoService(self.repo, bus=retenidos)
+        pedido = servicio.crear_pedido(1, self.mesero_id, [(1, 2)])
+        servicio.cambiar_estado(pedido.id, "Finalizado")
+        recargado = IndiceMesas(sesiones=sessionmaker(bind=self.engine), bus=self.bus)
+        recargado.libres()
+        self.bus.publicar(*reversed(cola.pendientes()))
+        for indice in (anterior, recargado):
+            self.assertEqual(indice.resumen(1)[2:], ("Ocupada", 1, 1, 22.0))
+            self.assertEqual(indice.con_finalizados(), {1: 1})
+
+    def test_pantallas_del_menu_ven_otras_terminales(self):
+        """Los pedidos de otro proceso no llegan por el bus, pero la pantalla de mesas los muestra."""
+        indice = IndiceMesas(self.repo, bus=self.bus)
+        self.assertEqual(indice.ocupadas(), [])
+        PedidoService(self.repo, bus=BusEventos()).crear_pedido(2, self.mesero_id, [(1, 1)])
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            ver_disponibilidad_mesas(indice)
+        self.assertIn("Mesa 2: Ocupada | Pedidos abiertos: 1 | S/. 11.00", salida.getvalue())
+        self.assertEqual(indice.ocupadas(), [2])
+
+    def test_recarga_y_migracion(self):
+        """Eventos perdidos o mesas nuevas fuerzan una recarga; la migración calcula el resumen."""
+        indice = IndiceMesas(self.repo, bus=self.bus)
+        self.assertEqual(len(indice.mesas()), 3)
+        self.repo.add(Mesa(_numero=4, _estado="Libre"))
+        self.pedidos.crear_pedido(4, self.mesero_id, [(1, 1)])
+        self.assertEqual(indice.ocupadas(), [4])
+        with self.engine.begin() as conexion:
+            conexion.exec_driver_sql("UPDATE mesas SET _pedidos_abiertos = 0, _importe_abierto = 0")
+            conexion.exec_driver_sql("UPDATE pedidos SET _importe = 0")
+        resumen_de_mesas(self.engine)
+        indice.recargar()
+        self.assertEqual(indice.resumen(4)[3:], (1, 0, 11.0))
+
+class TestSimuladorCarga(unittest.TestCase):
+    """Pruebas del simulador de carga con meseros y estaciones de cocina concurrentes."""
+    def test_simulacion_corta(self):
+        """Varios hilos toman, preparan y facturan pedidos sin errores y se informan percentiles."""
+        reporte = simular(meseros=3, estaciones=2, segundos=1.5, escala=0.005, semilla=7)
+        self.assertGreater(reporte["pedidos"], 0)
+        self.assertGreater(reporte["facturas"], 0)
+        self.assertEqual(sum(o["errores"] for o in reporte["operaciones"].values()), 0)
+        crear = reporte["operaciones"]["crear_pedido"]
+        self.assertLessEqual(crear["p50_ms"], crear["p95_ms"])
+        self.assertLessEqual(crear["p99_ms"], crear["max_ms"])
+
+    def test_conflictos_reintentables(self):
+        """Deadlocks y esperas agotadas se reintentan; otros errores de la base no."""
+        self.assertEqual(tipo_de_conflicto(OperationalError("x", {}, Exception(1213, "Deadlock found"))), "deadlock")
+        self.assertEqual(tipo_de_conflicto(OperationalError("x", {}, Exception("database is locked"))),
+                         "espera_agotada")
+        self.assertIsNone(tipo_de_conflicto(OperationalError("x", {}, Exception("no such table: mesas"))))
+
+class TestArchivoPedidos(PruebaConBase):
+    """Pruebas del archivo de pedidos facturados y de los reportes sobre ambas tablas."""
+    def crear_base(self):
+        return crear_base_historial(num_mesas=4, dias=3, pedidos_por_dia=5, items_por_pedido=2, num_productos=4)
+
+    def _contar(self, tabla):
+        with self.engine.connect() as conexion:
+            return conexion.execute(select(func.count()).select_from(tabla)).scalar()
+
+    def test_archiva_por_lotes_sin_cambiar_reportes(self):
+        """Solo queda el turno en curso; los reportes no cambian y los ids archivados no se reutilizan."""
+        abierto = PedidoService(self.repo).crear_pedido(1, self.mesero_id, [(1, 2)])
+        reporte = ReportePedidos(self.repo)
+        antes = (reporte.resumen_diario(), reporte.tiempos_preparacion())
+        self.assertEqual(sum(fila.pedidos for fila in antes[0]), 16)
+        self.assertEqual(archivar_pedidos(self.engine, timedelta(hours=1), tamano_lote=4), (15, 30))
+        self.assertEqual(archivar_pedidos(self.engine, timedelta(hours=1)), (0, 0))
+        self.session.expire_all()
+        self.assertEqual(sorted(p.id for p in self.repo.get_all(Pedido)), [abierto.id])
+        self.assertEqual((self._contar(pedidos_historico), self._contar(detalles_pedido_historico)), (15, 30))
+        self.assertEqual((reporte.resumen_diario(), reporte.tiempos_preparacion()), antes)
+        self.assertEqual(len(ReporteFacturacion(self.repo).resumen_diario()), 3)
+        nuevo = PedidoService(self.repo).crear_pedido(2, self.mesero_id, [(1, 1)])
+        self.assertGreater(nuevo.id, abierto.id)
+
+    def test_no_archiva_el_pedido_mas_nuevo(self):
+        """El último pedido queda en la tabla de trabajo aunque esté facturado."""
+        self.assertEqual(archivar_pedidos(self.engine, timedelta(hours=1), tamano_lote=4), (14, 28))
+        self.assertEqual([p.id for p in self.repo.get_all(Pedido)], [15])
+
+class TestLecturaEnReplica(unittest.TestCase):
+    """Pruebas del reparto de lecturas entre primario y réplica con dos bases SQLite."""
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        primario = os.path.join(self.directorio.name, "primario.db")
+        replica = os.path.join(self.directorio.name, "replica.db")
+        crear_base_benchmark(num_mesas=3, num_productos=2, url=f"sqlite:///{primario}").dispose()
+        shutil.copyfile(primario, replica)
+        self.engines = [crear_engine(f"sqlite:///{primario}"), crear_engine(f"sqlite:///{replica}")]
+        self.session, self.lectura = (sessionmaker(bind=engine)() for engine in self.engines)
+        self.mesero_id = Repository(self.session).get_by_codigo(Empleado, "B001").id
+
+    def tearDown(self):
+        self.session.close()
+        self.lectura.close()
+        for engine in self.engines:
+            engine.dispose()
+        self.directorio.cleanup()
+
+    def test_listados_y_reportes_en_replica(self):
+        """Cola y reportes leen la réplica; las escrituras y leer_del_primario van al primario."""
+        PedidoService(Repository(self.session)).crear_pedido(1, self.mesero_id, [(1, 2)])
+        repo = Repository(self.session, self.lectura, ventana_propia=0)
+        self.assertEqual(repo.get_cola_pedidos(), [])
+        self.assertEqual(ReportePedidos(repo).resumen_diario(), [])
+        with repo.leer_del_primario():
+            self.assertEqual(len(repo.get_cola_pedidos()), 1)
+        self.assertEqual(repo.get_by_numero(Mesa, 1).estado, "Ocupada")
+        self.assertEqual([m.estado for m in repo.get_all(Mesa)], ["Libre"] * 3)
+
+    def test_lee_lo_propio_tras_escribir(self):
+        """Tras un commit propio, o con cambios pendientes, las lecturas siguen en el primario."""
+        repo = Repository(self.session, self.lectura)
+        self.assertIs(repo.session_lectura, self.lectura)
+        pedido = PedidoService(repo).crear_pedido(1, self.mesero_id, [(1, 2)])
+        self.assertEqual([p.id for p in repo.get_cola_pedidos()], [pedido.id])
+        repo.ventana_propia = 0
+        self.assertIs(repo.session_lectura, self.lectura)
+        self.session.add(Mesa(_numero=9, _estado="Libre"))
+        self.assertIs(repo.session_lectura, self.session)
+
+    def test_terminar_lectura_cierra_la_transaccion_de_la_replica(self):
+        """terminar_lectura() deja la réplica sin transacción abierta para que la siguiente lectura vea datos nuevos."""
+        repo = Repository(self.session, self.lectura, ventana_propia=0)
+        repo.get_cola_pedidos()
+        self.assertTrue(self.lectura.in_transaction())
+        repo.terminar_lectura()
+        self.assertFalse(self.lectura.in_transaction())
+        Repository(self.session).terminar_lectura()
+
+class TestConsultasPorFlujo(PruebaConBase):
+    """Pruebas de las consultas por flujo, por páginas y con proyección del repositorio."""
+    num_mesas = 7
+    num_productos = 3
+
+    def test_iter_all_filtra_y_proyecta_en_sql(self):
+        """iter_all filtra en la base y devuelve entidades o solo las columnas pedidas."""
+        self.repo.get_by_numero(Mesa, 2)._estado = "Ocupada"
+        self.repo.update(None)
+        libres = self.repo.iter_all(Mesa, Mesa._numero > 3, tamano_lote=2, _estado="Libre")
+        self.assertEqual([m.numero for m in libres], [4, 5, 6, 7])
+        filas = list(self.repo.iter_all(Mesa, columnas=(Mesa._numero, Mesa._estado), orden=Mesa._numero.desc()))
+        self.assertEqual(filas[-2:], [(2, "Ocupada"), (1, "Libre")])
+        self.assertEqual(list(self.repo.iter_all(Producto, Producto._precio > 100)), [])
+
+    def test_paginas_por_clave_y_detalles_cambiables(self):
+        """get_pagina continúa desde el último id; la pantalla de detalles recibe solo lo que imprime."""
+        primera = self.repo.get_pagina(Mesa, limite=3, columnas=(Mesa.id,))
+        segunda = self.repo.get_pagina(Mesa, despues_de_id=primera[-1].id, limite=10)
+        self.assertEqual([f.id for f in primera] + [m.id for m in segunda], list(range(1, 8)))
+        mesero_id = self.repo.get_by_codigo(Empleado, "B001").id
+        pedido = PedidoService(self.repo).crear_pedido(3, mesero_id, [(1, 2), (2, 1)])
+        PedidoService(self.repo).cambiar_estado_detalle(pedido.detalles[1].id, "En preparación")
+        detalles = self.repo.get_detalles_cambiables([EstadoPedido.PEDIDO_REALIZADO])
+        self.assertEqual([(d.pedido_id, d.mesa, d.producto, d.cantidad, d.estado) for d in detalles],
+                         [(pedido.id, 3, "Producto 1", 2, EstadoPedido.PEDIDO_REALIZADO)])
+
+class TestModelosLectura(PruebaConBase):
+    """Pruebas de los modelos de lectura de la cola."""
+    num_mesas = 3
+    num_productos = 3
+
+    def setUp(self):
+        super().setUp()
+        self.service = PedidoService(self.repo)
+        self.pedidos = [self.service.crear_pedido(n, self.mesero_id, [(1, 3), (n, 1)]) for n in (1, 2, 3)]
+
+    def test_cola_igual_que_con_entidades(self):
+        """Misma página, filtros y datos que get_cola_pedidos, en dos consultas y sin entidades."""
+        self.service.cambiar_estado_detalle(self.pedidos[0].detalles[0].id, "En preparación", unidades=2)
+        primero = self.pedidos[0].id
+        self.session.expire_all()
+        with ContadorSQL(self.engine) as contador:
+            lectura = self.repo.get_cola_lectura(despues_de_id=primero - 1, limite=2)
+        self.assertEqual(contador.sentencias, 2)
+        entidades = self.repo.get_cola_pedidos(despues_de_id=primero - 1, limite=2)
+        self.assertEqual([(p.id, p.mesa, p.mesero, p.estado) for p in lectura],
+                         [(p.id, p.mesa.numero, p.mesero.nombre, p.estado) for p in entidades])
+        self.assertEqual([[(d.producto, d.cantidad, d.estado, d.unidades_por_estado()) for d in p.detalles]
+                          for p in lectura],
+                         [[(d.producto.nombre, d.cantidad, d.estado, d.unidades_por_estado()) for d in p.detalles]
+                          for p in entidades])
+        self.assertFalse(hasattr(lectura[0].detalles[0], "__dict__"))
+        self.assertEqual([p.id for p in self.repo.get_cola_lectura(mesa_numero=3)], [self.pedidos[2].id])
+        self.assertEqual(self.repo.get_cola_lectura(estados=[EstadoPedido.ENTREGADO]), [])
+
+    def test_benchmark_lecturas(self):
+        """El benchmark compara entidades y modelos de lectura por cada 10 000 filas."""
+        resultados = benchmark_lecturas(filas=40, repeticiones=1)
+        self.assertEqual([r["consulta"] for r in resultados], ["cola_pedidos", "detalles"])
+        self.assertTrue(all(r["kb_lectura"] < r["kb_orm"] for r in resultados))
+
+class TestPlanificadorCocina(unittest.TestCase):
+    """Pruebas del planificador de estaciones de cocina."""
+    def setUp(self):
+        self.engine = crear_engine("sqlite://")
+        crear_esquema(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.repo = Repository(self.session)
+        self.repo.add(Empleado(_codigo="M001", _nombre="Mesero", _rol="Mesero", _clave="1234"))
+        for i in range(1, 5):
+            self.repo.add(Mesa(_numero=i, _estado="Libre"))
+        for nombre, categoria in (("Margarita", "Pizzas Clásicas"), ("Lasagna", "Lasagnas"),
+                                  ("Lomo", "Al Fuego"), ("Tiramisú", "Postres")):
+            self.repo.add(Producto(_nombre=nombre, _categoria=categoria, _precio=20.0))
+        self.service = PedidoService(self.repo)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_tiempos_aprendidos_y_lotes(self):
+        """Media por producto, por categoría o por defecto; lotes por producto en orden de prioridad."""
+        tiempos = TiemposPreparacion({1: "Pizzas", 2: "Pizzas", 3: "Pastas"}, [(1, 5, 10.0), (2, 1, 30.0)])
+        self.assertEqual(tiempos.minutos(1), 10.0)
+        self.assertAlmostEqual(tiempos.minutos(2), (50.0 + 30.0) / 6)
+        self.assertEqual(tiempos.minutos(3), MINUTOS_POR_DEFECTO)
+        self.assertAlmostEqual(tiempos.minutos(1, unidades=3), 10.0 * (1 + 2 * FACTOR_UNIDAD_EXTRA))
+        pendientes = [Pendiente(1, 1, 3, 1, 9.0), Pendiente(2, 1, 1, 4, 2.0),
+                      Pendiente(3, 2, 1, 2, 1.0), Pendiente(4, 3, 1, 1, 0.0)]
+        lotes = armar_lotes(pendientes, tiempos, max_unidades=6)
+        self.assertEqual([(l.producto_id, l.detalle_ids, l.unidades) for l in lotes],
+                         [(3, (1,), 1), (1, (2, 3), 6), (1, (4,), 1)])
+        self.assertEqual(lotes[1].pedido_ids, (1, 2))
+
+    def test_cola_por_estacion_y_avance_del_lote(self):
+        """Las pizzas iguales de varios pedidos forman un lote del horno que avanza en un solo paso."""
+        for mesa, lineas in ((1, [(1, 2), (3, 1)]), (2, [(2, 1), (1, 1)]), (3, [(4, 1)])):
+            self.service.crear_pedido(mesa, 1, lineas)
+        planificador = PlanificadorCocina(self.repo)
+        self.assertEqual(planificador.estaciones_de_rol("Bartender"), ["Barra"])
+        self.assertEqual(planificador.estacion_de("Categoría nueva"), "Cocina caliente")
+        lotes = planificador.cola("Horno")
+        self.assertEqual(sorted((l.producto_id, l.unidades, l.pedido_ids) for l in lotes),
+                         [(1, 3, (1, 2)), (2, 1, (2,))])
+        self.assertEqual([l.producto_id for l in planificador.cola("Parrilla")], [3])
+        lote = planificador.siguiente("Horno")
+        self.assertEqual(planificador.tomar(lote, self.service), len(lote.detalle_ids))
+        self.assertNotIn(lote.producto_id, [l.producto_id for l in planificador.cola("Horno")])
+        self.assertEqual(planificador.entregar(lote, self.service), len(lote.detalle_ids))
+        self.session.expire_all()
+        self.assertEqual({self.repo.get(DetallePedido, i).estado for i in lote.detalle_ids}, {EstadoPedido.ENTREGADO})
+
+    def test_simulacion_contra_fifo(self):
+        """Con la misma carga, el planificador baja el ticket medio y el p95 respecto de FIFO."""
+        fifo, planificador = comparar_politicas(semillas=(1, 2), pedidos=200)
+        self.assertEqual((fifo["politica"], planificador["politica"]), ("fifo", "planificador"))
+        self.assertLess(planificador["ticket_medio"], fifo["ticket_medio"])
+        self.assertLess(planificador["p95"], fifo["p95"])
+
+class TestAnaliticaTiempos(PruebaConBase):
+    """Pruebas de los percentiles por histograma y de la caché de días cerrados."""
+    def crear_base(self):
+        return crear_base_historial(num_mesas=4, dias=4, pedidos_por_dia=10, items_por_pedido=3, num_productos=4)
+
+    def setUp(self):
+        super().setUp()
+        self.analitica = AnaliticaTiempos(self.repo)
+        self.desde = date.today() - timedelta(days=6)
+
+    def test_tiempos_de_servicio(self):
+        """Preparación, entrega, finalización y factura con los tiempos fijos del historial."""
+        tablero = self.analitica.tablero(self.desde)
+        esperados = {"preparacion": 15.0, "entrega": 20.0, "finalizacion": 40.0, "facturacion": 45.0}
+        for metrica, minutos in esperados.items():
+            fila = tablero[metrica]["total"]["total"]
+            self.assertEqual((fila["p50"], fila["p99"], fila["medio"]), (minutos, minutos, minutos))
+        self.assertEqual(tablero["preparacion"]["total"]["total"]["n"], 120)
+        self.assertEqual(tablero["facturacion"]["total"]["total"]["n"], 40)
+        self.assertEqual(sum(f["n"] for f in tablero["preparacion"]["producto"].values()), 120)
+        self.assertEqual(set(tablero["entrega"]["hora"]), set(range(12, 22)))
+        ventana = self.analitica.ventana_movil("preparacion", dias=2, desde=self.desde)
+        self.assertEqual([n for _, n, _, _ in ventana][-3:], [60, 60, 30])
+
+    def test_percentiles_aproximan_los_exactos(self):
+        """Con duraciones variadas, cada percentil queda a menos de un intervalo del exacto."""
+        rng = np.random.default_rng(7)
+        duraciones = rng.gamma(3.0, 5.0, size=120).round(2)
+        ids = self.session.scalars(select(DetallePedido.id).order_by(DetallePedido.id)).all()
+        self.session.execute(update(DetallePedido),
+                             [{"id": i, "_duracion_preparacion": float(d)} for i, d in zip(ids, duraciones)])
+        self.session.commit()
+        fila = self.analitica.percentiles("preparacion", desde=self.desde)["total"]
+        for p in (50, 90, 99):
+            exacto = np.percentile(duraciones, p, method="inverted_cdf")
+            self.assertGreaterEqual(fila[f"p{p}"], exacto)
+            self.assertLess(fila[f"p{p}"] - exacto, ANCHO_INTERVALO)
+        self.assertAlmostEqual(fila["medio"], duraciones.mean())
+        self.assertEqual(fila["max"], duraciones.max())
+
+    def test_dias_cerrados_en_cache(self):
+        """Repetir el tablero de días cerrados no consulta la base; invalidar vuelve a leerlos."""
+        hasta = date.today() - timedelta(days=2)
+        primero = self.analitica.tablero(self.desde, hasta)
+        with ContadorSQL(self.engine) as contador:
+            self.assertEqual(self.analitica.tablero(self.desde, hasta), primero)
+        self.assertEqual(contador.sentencias, 0)
+        self.analitica.invalidar()
+        with ContadorSQL(self.engine) as contador:
+            self.analitica.tablero(self.desde, hasta)
+        self.assertEqual(contador.sentencias, 2)
+
+
 if __name__ == '__main__':
     unittest.main()